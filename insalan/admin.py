@@ -4,6 +4,10 @@ from typing import Any
 
 from django.contrib import admin
 from django.http import HttpRequest
+from django.utils.translation import gettext_lazy as _
+from unfold.admin import ModelAdmin  # type: ignore
+
+from .models import JobMetrics, OutboxMail
 
 
 ADMIN_ORDERING: list[tuple[str, list[str]]] = []
@@ -37,3 +41,45 @@ def get_app_list(self: admin.AdminSite, request: HttpRequest, app_label: None =
 
 
 admin.AdminSite.get_app_list = get_app_list  # type: ignore[method-assign]
+
+
+class OutboxMailAdmin(ModelAdmin):  # type: ignore
+    """
+    Read-only view of the mail outbox
+    """
+    list_display = ("subject", "mailer", "status", "attempts", "scheduled_at", "sent_at")
+    list_filter = ("status", "mailer")
+    search_fields = ("subject", "to")
+    readonly_fields = [field.name for field in OutboxMail._meta.fields]
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(self, request: HttpRequest, obj: OutboxMail | None = None) -> bool:
+        return False
+
+
+admin.site.register(OutboxMail, OutboxMailAdmin)
+
+
+class JobMetricsAdmin(ModelAdmin):  # type: ignore
+    """
+    Read-only view of the metrics of the periodic jobs
+    """
+    list_display = ("name", "runs", "failures", "mean_duration", "last_duration",
+                    "last_started_at", "last_success_at")
+    readonly_fields = [field.name for field in JobMetrics._meta.fields]
+
+    @admin.display(description=_("Durée moyenne (s)"))
+    def mean_duration(self, obj: JobMetrics) -> str:
+        """Mean duration of the runs of the job"""
+        return f"{obj.mean_duration:.3f}"
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(self, request: HttpRequest, obj: JobMetrics | None = None) -> bool:
+        return False
+
+
+admin.site.register(JobMetrics, JobMetricsAdmin)
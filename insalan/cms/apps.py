@@ -2,6 +2,7 @@
 Module for managing the CMS application.
 """
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -12,3 +13,21 @@ class CmsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     verbose_name = _("Module de gestion de contenu")
     name = "insalan.cms"
+
+    def ready(self) -> None:
+        """Invalidate the rendered contents whenever the CMS is modified"""
+        # pylint: disable-next=import-outside-toplevel
+        from .rendering import invalidate_rendered_contents
+
+        for model_name in ("Content", "Constant", "File"):
+            model = self.get_model(model_name)
+            post_save.connect(
+                invalidate_rendered_contents,
+                sender=model,
+                dispatch_uid=f"cms-render-save-{model_name}",
+            )
+            post_delete.connect(
+                invalidate_rendered_contents,
+                sender=model,
+                dispatch_uid=f"cms-render-delete-{model_name}",
+            )
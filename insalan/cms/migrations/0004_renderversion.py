@@ -0,0 +1,24 @@
+# Generated by Django 4.1.12 on 2026-10-19 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0003_file_remove_content_planning_alter_constant_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Version')),
+            ],
+            options={
+                'verbose_name': 'Version du rendu',
+                'verbose_name_plural': 'Versions du rendu',
+            },
+        ),
+    ]
@@ -4,58 +4,62 @@ This module contains the models for the CMS (Content Management System) of the I
 The models include:
 - Content: Represents markdown content to be placed on website pages.
 - Constant: Stores constant values used on the InsaLan website.
+- RenderVersion: Counts the modifications of the CMS, for the rendered contents.
 """
 
 import re
+from collections.abc import Iterable
 
 from djongo import models  # type: ignore[import]
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 
-def constant_definition_validator(content: str) -> None:
+# References to a constant, ${name}, and to a file, $[name], in a content
+CONSTANT_REFERENCE = re.compile(r"\${(?P<name>[^{}]*)}")
+FILE_REFERENCE = re.compile(r"\$\[(?P<name>[^\[\]]*)\]")
+
+def validate_contents(contents: Iterable[str]) -> None:
     """
-    Validator to ensure that any used constant in content is defined.
+    Validator to ensure that the constants and files used by many contents are
+    defined, e.g. when importing them.
+
+    Only the referenced names are looked up, with a single query per model.
     """
-    # validate that all constants used in the content are defined
-    regex = re.compile(r"\${(?P<name>[^{}]*)}")
-    constant_list = set(
-        re.findall(regex, content)
-    )  # get the constant names in the content
-    p_constants = set(
-        constant.name for constant in Constant.objects.all()
-    )  # retrieve every constant names
-
-    excess_constants = constant_list - p_constants.intersection(
-        constant_list
-    )  # Get the constants in the content but not defined
-
-    if len(excess_constants) > 0:
-        raise ValidationError(
-            _(
-                f"Des constantes non définies sont utilisées: {', '.join(sorted(excess_constants))}"
-            )
+    constant_list: set[str] = set()
+    file_list: set[str] = set()
+    for content in contents:
+        constant_list.update(CONSTANT_REFERENCE.findall(content))
+        file_list.update(FILE_REFERENCE.findall(content))
+
+    if constant_list:
+        # Get the constants in the content but not defined
+        excess_constants = constant_list - set(
+            Constant.objects.filter(name__in=constant_list).values_list("name", flat=True)
         )
-
-    # validate that all files used in the content are defined
-    regex = re.compile(r"\$\[(?P<name>[^\[\]]*)\]")
-    file_list = set(
-        re.findall(regex, content)
-    )  # get the file names in the content
-    p_files = set(
-        file.name for file in File.objects.all()
-    )  # retrieve every file names
-
-    excess_files = file_list - p_files.intersection(
-        file_list
-    )  # Get the files in the content but not defined
-
-    if len(excess_files) > 0:
-        raise ValidationError(
-            _(
-                f"Des fichiers non définis sont utilisés: {', '.join(sorted(excess_files))}"
+        if excess_constants:
+            names = ", ".join(sorted(excess_constants))
+            raise ValidationError(
+                _(f"Des constantes non définies sont utilisées: {names}")
             )
+
+    if file_list:
+        # Get the files in the content but not defined
+        excess_files = file_list - set(
+            File.objects.filter(name__in=file_list).values_list("name", flat=True)
         )
+        if excess_files:
+            names = ", ".join(sorted(excess_files))
+            raise ValidationError(
+                _(f"Des fichiers non définis sont utilisés: {names}")
+            )
+
+
+def constant_definition_validator(content: str) -> None:
+    """
+    Validator to ensure that any used constant in content is defined.
+    """
+    validate_contents([content])
 
 
 # Ignore type error because djongo doesn't have types stubs.
@@ -143,3 +147,24 @@ class File(models.Model):  # type: ignore[misc]
 
     def __str__(self) -> str:
         return f"[File] {self.name}"
+
+
+# Ignore type error because djongo doesn't have types stubs.
+class RenderVersion(models.Model):  # type: ignore[misc]
+    """
+    Version of the CMS, incremented on every modification of a content,
+    constant or file, so that every worker knows when to render the contents
+    again. The table has a single row.
+    """
+
+    version = models.BigIntegerField(default=0, verbose_name=_("Version"))
+
+    class Meta:
+        """
+        Meta class for the RenderVersion model.
+        """
+        verbose_name = _("Version du rendu")
+        verbose_name_plural = _("Versions du rendu")
+
+    def __str__(self) -> str:
+        return f"[RenderVersion] {self.version}"
@@ -0,0 +1,106 @@
+"""
+Server-side rendering of the CMS contents
+
+The constants and files referenced by the contents are resolved once, and the
+rendered contents are kept in memory until the CMS changes. Every save or
+deletion of a content, constant or file bumps a version shared by the workers
+through the database (the Django cache is local to each process): each worker
+checks it at most every CMS_RENDER_VERSION_TTL seconds, and renders the
+contents again when it moved, so that page loads do not query the database in
+the common case.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from typing import Any
+
+from django.db.models import F
+
+from insalan import settings as app_settings
+
+from .models import CONSTANT_REFERENCE, FILE_REFERENCE, Constant, Content, File, RenderVersion
+
+# Primary key of the single row of the version
+VERSION_ID = 1
+
+_lock = threading.Lock()
+# Version last read from the database, and when it was read
+_version: int | None = None
+_version_checked_at: float = 0.0
+# Rendered contents of the current version, per language and site
+_rendered: dict[tuple[int, str, str], dict[str, str]] = {}
+
+
+def current_version() -> int:
+    """Version of the CMS, read from the database at most every few seconds"""
+    global _version, _version_checked_at  # pylint: disable=global-statement
+    now = time.monotonic()
+    with _lock:
+        fresh = now - _version_checked_at < app_settings.CMS_RENDER_VERSION_TTL
+        if _version is not None and fresh:
+            return _version
+    version = RenderVersion.objects.filter(id=VERSION_ID).values_list(
+        "version", flat=True
+    ).first()
+    with _lock:
+        _version = version or 0
+        _version_checked_at = now
+        return _version
+
+
+def bump_version() -> None:
+    """Invalidate the rendered contents of every worker"""
+    global _version  # pylint: disable=global-statement
+    if not RenderVersion.objects.filter(id=VERSION_ID).update(version=F("version") + 1):
+        RenderVersion.objects.get_or_create(id=VERSION_ID)
+        RenderVersion.objects.filter(id=VERSION_ID).update(version=F("version") + 1)
+    with _lock:
+        # Read the new version on the next render of this worker
+        _version = None
+        _rendered.clear()
+
+
+def invalidate_rendered_contents(**kwargs: Any) -> None:  # pylint: disable=unused-argument
+    """Signal receiver bumping the version when the CMS is modified"""
+    bump_version()
+
+
+def render_contents(base_url: str, language: str) -> dict[str, str]:
+    """
+    Return every content by name, with its constants replaced by their value
+    and its files by their absolute URL on `base_url`
+
+    Unknown references are left as they are.
+    """
+    version = current_version()
+    key = (version, language, base_url)
+    with _lock:
+        rendered = _rendered.get(key)
+    if rendered is not None:
+        return rendered
+
+    constants = dict(Constant.objects.values_list("name", "value"))
+    files = {
+        file.name: base_url + file.file.url
+        for file in File.objects.only("name", "file")
+    }
+
+    def constant_value(match: re.Match[str]) -> str:
+        return str(constants.get(match["name"], match[0]))
+
+    def file_url(match: re.Match[str]) -> str:
+        return str(files.get(match["name"], match[0]))
+
+    rendered = {
+        name: FILE_REFERENCE.sub(file_url, CONSTANT_REFERENCE.sub(constant_value, content))
+        for name, content in Content.objects.values_list("name", "content")
+    }
+    with _lock:
+        # Contents of older versions are never served again
+        for stale in [stale for stale in _rendered if stale[0] != version]:
+            del _rendered[stale]
+        _rendered[key] = rendered
+    return rendered
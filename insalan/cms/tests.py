@@ -7,6 +7,9 @@ The test cases cover the following models:
 
 Each test case verifies the functionality and behavior of the respective model.
 """
+
+from unittest.mock import patch
+
 from django.db.utils import IntegrityError
 from django.test import TestCase
 from django.core.exceptions import ValidationError
@@ -15,8 +18,17 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework.test import APITestCase
 from rest_framework import status
 
+from insalan import settings as app_settings
+from insalan.cms import rendering
 from insalan.cms.serializers import FileSerializer
-from insalan.cms.models import Constant, Content, File
+from insalan.cms.models import (
+    Constant,
+    Content,
+    File,
+    constant_definition_validator,
+    validate_contents,
+)
+from insalan.cms.rendering import bump_version
 
 
 class ContentTestCase(TestCase):
@@ -53,6 +65,29 @@ class ContentTestCase(TestCase):
             str(_("Des constantes non définies sont utilisées: inconnue, random")),
         )
 
+    def test_validator_queries(self) -> None:
+        """Test that only the referenced constants and files are looked up"""
+        Constant.objects.create(name="a", value="je suis la valeur a")
+        File.objects.create(name="f", file="test_file.txt")
+        with self.assertNumQueries(0):
+            constant_definition_validator("pas de constante")
+        with self.assertNumQueries(2):
+            constant_definition_validator("${a} ${a} $[f]")
+        with self.assertRaisesMessage(
+            ValidationError, "Des fichiers non définis sont utilisés: g"
+        ):
+            constant_definition_validator("${a} $[g]")
+
+    def test_validate_contents(self) -> None:
+        """Test that many contents are validated together"""
+        Constant.objects.create(name="a", value="je suis la valeur a")
+        with self.assertNumQueries(1):
+            validate_contents(["${a}", "encore ${a}", "rien"])
+        with self.assertRaisesMessage(
+            ValidationError, "Des constantes non définies sont utilisées: b, c"
+        ):
+            validate_contents(["${a} ${c}", "${b}"])
+
     def test_create_two_contents_with_same_name(self) -> None:
         """Test that the name unicity of a content is checked"""
         with self.assertRaises(IntegrityError):
@@ -149,3 +184,75 @@ class FullListTestCase(APITestCase):
         self.assertEqual(response.data["constants"][0]["name"], self.constant.name)
         self.assertEqual(response.data["contents"][0]["name"], self.content.name)
         self.assertEqual(response.data["files"][0]["name"], self.file.name)
+
+
+class RenderedContentTestCase(APITestCase):
+    """Tests of the contents rendered by the server"""
+
+    def setUp(self) -> None:
+        # Drop what previous tests rendered before their rollback
+        bump_version()
+        Constant.objects.create(name="date", value="1er avril")
+        File.objects.create(name="plan", file="files/plan.pdf")
+        Content.objects.create(name="accueil", content="Le ${date}, voir $[plan]")
+
+    def test_rendered(self) -> None:
+        """Test that constants and files are resolved"""
+        response = self.client.get(reverse("rendered/list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{
+            "name": "accueil",
+            "content": "Le 1er avril, voir http://testserver/v1/media/files/plan.pdf",
+        }])
+
+        response = self.client.get(reverse("rendered/name", kwargs={"name": "accueil"}))
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get(reverse("rendered/name", kwargs={"name": "inconnu"}))
+        self.assertEqual(response.data, [])
+
+    def test_cached(self) -> None:
+        """Test that rendered contents are served without any query"""
+        self.client.get(reverse("rendered/list"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("rendered/list"))
+            self.client.get(reverse("rendered/name", kwargs={"name": "accueil"}))
+
+    def test_invalidated(self) -> None:
+        """Test that saving or deleting a CMS object renders the contents again"""
+        self.client.get(reverse("rendered/list"))
+
+        constant = Constant.objects.get(name="date")
+        constant.value = "2 avril"
+        constant.save()
+        response = self.client.get(reverse("rendered/name", kwargs={"name": "accueil"}))
+        self.assertTrue(response.data[0]["content"].startswith("Le 2 avril"))
+
+        Content.objects.create(name="infos", content="Infos")
+        response = self.client.get(reverse("rendered/list"))
+        self.assertEqual(len(response.data), 2)
+
+        File.objects.get(name="plan").delete()
+        response = self.client.get(reverse("rendered/name", kwargs={"name": "accueil"}))
+        self.assertEqual(response.data[0]["content"], "Le 2 avril, voir $[plan]")
+
+    def test_invalidated_in_other_workers(self) -> None:
+        """Test that a worker sees the modifications made by another one"""
+        # pylint: disable=protected-access
+        self.client.get(reverse("rendered/list"))
+        # State of this worker, which another one does not share
+        state = (rendering._version, rendering._version_checked_at, dict(rendering._rendered))
+
+        constant = Constant.objects.get(name="date")
+        constant.value = "2 avril"
+        constant.save()
+        with rendering._lock:
+            rendering._version, rendering._version_checked_at = state[:2]
+            rendering._rendered.clear()
+            rendering._rendered.update(state[2])
+
+        # The version is only read again after a few seconds
+        response = self.client.get(reverse("rendered/name", kwargs={"name": "accueil"}))
+        self.assertTrue(response.data[0]["content"].startswith("Le 1er avril"))
+        with patch.object(app_settings, "CMS_RENDER_VERSION_TTL", 0):
+            response = self.client.get(reverse("rendered/name", kwargs={"name": "accueil"}))
+        self.assertTrue(response.data[0]["content"].startswith("Le 2 avril"))
@@ -8,6 +8,8 @@ URL Patterns:
 - constant/<str:name> : Fetch a specific constant by name
 - content/ : List all content
 - content/<str:section>/ : Fetch content for a specific section
+- rendered/ : List all content, with constants and files resolved
+- rendered/<str:name>/ : Fetch a specific content, with constants and files resolved
 """
 from django.urls import path
 from . import views
@@ -20,6 +22,10 @@ urlpatterns = [
     path(
         "content/<str:name>/", views.ContentFetch.as_view(), name="content/section"
     ),
+    path("rendered/", views.RenderedContentList.as_view(), name="rendered/list"),
+    path(
+        "rendered/<str:name>/", views.RenderedContentFetch.as_view(), name="rendered/name"
+    ),
     path("file/", views.FileList.as_view(), name="file/list"),
     path("file/<str:name>/", views.FileFetch.as_view(), name="file/name"),
 ]
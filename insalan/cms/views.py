@@ -6,6 +6,7 @@ of the Insalan website.
 from typing import Any
 
 from django.db.models.query import QuerySet
+from django.utils.translation import get_language
 
 from rest_framework import generics
 from rest_framework.request import Request
@@ -15,6 +16,7 @@ from rest_framework.views import APIView
 from insalan.cms import serializers
 
 from .models import Constant, Content, File
+from .rendering import render_contents
 
 
 class ContentList(generics.ListAPIView[Content]):  # pylint: disable=unsubscriptable-object
@@ -98,3 +100,28 @@ class FullList(APIView):
             "contents": content_serializer.data,
             "files": files_serializer.data
         })
+
+
+class RenderedContentList(APIView):
+    """
+    Get all contents, with their constants and files resolved
+
+    The rendered contents are cached until the CMS is modified.
+    """
+
+    def get(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        rendered = render_contents(request.build_absolute_uri("/")[:-1], get_language())
+        return Response([
+            {"name": name, "content": content} for name, content in rendered.items()
+        ])
+
+
+class RenderedContentFetch(APIView):
+    """Get a content, with its constants and files resolved"""
+
+    def get(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        rendered = render_contents(request.build_absolute_uri("/")[:-1], get_language())
+        name = kwargs["name"]
+        if name not in rendered:
+            return Response([])
+        return Response([{"name": name, "content": rendered[name]}])
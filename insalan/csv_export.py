@@ -0,0 +1,46 @@
+"""
+CSV exports of the admin
+
+The rows are read from the database one chunk of the queryset at a time and
+written right away to a temporary file, so that exporting every payment of a
+season keeps neither its model instances nor its CSV text in memory. The file
+is then sent by blocks.
+Fields are separated by ";", like every export the staff open in a
+spreadsheet.
+
+The file is written before the response is returned: under ASGI, Django 4.1
+iterates streaming responses on the event loop, where the database cannot be
+queried.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import tempfile
+from collections.abc import Iterable
+from typing import Any
+
+from django.http import FileResponse
+
+# Rows read from the database at once
+EXPORT_CHUNK_SIZE = 500
+
+
+def stream_csv(
+    filename: str, header: Iterable[Any], rows: Iterable[Iterable[Any]]
+) -> FileResponse:
+    """Send `rows` as a CSV attachment, after their `header`"""
+    # pylint: disable-next=consider-using-with
+    file = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    writer = csv.writer(text, delimiter=";", lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(rows)
+    # The response closes the file once it is sent
+    text.detach()
+    file.seek(0)
+
+    response = FileResponse(file, content_type="text/csv")
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
@@ -1,25 +1,38 @@
+import logging
 import sys
-from typing import cast
+from datetime import timedelta
+from email.mime.base import MIMEBase
+from typing import Iterable, cast
 
 import django_stubs_ext
 
 from django.contrib.auth.models import Permission
 from django.core.files import File
 from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
 from django.contrib.auth.tokens import (
     PasswordResetTokenGenerator,
     default_token_generator,
 )
+from django.db import transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from insalan import settings
+from insalan.models import OutboxMail
+from insalan.ratelimit import TokenBucket
 from insalan.user.models import User
 from insalan.tickets.models import Ticket, TicketManager
-from insalan.scheduler import scheduler
+from insalan.scheduler import register_job
 
 
 django_stubs_ext.monkeypatch(extra_classes=[File])
 
+logger = logging.getLogger(__name__)
+
+# Number of outbox rows inserted per query when mass mailing
+MASS_MAIL_BATCH_SIZE = 500
+
 
 class EmailConfirmationTokenGenerator(PasswordResetTokenGenerator):
     """
@@ -38,15 +51,21 @@ class UserMailer:
     """
     Send emails.
     """
+    # pylint: disable-next=too-many-arguments
     def __init__(self, mail_host: str, mail_port: str, mail_from: str, mail_pass: str,
-                 mail_ssl: bool, test: bool = False) -> None:
+                 mail_ssl: bool, test: bool = False, rate: float | None = None,
+                 batch_size: int | None = None) -> None:
         self.mail_host = mail_host
         self.mail_port = mail_port
         self.mail_ssl = mail_ssl
         self.mail_from = mail_from
         self.mail_pass = mail_pass
         self.test = test
-        self.queue: list[EmailMessage] = []
+        # The provider rate limit is given in mails per minute
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.rate_limit = TokenBucket(
+            (rate or settings.EMAIL_RATE_LIMIT) / 60, self.batch_size
+        )
 
     def send_email_confirmation(self, user_object: User) -> None:
         """
@@ -59,26 +78,14 @@ class UserMailer:
         token = EmailConfirmationTokenGenerator().make_token(user_object)
         user = user_object.pk
 
-        connection = get_connection(
-            host=self.mail_host,
-            port=self.mail_port,
-            password=self.mail_pass,
-            fail_silently=False,
-            use_ssl=self.mail_ssl,
-            username=self.mail_from,
-        )
         email = EmailMessage(
             settings.EMAIL_SUBJECT_PREFIX + _("Confirmez votre courriel"),
             _("Confirmez votre adresse de courriel en cliquant sur ") +
             f"{settings.PROTOCOL}://{settings.WEBSITE_HOST}/verification/{user}/{token}/",
             self.mail_from,
             [user_object.email],
-            connection=connection,
         )
-        if self.test:
-            email.send()
-        else:
-            self.queue.append(email)
+        self.dispatch(email)
 
     def send_password_reset(self, user_object: User) -> None:
         """
@@ -87,14 +94,6 @@ class UserMailer:
         token = default_token_generator.make_token(user_object)
         user = user_object.pk
 
-        connection = get_connection(
-            fail_silently=False,
-            username=self.mail_from,
-            password=self.mail_pass,
-            host=self.mail_host,
-            port=self.mail_port,
-            use_ssl=self.mail_ssl,
-        )
         email = EmailMessage(
             settings.EMAIL_SUBJECT_PREFIX + _("Demande de ré-initialisation de mot de passe"),
             _(
@@ -105,36 +104,20 @@ class UserMailer:
             f"{settings.PROTOCOL}://{settings.WEBSITE_HOST}/reset-password/{user}/{token}/",
             self.mail_from,
             [user_object.email],
-            connection=connection,
         )
-        if self.test:
-            email.send()
-        else:
-            self.queue.append(email)
+        self.dispatch(email)
 
     def send_kick_mail(self, user_object: User, team_name: str) -> None:
         """
         Send a mail to a user that has been kicked.
         """
-        connection = get_connection(
-            fail_silently=False,
-            username=self.mail_from,
-            password=self.mail_pass,
-            host=self.mail_host,
-            port=self.mail_port,
-            use_ssl=self.mail_ssl,
-        )
         email = EmailMessage(
             settings.EMAIL_SUBJECT_PREFIX + _("Vous avez été exclu.e de votre équipe"),
             _("Vous avez été exclu.e de l'équipe %s.") % team_name,
             self.mail_from,
             [user_object.email],
-            connection=connection,
         )
-        if self.test:
-            email.send()
-        else:
-            self.queue.append(email)
+        self.dispatch(email)
 
     def send_ticket_mail(self, user_object: User, ticket: Ticket) -> None:
         """
@@ -143,21 +126,12 @@ class UserMailer:
 
         ticket_pdf = TicketManager.generate_ticket_pdf(ticket)
 
-        connection = get_connection(
-            fail_silently=False,
-            username=self.mail_from,
-            password=self.mail_pass,
-            host=self.mail_host,
-            port=self.mail_port,
-            use_ssl=self.mail_ssl,
-        )
         email = EmailMessage(
             settings.EMAIL_SUBJECT_PREFIX + _("Votre billet pour l'InsaLan"),
             # pylint: disable-next=line-too-long
             cast(str, _("Votre inscription pour l'Insalan a été payée. Votre billet est disponible en pièce jointe. Vous pouvez retrouver davantages d'informations sur l'évènement sur le site internet de l'InsaLan.")),
             self.mail_from,
             [user_object.email],
-            connection=connection,
         )
         email.attach(
             TicketManager.create_pdf_name(ticket),
@@ -165,10 +139,7 @@ class UserMailer:
             "application/pdf"
         )
 
-        if self.test:
-            email.send()
-        else:
-            self.queue.append(email)
+        self.dispatch(email)
 
     def send_tournament_mail(
         self,
@@ -178,42 +149,193 @@ class UserMailer:
         attachment: File[bytes] | None,  # pylint: disable=unsubscriptable-object
     ) -> None:
         """Send a mail."""
-        connection = get_connection(
+        self.send_tournament_mails([user_object.email], title, content, attachment)
+
+    def send_tournament_mails(
+        self,
+        recipients: Iterable[str],
+        title: str,
+        content: str,
+        attachment: File[bytes] | None,  # pylint: disable=unsubscriptable-object
+    ) -> int:
+        """
+        Send the same mail to every recipient, each one receiving its own
+        copy. The attachment is read and spooled only once, and the mails are
+        queued in bulk. Return the number of mails sent.
+        """
+        attachment_content = attachment.read() if attachment else None
+        spooled = []
+        if attachment and not self.test:
+            spooled.append(
+                OutboxMail.spool_attachment(attachment.name, attachment_content, None)
+            )
+
+        count = 0
+        batch: list[OutboxMail] = []
+        for recipient in recipients:
+            count += 1
+            if self.test:
+                email = EmailMessage(
+                    settings.EMAIL_SUBJECT_PREFIX + title,
+                    content,
+                    self.mail_from,
+                    [recipient],
+                )
+                if attachment:
+                    email.attach(attachment.name, attachment_content)
+                self.dispatch(email)
+                continue
+
+            batch.append(OutboxMail(
+                mailer=self.mail_from,
+                subject=settings.EMAIL_SUBJECT_PREFIX + title,
+                body=content,
+                to=[recipient],
+                attachments=spooled,
+            ))
+            if len(batch) >= MASS_MAIL_BATCH_SIZE:
+                OutboxMail.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            OutboxMail.objects.bulk_create(batch)
+        return count
+
+    def enqueue(self, email: EmailMessage) -> OutboxMail:
+        """
+        Store a mail in the outbox, its attachments being spooled to disk.
+        """
+        attachments = []
+        for attachment in email.attachments:
+            if isinstance(attachment, MIMEBase):
+                # Only happens for alternative parts, which we never build
+                raise TypeError("MIME attachments cannot be queued")
+            name, content, mimetype = attachment
+            attachments.append(OutboxMail.spool_attachment(name, content, mimetype))
+
+        return OutboxMail.objects.create(
+            mailer=self.mail_from,
+            subject=email.subject,
+            body=email.body,
+            to=list(email.to),
+            attachments=attachments,
+        )
+
+    def get_connection(self) -> BaseEmailBackend:
+        """
+        Build a connection to the SMTP server of this mailer.
+        """
+        return cast(BaseEmailBackend, get_connection(
             fail_silently=False,
             username=self.mail_from,
             password=self.mail_pass,
             host=self.mail_host,
             port=self.mail_port,
             use_ssl=self.mail_ssl,
-        )
-        email = EmailMessage(
-            settings.EMAIL_SUBJECT_PREFIX + title,
-            content,
-            self.mail_from,
-            [user_object.email],
-            connection=connection,
-        )
-        if attachment:
-            email.attach(attachment.name, attachment.read())
+        ))
 
+    def dispatch(self, email: EmailMessage) -> None:
+        """
+        Send a mail right away in test mode, queue it otherwise.
+        """
         if self.test:
+            email.connection = self.get_connection()
             email.send()
         else:
-            self.queue.append(email)
+            self.enqueue(email)
+
+    @staticmethod
+    def build_message(mail: OutboxMail) -> EmailMessage:
+        """
+        Rebuild the message of a queued mail, reading back its attachments.
+        """
+        email = EmailMessage(mail.subject, mail.body, mail.mailer, mail.to)
+        for attachment in mail.attachments:
+            with open(attachment["path"], "rb") as file:
+                email.attach(attachment["name"], file.read(), attachment["mimetype"])
+        return email
+
+    def pending_count(self) -> int:
+        """
+        Number of mails waiting in the outbox of this mailer.
+        """
+        return OutboxMail.objects.filter(
+            mailer=self.mail_from, status=OutboxMail.Status.PENDING
+        ).count()
+
+    @staticmethod
+    def retry_delay(attempts: int) -> timedelta:
+        """
+        Exponential backoff before the next delivery attempt of a mail.
+        """
+        return timedelta(seconds=min(
+            settings.EMAIL_RETRY_DELAY * 2 ** (attempts - 1), settings.EMAIL_MAX_RETRY_DELAY
+        ))
 
-    def send_first_mail(self) -> None:
+    def send_queued(self) -> int:
         """
-        Send the first mail in the queue.
+        Drain the outbox of this mailer in batches, over a single SMTP
+        connection, as far as the rate limit allows. Return the number of
+        mails sent.
+
+        Rows are locked while their batch is sent, and rows locked by other
+        workers are skipped, so several workers can drain the same outbox.
         """
-        if len(self.queue) == 0:
-            return
+        sent = 0
+        connection = self.get_connection()
         try:
-            self.queue[0].send()
-            self.queue.pop(0)
-        except Exception as e:  # pylint: disable=broad-exception-caught
-            print("Error sending mail", e, file=sys.stderr)
-            mail = self.queue.pop(0)
-            self.queue.append(mail)
+            while True:
+                allowed = self.rate_limit.take(self.batch_size)
+                if allowed == 0:
+                    break
+                with transaction.atomic():
+                    mails = list(
+                        OutboxMail.objects.select_for_update(skip_locked=True)
+                        .filter(
+                            mailer=self.mail_from,
+                            status=OutboxMail.Status.PENDING,
+                            scheduled_at__lte=timezone.now(),
+                        )
+                        .order_by("scheduled_at", "id")[:allowed]
+                    )
+                    self.rate_limit.give_back(allowed - len(mails))
+                    if not mails:
+                        break
+                    sent += self._send_batch(connection, mails)
+        finally:
+            connection.close()
+        return sent
+
+    def _send_batch(self, connection: BaseEmailBackend, mails: list[OutboxMail]) -> int:
+        now = timezone.now()
+        delivered = []
+        for mail in mails:
+            mail.attempts += 1
+            try:
+                # Without an open session, the backend would open and close
+                # one for every message
+                connection.open()
+                connection.send_messages([self.build_message(mail)])
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # Start over with a fresh session for the next message
+                connection.close()
+                mail.last_error = str(e)
+                if mail.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                    logger.error("Giving up sending mail %s: %s", mail.id, e)
+                    mail.status = OutboxMail.Status.FAILED
+                else:
+                    logger.warning("Error sending mail %s: %s", mail.id, e)
+                    mail.scheduled_at = now + self.retry_delay(mail.attempts)
+                continue
+            mail.status = OutboxMail.Status.SENT
+            mail.sent_at = now
+            delivered.append(mail)
+
+        OutboxMail.objects.bulk_update(
+            mails, ["attempts", "status", "sent_at", "scheduled_at", "last_error"]
+        )
+        for mail in delivered:
+            mail.release_attachments()
+        return len(delivered)
 
 class MailManager:
     """
@@ -239,24 +361,28 @@ class MailManager:
             return None
         return list(MailManager.mailers.values())[0]
 
+    # pylint: disable-next=too-many-arguments
     @staticmethod
     def add_mailer(mail_host: str, mail_port: str, mail_from: str, mail_pass: str, mail_ssl: bool,
-                   test: bool = False) -> None:
+                   test: bool = False, rate: float | None = None,
+                   batch_size: int | None = None) -> None:
         """
         Add a mailer for a specific email address.
         """
         MailManager.mailers[mail_from] = UserMailer(mail_host, mail_port, mail_from, mail_pass,
-                                                    mail_ssl, test=test)
+                                                    mail_ssl, test=test, rate=rate,
+                                                    batch_size=batch_size)
 
     @staticmethod
     def send_queued_mail() -> None:
         """
-        Send first mail in all mailer's queue.
+        Deliver the queued mails of every mailer.
         """
         for mailer in MailManager.mailers.values():
-            mailer.send_first_mail()
+            mailer.send_queued()
 
 def start_job() -> None:
+    """Add the configured mailers, and register the delivery of their outboxes"""
     # Check if we are in test mode
     test = 'test' in sys.argv
 
@@ -264,8 +390,9 @@ def start_job() -> None:
     for auth in settings.EMAIL_AUTH:
         mailer = settings.EMAIL_AUTH[auth]
         MailManager.add_mailer(mailer["host"], mailer["port"], mailer["from"], mailer["pass"],
-                               mailer["ssl"], test=test)
+                               mailer["ssl"], test=test, rate=mailer.get("rate"),
+                               batch_size=mailer.get("batch"))
 
-    # Start scheduler
-    if not test:
-        scheduler.add_job(MailManager.send_queued_mail, 'interval', seconds=30)
+    # Run by the leader of the scheduler
+    register_job("mail", MailManager.send_queued_mail, settings.EMAIL_DELIVERY_INTERVAL)
+    register_job("mail-spool", OutboxMail.purge_spool, settings.MAIL_SPOOL_GRACE)
@@ -0,0 +1,209 @@
+"""
+Command handler to benchmark the mail delivery pipeline.
+
+Mails are queued through a real mailer, then delivered over SMTP to a local
+sink, so the whole pipeline is measured (PDF generation, spooling, outbox,
+batching and SMTP) without sending anything. Every row created by the
+benchmark is rolled back at the end.
+"""
+
+import io
+import os
+import statistics
+import time
+from datetime import date, timedelta
+from os import path
+from typing import Any
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+from PIL import Image
+
+from insalan import settings
+from insalan.mailer import UserMailer
+from insalan.models import OutboxMail
+from insalan.smtp_sink import SMTPSink
+from insalan.tickets.models import Ticket
+from insalan.tournament.models import Event, EventTournament, Game
+from insalan.user.models import User
+
+KINDS = ("ticket", "password", "tournament")
+
+
+def percentile(values: list[float], ratio: float) -> float:
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(ratio * len(ordered)))]
+
+
+class Command(BaseCommand):
+    """The `mail_benchmark` command handler class"""
+
+    help = "Measure the throughput and latency of the mail pipeline against a local SMTP sink"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add declarations for the arguments this command will take"""
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=100,
+            help="Number of mails of each kind to queue",
+        )
+        parser.add_argument(
+            "--kinds",
+            default=",".join(KINDS),
+            help=f"Comma separated kinds of mail to queue, among {', '.join(KINDS)}",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=1_000_000,
+            help="Rate limit of the mailer, in mails per minute",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=settings.EMAIL_BATCH_SIZE,
+            help="Batch size of the mailer",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=600,
+            help="Give up delivering after this many seconds",
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        kinds = [kind for kind in options["kinds"].split(",") if kind]
+        for kind in kinds:
+            if kind not in KINDS:
+                raise CommandError(f"Unknown kind of mail: {kind}")
+        if "ticket" in kinds and not path.exists(
+            path.join(settings.STATIC_ROOT, "images/logo.png")
+        ):
+            raise CommandError(
+                "Tickets need the static files, run `manage.py collectstatic` first"
+            )
+
+        with SMTPSink() as sink, transaction.atomic():
+            mailer = UserMailer(
+                sink.host, str(sink.port), "benchmark@insalan.fr", "password", False,
+                rate=options["rate"], batch_size=options["batch"],
+            )
+            try:
+                self.run(mailer, sink, kinds, options["count"], options["timeout"])
+            finally:
+                transaction.set_rollback(True)
+
+    def run(self, mailer: UserMailer, sink: SMTPSink, kinds: list[str], count: int,
+            timeout: float) -> None:
+        """Queue the mails, deliver them and report"""
+        prefix = f"bench{os.getpid()}"
+        # Each kind of mail gets its own recipients, so deliveries can be
+        # matched to the mail they come from
+        users = {
+            kind: User.objects.bulk_create([
+                User(
+                    username=f"{prefix}_{kind}_{i}",
+                    email=f"{prefix}_{kind}_{i}@example.net",
+                    first_name="Jane",
+                    last_name="Doe",
+                )
+                for i in range(count)
+            ])
+            for kind in kinds
+        }
+
+        enqueue_durations = {}
+        tourney = None
+        if "ticket" in kinds:
+            tourney = self.create_tournament(prefix)
+            tickets = Ticket.objects.bulk_create([
+                Ticket(user=user, tournament=tourney) for user in users["ticket"]
+            ])
+            start = time.perf_counter()
+            for user, ticket in zip(users["ticket"], tickets):
+                mailer.send_ticket_mail(user, ticket)
+            enqueue_durations["ticket"] = time.perf_counter() - start
+
+        if "password" in kinds:
+            start = time.perf_counter()
+            for user in users["password"]:
+                mailer.send_password_reset(user)
+            enqueue_durations["password"] = time.perf_counter() - start
+
+        if "tournament" in kinds:
+            attachment = ContentFile(os.urandom(64 * 1024), name="reglement.pdf")
+            start = time.perf_counter()
+            mailer.send_tournament_mails(
+                [user.email for user in users["tournament"]], "Benchmark", "Contenu", attachment
+            )
+            enqueue_durations["tournament"] = time.perf_counter() - start
+
+        self.stdout.write(f"Queued {len(kinds) * count} mails")
+        for kind, duration in enqueue_durations.items():
+            self.stdout.write(
+                f"  {kind:<10} enqueue: {duration:8.3f}s ({duration * 1000 / count:.2f} ms/mail)"
+            )
+
+        try:
+            self.deliver(mailer, sink, len(kinds) * count, timeout)
+        finally:
+            if tourney is not None:
+                tourney.logo.delete(save=False)
+
+    def create_tournament(self, prefix: str) -> EventTournament:
+        """Tournament the benchmark tickets are for, with a generated logo"""
+        event = Event.objects.create(
+            name=f"Benchmark {prefix}",
+            description="",
+            date_start=date.today(),
+            date_end=date.today() + timedelta(days=2),
+        )
+        game = Game.objects.create(name=f"Benchmark {prefix}", short_name="BNC")
+        logo = io.BytesIO()
+        Image.new("RGB", (1200, 600), (44, 41, 45)).save(logo, format="PNG")
+        return EventTournament.objects.create(
+            event=event,
+            game=game,
+            name=f"Benchmark {prefix}",
+            logo=ContentFile(logo.getvalue(), name=f"{prefix}.png"),
+        )
+
+    def deliver(self, mailer: UserMailer, sink: SMTPSink, total: int, timeout: float) -> None:
+        """Drain the outbox into the sink and report the measures"""
+        queued_at = {
+            mail["to"][0]: mail["created_at"].timestamp()
+            for mail in OutboxMail.objects.filter(mailer=mailer.mail_from)
+            .values("to", "created_at")
+        }
+
+        start = time.perf_counter()
+        deadline = start + timeout
+        while len(sink.messages) < total and time.perf_counter() < deadline:
+            if mailer.send_queued() == 0:
+                time.sleep(0.05)
+        duration = time.perf_counter() - start
+
+        delivered = len(sink.messages)
+        latencies = [
+            message.received_at - queued_at[message.recipients[0]]
+            for message in sink.messages
+            if message.recipients and message.recipients[0] in queued_at
+        ]
+        self.stdout.write(
+            f"Delivered {delivered}/{total} mails in {duration:.3f}s "
+            f"({delivered / duration if duration else 0:.1f} mails/s)"
+        )
+        if latencies:
+            self.stdout.write(
+                "Enqueue to delivered latency: "
+                f"p50 {percentile(latencies, 0.5):.3f}s, "
+                f"p95 {percentile(latencies, 0.95):.3f}s, "
+                f"max {max(latencies):.3f}s, "
+                f"mean {statistics.fmean(latencies):.3f}s"
+            )
+        if delivered < total:
+            raise CommandError(f"Only {delivered} of {total} mails were delivered")
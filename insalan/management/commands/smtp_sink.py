@@ -0,0 +1,44 @@
+"""
+Command handler to run a local SMTP sink.
+
+Point a mailer of `MAIL_AUTH` to it (with `"ssl": false`) to receive the
+mails of a development instance without sending them anywhere.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from insalan.smtp_sink import SMTPSink, SunkMessage
+
+
+class Command(BaseCommand):
+    """The `smtp_sink` command handler class"""
+
+    help = "Run a local SMTP server that accepts and prints every mail"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add declarations for the arguments this command will take"""
+        parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+        parser.add_argument("--port", type=int, default=1025, help="Port to listen on")
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        command = self
+
+        class PrintingSink(SMTPSink):
+            """Sink printing a summary of every mail, and forgetting it"""
+
+            def store(self, message: SunkMessage) -> None:
+                parsed = message.parse()
+                command.stdout.write(
+                    f"{message.mail_from} -> {', '.join(message.recipients)}: "
+                    f"{parsed['Subject']} ({len(message.data)} bytes)"
+                )
+
+        sink = PrintingSink(options["host"], options["port"])
+        self.stdout.write(f"SMTP sink listening on {options['host']}:{options['port']}")
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            pass
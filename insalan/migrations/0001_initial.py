@@ -0,0 +1,42 @@
+# Generated by Django 4.1.12 on 2026-10-19 06:37
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mailer', models.CharField(max_length=254, verbose_name='Expéditeur')),
+                ('subject', models.TextField(verbose_name='Sujet')),
+                ('body', models.TextField(blank=True, verbose_name='Contenu')),
+                ('to', django.contrib.postgres.fields.ArrayField(base_field=models.EmailField(max_length=254), size=None, verbose_name='Destinataires')),
+                ('attachments', models.JSONField(blank=True, default=list, verbose_name='Pièces jointes')),
+                ('status', models.CharField(choices=[('PE', 'En attente'), ('SE', 'Envoyé'), ('FA', 'Échec')], default='PE', max_length=2, verbose_name='Statut')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Nombre de tentatives')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Dernière erreur')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('scheduled_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Envoi prévu à partir de')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name="Date d'envoi")),
+            ],
+            options={
+                'verbose_name': "Mail en file d'attente",
+                'verbose_name_plural': "Mails en file d'attente",
+                'ordering': ['scheduled_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmail',
+            index=models.Index(fields=['mailer', 'status', 'scheduled_at'], name='outbox_mailer_status_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.12 on 2026-10-19 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insalan', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Tâche')),
+                ('runs', models.PositiveIntegerField(default=0, verbose_name="Nombre d'exécutions")),
+                ('failures', models.PositiveIntegerField(default=0, verbose_name="Nombre d'échecs")),
+                ('total_duration', models.FloatField(default=0, verbose_name='Durée totale (s)')),
+                ('last_duration', models.FloatField(default=0, verbose_name='Durée de la dernière exécution (s)')),
+                ('last_started_at', models.DateTimeField(blank=True, null=True, verbose_name='Début de la dernière exécution')),
+                ('last_success_at', models.DateTimeField(blank=True, null=True, verbose_name='Fin de la dernière exécution réussie')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Dernière erreur')),
+            ],
+            options={
+                'verbose_name': "Métriques d'une tâche périodique",
+                'verbose_name_plural': 'Métriques des tâches périodiques',
+                'ordering': ['name'],
+            },
+        ),
+    ]
@@ -0,0 +1,263 @@
+"""
+Models shared by the whole backend.
+
+The outbox holds the mails waiting to be delivered by the mailers, so that
+they survive restarts and can be delivered by any worker. The metrics of the
+periodic jobs tell how their runs went, whichever worker ran them.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from os import path
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class OutboxMail(models.Model):
+    """
+    A mail waiting in the outbox of a mailer.
+
+    Only the metadata lives in the database, attachments are spooled to
+    `MAIL_SPOOL_ROOT` and referenced by path.
+
+    A spooled file may be shared by several mails, and written again by a mail
+    being queued whose row is not committed yet: it is only removed once no
+    pending mail refers to it and it was not written for `MAIL_SPOOL_GRACE`
+    seconds.
+    """
+
+    class Status(models.TextChoices):
+        """Delivery status of a mail"""
+        PENDING = "PE", _("En attente")
+        SENT = "SE", _("Envoyé")
+        FAILED = "FA", _("Échec")
+
+    class Meta:
+        """Meta options"""
+
+        verbose_name = _("Mail en file d'attente")
+        verbose_name_plural = _("Mails en file d'attente")
+        ordering = ["scheduled_at", "id"]
+        indexes = [
+            models.Index(
+                fields=["mailer", "status", "scheduled_at"],
+                name="outbox_mailer_status_idx",
+            ),
+        ]
+
+    id: int
+    mailer = models.CharField(
+        verbose_name=_("Expéditeur"),
+        max_length=254,
+    )
+    subject = models.TextField(verbose_name=_("Sujet"))
+    body = models.TextField(verbose_name=_("Contenu"), blank=True)
+    to = ArrayField(
+        models.EmailField(),
+        verbose_name=_("Destinataires"),
+    )
+    attachments = models.JSONField(
+        verbose_name=_("Pièces jointes"),
+        default=list,
+        blank=True,
+    )
+    status = models.CharField(
+        verbose_name=_("Statut"),
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    attempts = models.PositiveIntegerField(
+        verbose_name=_("Nombre de tentatives"),
+        default=0,
+    )
+    last_error = models.TextField(
+        verbose_name=_("Dernière erreur"),
+        blank=True,
+        default="",
+    )
+    created_at = models.DateTimeField(
+        verbose_name=_("Date de création"),
+        auto_now_add=True,
+    )
+    scheduled_at = models.DateTimeField(
+        verbose_name=_("Envoi prévu à partir de"),
+        default=timezone.now,
+    )
+    sent_at = models.DateTimeField(
+        verbose_name=_("Date d'envoi"),
+        null=True,
+        blank=True,
+    )
+
+    def __str__(self) -> str:
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+    @staticmethod
+    def spool_attachment(
+        name: str | None, content: bytes | str, mimetype: str | None
+    ) -> dict[str, str | None]:
+        """
+        Write an attachment to the spool and return its reference.
+
+        Files are named after the hash of their content, so an attachment
+        shared by many mails is only stored once.
+        """
+        if isinstance(content, str):
+            content = content.encode()
+        digest = hashlib.sha256(content).hexdigest()
+        file_path = path.join(settings.MAIL_SPOOL_ROOT, digest[:2], digest)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.dirname(file_path))
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(tmp_path, file_path)
+        return {"name": name, "path": file_path, "mimetype": mimetype}
+
+    def release_attachments(self) -> None:
+        """Remove the spooled attachments no other pending mail refers to"""
+        for attachment in self.attachments:
+            still_used = OutboxMail.objects.filter(
+                status=OutboxMail.Status.PENDING,
+                attachments__contains=[{"path": attachment["path"]}],
+            ).exclude(id=self.id).exists()
+            if not still_used:
+                OutboxMail.remove_spooled(attachment["path"])
+
+    @staticmethod
+    def remove_spooled(file_path: str) -> None:
+        """
+        Remove a spooled file, unless it was written in the last
+        `MAIL_SPOOL_GRACE` seconds.
+
+        The file is moved away before its age is checked, and put back when
+        it is recent, so that a copy written meanwhile is never removed.
+        Putting it back over a newer copy changes nothing, as files are named
+        after their content.
+        """
+        removed_path = f"{file_path}.{uuid.uuid4().hex}.removed"
+        try:
+            os.rename(file_path, removed_path)
+        except FileNotFoundError:
+            return
+        if time.time() - os.stat(removed_path).st_mtime < settings.MAIL_SPOOL_GRACE:
+            os.replace(removed_path, file_path)
+        else:
+            os.remove(removed_path)
+
+    @staticmethod
+    def purge_spool() -> int:
+        """
+        Remove the spooled files no pending mail refers to, kept by
+        `release_attachments` while they were recent, and return their number
+        """
+        used = {
+            attachment["path"]
+            for attachments in OutboxMail.objects.filter(
+                status=OutboxMail.Status.PENDING
+            ).values_list("attachments", flat=True)
+            for attachment in attachments
+        }
+        deadline = time.time() - settings.MAIL_SPOOL_GRACE
+        removed = 0
+        for directory, _, names in os.walk(settings.MAIL_SPOOL_ROOT):
+            for name in names:
+                file_path = path.join(directory, name)
+                if file_path in used:
+                    continue
+                try:
+                    if os.stat(file_path).st_mtime >= deadline:
+                        continue
+                    if len(name) == 64:
+                        OutboxMail.remove_spooled(file_path)
+                    else:
+                        # Left by a write which did not complete
+                        os.remove(file_path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+        return removed
+
+
+class JobMetrics(models.Model):
+    """Execution metrics of a periodic job of the scheduler"""
+
+    class Meta:
+        """Meta options"""
+
+        verbose_name = _("Métriques d'une tâche périodique")
+        verbose_name_plural = _("Métriques des tâches périodiques")
+        ordering = ["name"]
+
+    id: int
+    name = models.CharField(
+        verbose_name=_("Tâche"),
+        max_length=100,
+        unique=True,
+    )
+    runs = models.PositiveIntegerField(
+        verbose_name=_("Nombre d'exécutions"),
+        default=0,
+    )
+    failures = models.PositiveIntegerField(
+        verbose_name=_("Nombre d'échecs"),
+        default=0,
+    )
+    total_duration = models.FloatField(
+        verbose_name=_("Durée totale (s)"),
+        default=0,
+    )
+    last_duration = models.FloatField(
+        verbose_name=_("Durée de la dernière exécution (s)"),
+        default=0,
+    )
+    last_started_at = models.DateTimeField(
+        verbose_name=_("Début de la dernière exécution"),
+        null=True,
+        blank=True,
+    )
+    last_success_at = models.DateTimeField(
+        verbose_name=_("Fin de la dernière exécution réussie"),
+        null=True,
+        blank=True,
+    )
+    last_error = models.TextField(
+        verbose_name=_("Dernière erreur"),
+        blank=True,
+        default="",
+    )
+
+    def __str__(self) -> str:
+        return self.name
+
+    @property
+    def mean_duration(self) -> float:
+        """Mean duration of the runs of the job, in seconds"""
+        return self.total_duration / self.runs if self.runs else 0
+
+    @staticmethod
+    def record(name: str, started_at: datetime, duration: float, error: str = "") -> None:
+        """Count a run of a job, failed if `error` is not empty"""
+        changes = {
+            "runs": F("runs") + 1,
+            "total_duration": F("total_duration") + duration,
+            "last_duration": duration,
+            "last_started_at": started_at,
+        }
+        if error:
+            changes |= {"failures": F("failures") + 1, "last_error": error}
+        else:
+            changes["last_success_at"] = timezone.now()
+        if not JobMetrics.objects.filter(name=name).update(**changes):
+            JobMetrics.objects.get_or_create(name=name)
+            JobMetrics.objects.filter(name=name).update(**changes)
@@ -1,12 +1,18 @@
 """Payment Admin Panel Code"""
 
-from django.contrib import admin
+from collections.abc import Iterator
+from typing import Any
+
+from django.contrib import admin, messages
 from django.db.models.query import QuerySet
-from django.http import HttpRequest, HttpResponse
+from django.http import FileResponse, HttpRequest
 from django.utils.translation import gettext_lazy as _
 from unfold.admin import ModelAdmin # type: ignore
 
-from .models import Product, Transaction, Payment, TransactionStatus, Discount
+from insalan.csv_export import EXPORT_CHUNK_SIZE, stream_csv
+
+from .models import Product, Transaction, Payment, TransactionStatus, Discount, Notification
+from .notifications import replay_notifications
 
 
 class ProductAdmin(ModelAdmin):  # type: ignore
@@ -51,25 +57,42 @@ class PaymentAdmin(ModelAdmin):  # type: ignore
         """Remove the ability to edit a payment from the backoffice"""
         return False
 
-    def export(self, request: HttpRequest, queryset: QuerySet[Payment]) -> HttpResponse:
+    def export(
+        self, request: HttpRequest, queryset: QuerySet[Payment]
+    ) -> FileResponse:
         """
         Export the selected payments to a CSV file
         """
-        export = "id;prix;type;statut;date de paiement;date de dernière modification\n"
-        for payment in queryset:
-            # /!\ This will be removed when the payment timeouts are implemented
-            payment_status = payment.transaction.payment_status
-            if payment.transaction.payment_status == TransactionStatus.PENDING:
-                payment_status = TransactionStatus.FAILED
-            payment_type = ", ".join(
-                [product.name for product in payment.transaction.products.all()]
-            )
-
-            # pylint: disable-next=line-too-long
-            export += f"{payment.id};{payment.amount};{payment_type};{payment_status};{payment.transaction.creation_date};{payment.transaction.last_modification_date}\n"
-        response = HttpResponse(export, content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=export.csv"
-        return response
+        payments = (
+            queryset.select_related("transaction")
+            .prefetch_related("transaction__products")
+            .order_by("id")
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+
+        def rows() -> Iterator[list[Any]]:
+            for payment in payments:
+                # /!\ This will be removed when the payment timeouts are implemented
+                payment_status = payment.transaction.payment_status
+                if payment_status == TransactionStatus.PENDING:
+                    payment_status = TransactionStatus.FAILED
+                payment_type = ", ".join(
+                    product.name for product in payment.transaction.products.all()
+                )
+                yield [
+                    payment.id,
+                    payment.amount,
+                    payment_type,
+                    payment_status,
+                    payment.transaction.creation_date,
+                    payment.transaction.last_modification_date,
+                ]
+
+        return stream_csv(
+            "export.csv",
+            ["id", "prix", "type", "statut", "date de paiement", "date de dernière modification"],
+            rows(),
+        )
     export.short_description = "Exporter les paiements sélectionnés"  # type: ignore[attr-defined]
 
 
@@ -106,6 +129,7 @@ class TransactionAdmin(ModelAdmin):  # type: ignore
     ]
 
     # actions = [reimburse_transactions]
+    actions = ["export"]
 
     def has_add_permission(self, _request: HttpRequest) -> bool:
         """Remove the ability to add a transaction from the backoffice"""
@@ -119,6 +143,55 @@ class TransactionAdmin(ModelAdmin):  # type: ignore
         """Remove the ability to edit a transaction from the backoffice"""
         return False
 
+    @admin.action(description=_("Exporter les transactions sélectionnées"))
+    def export(
+        self, request: HttpRequest, queryset: QuerySet[Transaction]
+    ) -> FileResponse:
+        """
+        Export the selected transactions to a CSV file
+        """
+        transactions = (
+            queryset.select_related("payer")
+            .prefetch_related("products")
+            .order_by("creation_date")
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        statuses = dict(TransactionStatus.choices)
+
+        def rows() -> Iterator[list[Any]]:
+            for trans in transactions:
+                # The payer of a transaction may have deleted their account
+                payer = trans.payer
+                yield [
+                    trans.id,
+                    payer.username if payer is not None else "",
+                    payer.email if payer is not None else "",
+                    ", ".join(product.name for product in trans.products.all()),
+                    trans.amount,
+                    statuses.get(trans.payment_status, trans.payment_status),
+                    trans.creation_date,
+                    trans.last_modification_date,
+                    trans.intent_id,
+                    trans.order_id,
+                ]
+
+        return stream_csv(
+            "transactions.csv",
+            [
+                "id",
+                "payeur",
+                "courriel",
+                "produits",
+                "montant",
+                "statut",
+                "date de création",
+                "date de dernière modification",
+                "intent",
+                "commande",
+            ],
+            rows(),
+        )
+
 
 admin.site.register(Transaction, TransactionAdmin)
 
@@ -133,3 +206,43 @@ class DiscountAdmin(ModelAdmin):  # type: ignore
 
 
 admin.site.register(Discount, DiscountAdmin)
+
+
+class NotificationAdmin(ModelAdmin):  # type: ignore
+    """
+    Admin handler for HelloAsso notifications
+
+    They can only be seen, and the failed ones replayed.
+    """
+
+    list_display = ("id", "event_type", "transaction_uuid", "status", "attempts",
+                    "received_at", "processed_at")
+    list_filter = ("status", "event_type")
+    search_fields = ["transaction_uuid", "last_error"]
+    readonly_fields = ("dedupe_key", "transaction_uuid", "event_type", "payload", "status",
+                       "attempts", "last_error", "received_at", "processed_at")
+    actions = ["replay"]
+
+    def has_add_permission(self, _request: HttpRequest) -> bool:
+        """Notifications only come from HelloAsso"""
+        return False
+
+    def has_change_permission(self, _request: HttpRequest,
+                              _obj: Notification | None = None) -> bool:
+        """Notifications only come from HelloAsso"""
+        return False
+
+    @admin.action(description=_("Rejouer les notifications en échec"))
+    def replay(self, request: HttpRequest, queryset: QuerySet[Notification]) -> None:
+        """Process the selected failed notifications again"""
+        total = queryset.filter(status=Notification.Status.FAILED).count()
+        succeeded = replay_notifications(queryset)
+        self.message_user(
+            request,
+            _("%(succeeded)s notifications sur %(total)s rejouées avec succès")
+            % {"succeeded": succeeded, "total": total},
+            messages.SUCCESS if succeeded == total else messages.WARNING,
+        )
+
+
+admin.site.register(Notification, NotificationAdmin)
@@ -7,6 +7,9 @@ It defines the PaymentConfig class, which is responsible for configuring the app
 from django.apps import AppConfig
 from django.utils.translation import gettext_lazy as _
 
+from insalan import settings as app_settings
+from insalan.scheduler import register_job
+
 
 class PaymentConfig(AppConfig):
     """
@@ -15,3 +18,15 @@ class PaymentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name ='insalan.payment'
     verbose_name = _('Paiement')
+
+    def ready(self) -> None:
+        """Called when the module is ready"""
+        # pylint: disable-next=import-outside-toplevel
+        from .notifications import process_notifications
+        # pylint: disable-next=import-outside-toplevel
+        from .reconciliation import reconcile_transactions
+
+        register_job("notifications", process_notifications,
+                     app_settings.HA_NOTIFICATION_INTERVAL)
+        register_job("reconciliation", reconcile_transactions,
+                     app_settings.HA_RECONCILE_INTERVAL)
@@ -0,0 +1,369 @@
+"""
+Local HelloAsso stand-in.
+
+A minimal HTTP server speaking enough of the HelloAsso API for our payment
+flow: it hands out OAuth2 tokens, accepts checkout intents, and then plays
+the part of the payer by sending the Order and Payment notifications to our
+webhook, like HelloAsso does once the card is charged. Latency, errors and
+refused payments can be injected, so the whole checkout to ticket pipeline can
+be load tested without reaching HelloAsso.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import random
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any
+from urllib.parse import parse_qs
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_INTENTS = re.compile(r"^/v5/organizations/(?P<slug>[^/]+)/checkout-intents/?$")
+CHECKOUT_INTENT = re.compile(r"^/v5/organizations/(?P<slug>[^/]+)/checkout-intents/(?P<id>\d+)/?$")
+
+
+@dataclass
+class FakeIntent:
+    """A checkout intent created on the fake server"""
+    id: int
+    body: dict[str, Any]
+    created_at: float = field(default_factory=time.time)
+    order_id: int | None = None
+    payment_id: int | None = None
+    state: str | None = None
+
+    def describe(self) -> dict[str, Any]:
+        """The intent as the API shows it, with its order once paid"""
+        description: dict[str, Any] = {
+            "id": self.id,
+            "metadata": self.body.get("metadata", {}),
+        }
+        if self.order_id is not None:
+            description["order"] = {
+                "id": self.order_id,
+                "payments": [{
+                    "id": self.payment_id,
+                    "amount": self.body["totalAmount"],
+                    "state": self.state,
+                }],
+            }
+        return description
+
+
+@dataclass
+class FakeStats:
+    """What the fake server did"""
+    tokens: int = 0
+    intents: int = 0
+    injected_errors: int = 0
+    notifications: int = 0
+    duplicates: int = 0
+    lost: int = 0
+    webhook_errors: int = 0
+
+
+class _HelloAssoHandler(BaseHTTPRequestHandler):
+    """Answers the HelloAsso API calls"""
+
+    server: _HelloAssoServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+    def reply(self, status: int, body: Any) -> None:
+        """Send a JSON answer"""
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_body(self) -> bytes:
+        """Read the request body"""
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Checkout intent state endpoint"""
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.roll(fake.failure_rate):
+            with fake.lock:
+                fake.stats.injected_errors += 1
+            self.reply(503, {"message": "Injected failure"})
+            return
+        match = CHECKOUT_INTENT.match(self.path)
+        if match is None:
+            self.reply(404, {"message": "Not found"})
+            return
+        authorization = self.headers.get("Authorization", "")
+        if not fake.check_token(authorization.removeprefix("Bearer ")):
+            self.reply(401, {"message": "Invalid token"})
+            return
+        with fake.lock:
+            intent = fake.intents.get(int(match["id"]))
+            description = intent.describe() if intent is not None else None
+        if description is None:
+            self.reply(404, {"message": "Unknown checkout intent"})
+            return
+        self.reply(200, description)
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Token and checkout intent endpoints"""
+        fake = self.server.fake
+        body = self.read_body()
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.roll(fake.failure_rate):
+            with fake.lock:
+                fake.stats.injected_errors += 1
+            self.reply(503, {"message": "Injected failure"})
+            return
+
+        if self.path == "/oauth2/token":
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            self.reply(200, fake.issue_token(form))
+            return
+
+        match = CHECKOUT_INTENTS.match(self.path)
+        if match is None:
+            self.reply(404, {"message": "Not found"})
+            return
+        authorization = self.headers.get("Authorization", "")
+        if not fake.check_token(authorization.removeprefix("Bearer ")):
+            self.reply(401, {"message": "Invalid token"})
+            return
+        try:
+            intent_body = json.loads(body)
+        except ValueError:
+            self.reply(400, {"message": "Invalid JSON"})
+            return
+        if not isinstance(intent_body.get("totalAmount"), int):
+            self.reply(400, {"message": "totalAmount must be an integer"})
+            return
+        intent = fake.create_intent(intent_body)
+        self.reply(200, {"id": intent.id, "redirectUrl": f"{fake.url}/checkout/{intent.id}"})
+
+
+class _HelloAssoServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], fake: FakeHelloAsso) -> None:
+        super().__init__(address, _HelloAssoHandler)
+        self.fake = fake
+
+
+# pylint: disable-next=too-many-instance-attributes
+class FakeHelloAsso:
+    """
+    Fake HelloAsso server.
+
+    Every checkout intent is paid `payment_delay` seconds after its creation:
+    the Order and Payment notifications are then posted to `webhook_url`.
+    `failure_rate` of the API calls fail with a 503 after `latency` seconds,
+    `refusal_rate` of the payments are refused, `duplicate_rate` of the
+    notifications are sent twice, as HelloAsso does when our answer is slow,
+    and `loss_rate` of them are never sent. The state of the intents can be
+    fetched back, as on HelloAsso. Without a webhook, intents are only paid by
+    calling `pay`, and nothing is notified.
+
+    Use it as a context manager, or call `start` and `stop`. With port 0, a
+    free port is picked and available in `port` once started.
+    """
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self,
+        webhook_url: str | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        failure_rate: float = 0,
+        refusal_rate: float = 0,
+        duplicate_rate: float = 0,
+        loss_rate: float = 0,
+        payment_delay: float = 0,
+        token_lifetime: int = 1800,
+        seed: int | None = None,
+    ) -> None:
+        self.webhook_url = webhook_url
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.refusal_rate = refusal_rate
+        self.duplicate_rate = duplicate_rate
+        self.loss_rate = loss_rate
+        self.payment_delay = payment_delay
+        self.token_lifetime = token_lifetime
+        self.intents: dict[int, FakeIntent] = {}
+        self.stats = FakeStats()
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._tokens: dict[str, float] = {}
+        self._ids = itertools.count(1)
+        self._server: _HelloAssoServer | None = None
+        self._thread: threading.Thread | None = None
+        self._notifier: ThreadPoolExecutor | None = None
+        self._session = requests.Session()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the API, to use as `HA_URL`"""
+        return f"http://{self.host}:{self.port}"
+
+    def roll(self, rate: float) -> bool:
+        """Randomly decide whether something happens, with probability `rate`"""
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self._random.random() < rate
+
+    def issue_token(self, form: dict[str, str]) -> dict[str, Any]:
+        """Hand out a new token, whatever the grant"""
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self._tokens[token] = time.time() + self.token_lifetime
+            self.stats.tokens += 1
+        logger.debug("Issued token with grant %s", form.get("grant_type"))
+        return {
+            "access_token": token,
+            "refresh_token": secrets.token_urlsafe(16),
+            "token_type": "bearer",
+            "expires_in": self.token_lifetime,
+        }
+
+    def check_token(self, token: str) -> bool:
+        """Whether a bearer token was issued here and is still valid"""
+        with self.lock:
+            return self._tokens.get(token, 0) > time.time()
+
+    def create_intent(self, body: dict[str, Any]) -> FakeIntent:
+        """Record a checkout intent, and plan its payment"""
+        with self.lock:
+            intent = FakeIntent(next(self._ids), body)
+            self.intents[intent.id] = intent
+            self.stats.intents += 1
+        if self.webhook_url is not None and self._notifier is not None:
+            self._notifier.submit(self.pay, intent)
+        return intent
+
+    def pay(self, intent: FakeIntent) -> None:
+        """Pay an intent, and notify the webhook like HelloAsso does"""
+        if self.payment_delay:
+            time.sleep(self.payment_delay)
+        state = "Refused" if self.roll(self.refusal_rate) else "Authorized"
+        with self.lock:
+            intent.order_id = next(self._ids)
+            intent.payment_id = next(self._ids)
+            intent.state = state
+        if self.webhook_url is None:
+            return
+
+        metadata = intent.body.get("metadata", {})
+        payer = intent.body.get("payer", {})
+        amount = intent.body["totalAmount"]
+        self.notify({
+            "eventType": "Order",
+            "data": {
+                "id": intent.order_id,
+                "payer": {
+                    "firstName": payer.get("firstName", ""),
+                    "lastName": payer.get("lastName", ""),
+                    "email": payer.get("email", ""),
+                },
+                "payments": [{"id": intent.payment_id, "amount": amount}],
+            },
+            "metadata": metadata,
+        })
+        self.notify({
+            "eventType": "Payment",
+            "data": {
+                "id": intent.payment_id,
+                "amount": amount,
+                "state": intent.state,
+                "order": {"id": intent.order_id},
+            },
+            "metadata": metadata,
+        })
+
+    def notify(self, notification: dict[str, Any], attempts: int = 3) -> None:
+        """Post a notification to the webhook, retrying on errors"""
+        assert self.webhook_url is not None
+        if self.roll(self.loss_rate):
+            with self.lock:
+                self.stats.lost += 1
+            return
+        copies = 2 if self.roll(self.duplicate_rate) else 1
+        for copy in range(copies):
+            for attempt in range(attempts):
+                try:
+                    response = self._session.post(
+                        self.webhook_url, json=notification, timeout=30
+                    )
+                    if response.ok:
+                        with self.lock:
+                            self.stats.notifications += 1
+                            self.stats.duplicates += copy
+                        break
+                    logger.warning("Webhook answered %d", response.status_code)
+                except requests.exceptions.RequestException as err:
+                    logger.warning("Unable to reach the webhook: %s", err)
+                with self.lock:
+                    self.stats.webhook_errors += 1
+                time.sleep(0.1 * 2 ** attempt)
+
+    def start(self) -> None:
+        """Start serving in a background thread"""
+        self._server = _HelloAssoServer((self.host, self.port), self)
+        self.port = self._server.server_address[1]
+        self._notifier = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fake-helloasso")
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        """Serve in the current thread"""
+        self._server = _HelloAssoServer((self.host, self.port), self)
+        self.port = self._server.server_address[1]
+        self._notifier = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fake-helloasso")
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        """Stop serving, after the planned notifications are sent"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._notifier is not None:
+            self._notifier.shutdown()
+            self._notifier = None
+        self._session.close()
+
+    def __enter__(self) -> FakeHelloAsso:
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.stop()
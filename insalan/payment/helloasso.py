@@ -0,0 +1,221 @@
+"""
+HelloAsso API client
+
+Every call to HelloAsso goes through a single client per process, which keeps
+a pool of keep-alive connections, the OAuth2 token, and a circuit breaker so
+that an unavailable HelloAsso fails fast instead of piling up workers waiting
+for their timeout.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+
+import insalan.settings as app_settings
+
+from .tokens import TOKEN_CACHE_KEY, Token
+
+logger = logging.getLogger(__name__)
+
+
+class HelloAssoError(RuntimeError):
+    """A call to HelloAsso failed"""
+
+    def __init__(self, message: object, status: int | None = None) -> None:
+        super().__init__(message)
+        # HTTP status of the answer, None if HelloAsso could not be reached
+        self.status = status
+
+
+class CircuitOpenError(HelloAssoError):
+    """HelloAsso failed too many times recently, calls are not attempted"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker
+
+    After `threshold` consecutive failures, the circuit opens and calls are
+    refused for `cooldown` seconds. Then a single call is let through: the
+    circuit closes again if it succeeds, and stays open otherwise.
+    """
+
+    def __init__(self, threshold: int, cooldown: float) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call must not be attempted"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self._trial or time.monotonic() < self.opened_at + self.cooldown:
+                raise CircuitOpenError(_("Le service de paiement est indisponible"))
+            # Half-open: let this call through to probe HelloAsso
+            self._trial = True
+
+    def record_success(self) -> None:
+        """Close the circuit"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the circuit past the threshold"""
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened_at is None or self._trial:
+                    logger.error("HelloAsso circuit opened after %d failures", self.failures)
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class HelloAssoClient:
+    """Client of the HelloAsso API"""
+
+    def __init__(self) -> None:
+        self.session = requests.Session()
+        # Only idempotent requests are retried: creating a checkout intent
+        # twice would create two intents
+        retries = Retry(
+            total=app_settings.HA_MAX_RETRIES,
+            connect=app_settings.HA_MAX_RETRIES,
+            read=app_settings.HA_MAX_RETRIES,
+            status=app_settings.HA_MAX_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=app_settings.HA_POOL_SIZE,
+            max_retries=retries,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.token = Token(self.session)
+        self.breaker = CircuitBreaker(
+            app_settings.HA_BREAKER_THRESHOLD, app_settings.HA_BREAKER_COOLDOWN
+        )
+
+    def request(self, method: str, path: str, **kwargs: Any) -> Any:
+        """
+        Send an authenticated request to the API, and return the decoded body
+
+        Raise HelloAssoError if HelloAsso could not be reached or answered
+        with an error.
+        """
+        self.breaker.before_call()
+        try:
+            response = self._send(method, path, **kwargs)
+            if response.status_code == 401:
+                # The token may have been revoked, get a new one once
+                self.token.invalidate()
+                response = self._send(method, path, **kwargs)
+        except (requests.exceptions.RequestException, RuntimeError) as err:
+            self.breaker.record_failure()
+            logger.error("HelloAsso %s %s failed: %s", method, path, err)
+            raise HelloAssoError(_("Le service de paiement est indisponible")) from err
+        except Exception:
+            # An unexpected error must not leave a trial call unfinished,
+            # which would keep the circuit open
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if not response.ok:
+            logger.error(
+                "HelloAsso %s %s answered %d: %s",
+                method,
+                path,
+                response.status_code,
+                response.text,
+            )
+            raise HelloAssoError(
+                _("Erreur du service de paiement: %s") % response.status_code,
+                response.status_code,
+            )
+        try:
+            return response.json()
+        except ValueError as err:
+            raise HelloAssoError(_("Réponse invalide du service de paiement")) from err
+
+    def _send(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """Send a request with the current token"""
+        headers = {"authorization": "Bearer " + self.token.get_token()}
+        return self.session.request(
+            method,
+            f"{app_settings.HA_URL}{path}",
+            headers=headers,
+            timeout=app_settings.HA_TIMEOUT,
+            **kwargs,
+        )
+
+    def create_checkout_intent(self, body: dict[str, Any]) -> dict[str, Any]:
+        """Initiate a checkout intent, and return its id and redirect URL"""
+        result: dict[str, Any] = self.request(
+            "POST",
+            f"/v5/organizations/{app_settings.HA_ORG_SLUG}/checkout-intents",
+            json=body,
+        )
+        return result
+
+    def get_checkout_intent(self, intent_id: int) -> dict[str, Any]:
+        """Fetch a checkout intent, with its order once it was paid"""
+        result: dict[str, Any] = self.request(
+            "GET",
+            f"/v5/organizations/{app_settings.HA_ORG_SLUG}/checkout-intents/{intent_id}",
+        )
+        return result
+
+    def close(self) -> None:
+        """Release the connections and stop refreshing the token"""
+        self.token.stop()
+        self.session.close()
+
+
+_client: HelloAssoClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HelloAssoClient:
+    """Return the HelloAsso client of this process"""
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HelloAssoClient()
+    return _client
+
+
+def reset_client() -> None:
+    """
+    Drop the client of this process and the shared token, the next call
+    creates a new client
+    """
+    global _client  # pylint: disable=global-statement
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        cache.delete(TOKEN_CACHE_KEY)
@@ -0,0 +1,73 @@
+"""
+Command handler to run a local HelloAsso stand-in.
+
+Start it, then run the backend with `HELLOASSO_URL` pointing to it: payments
+are accepted without reaching HelloAsso, and the notifications are sent to the
+webhook given with `--webhook`.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from insalan.payment.fake_helloasso import FakeHelloAsso
+
+
+class Command(BaseCommand):
+    """The `fake_helloasso` command handler class"""
+
+    help = "Run a local server imitating the HelloAsso API"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add declarations for the arguments this command will take"""
+        parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+        parser.add_argument("--port", type=int, default=8090, help="Port to listen on")
+        parser.add_argument(
+            "--webhook",
+            default="http://localhost:8000/v1/payment/notifications/",
+            help="URL the notifications are sent to",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0, help="Seconds added to every API call"
+        )
+        parser.add_argument(
+            "--failure-rate", type=float, default=0, help="Ratio of API calls failing with a 503"
+        )
+        parser.add_argument(
+            "--refusal-rate", type=float, default=0, help="Ratio of refused payments"
+        )
+        parser.add_argument(
+            "--duplicate-rate", type=float, default=0, help="Ratio of notifications sent twice"
+        )
+        parser.add_argument(
+            "--loss-rate", type=float, default=0, help="Ratio of notifications never sent"
+        )
+        parser.add_argument(
+            "--payment-delay",
+            type=float,
+            default=1,
+            help="Seconds between a checkout and its payment",
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        fake = FakeHelloAsso(
+            options["webhook"],
+            options["host"],
+            options["port"],
+            latency=options["latency"],
+            failure_rate=options["failure_rate"],
+            refusal_rate=options["refusal_rate"],
+            duplicate_rate=options["duplicate_rate"],
+            loss_rate=options["loss_rate"],
+            payment_delay=options["payment_delay"],
+        )
+        self.stdout.write(
+            f"Fake HelloAsso listening on {fake.url}, set HELLOASSO_URL={fake.url}"
+        )
+        try:
+            fake.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            fake.stop()
@@ -0,0 +1,293 @@
+"""
+Command handler to benchmark the payment pipeline.
+
+The backend is served on a local port and HelloAsso is replaced by a local
+stand-in, then players pay their registration: each checkout goes through
+`PayView`, the fake HelloAsso notifies the webhook, and the notifications are
+processed until the ticket is created and its mail queued. Nothing leaves the
+machine, and every row created by the benchmark is deleted at the end.
+"""
+
+import io
+import os
+import secrets
+import statistics
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from os import path
+from typing import Any
+
+import requests
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.core.servers.basehttp import ThreadedWSGIServer, get_internal_wsgi_application
+from django.test import Client, override_settings
+from django.test.testcases import QuietWSGIRequestHandler
+from django.urls import get_resolver, reverse
+from PIL import Image
+
+from insalan import settings as app_settings
+from insalan.management.commands.mail_benchmark import percentile
+from insalan.models import OutboxMail
+from insalan.payment.fake_helloasso import FakeHelloAsso
+from insalan.payment.helloasso import reset_client
+from insalan.payment.models import Notification, Transaction, TransactionStatus
+from insalan.scheduler import scheduler
+from insalan.tickets.models import Ticket
+from insalan.tournament.models import Event, EventTournament, Game, Player, Team
+from insalan.user.models import User
+
+
+@contextmanager
+def helloasso_at(url: str) -> Iterator[None]:
+    """Send the HelloAsso API calls to another server"""
+    previous = app_settings.HA_URL
+    app_settings.HA_URL = url
+    reset_client()
+    try:
+        yield
+    finally:
+        app_settings.HA_URL = previous
+        reset_client()
+
+
+@contextmanager
+def serve_backend() -> Iterator[str]:
+    """Serve the backend on a free local port, and return its URL"""
+    server = ThreadedWSGIServer(("127.0.0.1", 0), QuietWSGIRequestHandler)
+    # WSGIHandler.__call__ returns a response, which the stubs do not see as iterable
+    server.set_app(get_internal_wsgi_application())  # type: ignore[arg-type]
+    with ThreadPoolExecutor(max_workers=1) as thread:
+        thread.submit(server.serve_forever)
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "127.0.0.1"]):
+                yield f"http://127.0.0.1:{server.server_address[1]}"
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class Command(BaseCommand):
+    """The `payment_benchmark` command handler class"""
+
+    prefix = "paybench"
+
+    help = "Measure the throughput of the checkout to ticket pipeline against a fake HelloAsso"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add declarations for the arguments this command will take"""
+        parser.add_argument(
+            "--count", type=int, default=100, help="Number of players paying their registration"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8, help="Number of checkouts made at once"
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0, help="Seconds added to every HelloAsso call"
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0,
+            help="Ratio of HelloAsso calls failing with a 503",
+        )
+        parser.add_argument(
+            "--refusal-rate", type=float, default=0, help="Ratio of refused payments"
+        )
+        parser.add_argument(
+            "--duplicate-rate", type=float, default=0, help="Ratio of notifications sent twice"
+        )
+        parser.add_argument(
+            "--payment-delay",
+            type=float,
+            default=0,
+            help="Seconds between a checkout and its payment",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=300,
+            help="Give up waiting for the tickets after this many seconds",
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        if not path.exists(path.join(settings.STATIC_ROOT, "images/logo.png")):
+            raise CommandError(
+                "Tickets need the static files, run `manage.py collectstatic` first"
+            )
+        # Loading the URLs registers the mailers, and starts the scheduler,
+        # which must not deliver the mails of the benchmark
+        get_resolver().url_patterns  # pylint: disable=expression-not-assigned
+        scheduler.pause()
+
+        self.prefix = f"paybench{os.getpid()}"
+        tourney = self.create_tournament(self.prefix)
+        try:
+            with serve_backend() as backend_url, FakeHelloAsso(
+                f"{backend_url}{reverse('payment:notifications')}",
+                latency=options["latency"],
+                failure_rate=options["failure_rate"],
+                refusal_rate=options["refusal_rate"],
+                duplicate_rate=options["duplicate_rate"],
+                payment_delay=options["payment_delay"],
+            ) as fake, helloasso_at(fake.url):
+                self.run(backend_url, fake, tourney, options)
+        finally:
+            self.clean_up(tourney)
+            scheduler.resume()
+
+    def create_tournament(self, prefix: str) -> EventTournament:
+        """Tournament the players register to, with a generated logo"""
+        event = Event.objects.create(
+            name=f"Benchmark {prefix}",
+            description="",
+            date_start=date.today(),
+            date_end=date.today() + timedelta(days=2),
+        )
+        game = Game.objects.create(name=f"Benchmark {prefix}", short_name="BNC")
+        logo = io.BytesIO()
+        Image.new("RGB", (1200, 600), (44, 41, 45)).save(logo, format="PNG")
+        return EventTournament.objects.create(
+            event=event,
+            game=game,
+            name=f"Benchmark {prefix}",
+            is_announced=True,
+            player_price_online=20,
+            logo=ContentFile(logo.getvalue(), name=f"{prefix}.png"),
+        )
+
+    def run(self, backend_url: str, fake: FakeHelloAsso, tourney: EventTournament,
+            options: dict[str, Any]) -> None:
+        """Register the players, pay and report"""
+        count = options["count"]
+        users = User.objects.bulk_create([
+            User(
+                username=f"{self.prefix}_{i}",
+                email=f"{self.prefix}_{i}@example.net",
+                first_name="Jane",
+                last_name="Doe",
+            )
+            for i in range(count)
+        ])
+        teams = Team.objects.bulk_create([
+            Team(name=f"Équipe {i}", tournament=tourney) for i in range(count)
+        ])
+        Player.objects.bulk_create([
+            Player(user=user, team=team, name_in_game=user.username)
+            for user, team in zip(users, teams)
+        ])
+        assert tourney.player_online_product is not None
+        product_id = tourney.player_online_product.id
+
+        pay_url = f"{backend_url}{reverse('payment:pay')}"
+        # Log the players in beforehand, the checkouts only make HTTP calls
+        clients = {user.id: Client() for user in users}
+        for user in users:
+            clients[user.id].force_login(user)
+
+        def checkout(user: User) -> tuple[int, float, float]:
+            """Pay the registration of a player"""
+            csrf_token = secrets.token_hex(16)
+            cookies = {
+                settings.SESSION_COOKIE_NAME:
+                    clients[user.id].cookies[settings.SESSION_COOKIE_NAME].value,
+                settings.CSRF_COOKIE_NAME: csrf_token,
+            }
+            start = time.perf_counter()
+            response = requests.post(
+                pay_url,
+                json={"products": [product_id]},
+                cookies=cookies,
+                headers={"X-CSRFToken": csrf_token},
+                timeout=60,
+            )
+            return response.status_code, start, time.perf_counter()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            checkouts = dict(zip((user.id for user in users), pool.map(checkout, users)))
+        succeeded = {uid: c for uid, c in checkouts.items() if c[0] == 200}
+        checkout_latencies = [end - begin for _, begin, end in checkouts.values()]
+        self.stdout.write(
+            f"Checkouts: {len(succeeded)}/{count} succeeded in "
+            f"{time.perf_counter() - start:.3f}s, latency "
+            f"p50 {percentile(checkout_latencies, 0.5):.3f}s, "
+            f"p95 {percentile(checkout_latencies, 0.95):.3f}s"
+        )
+
+        ticketed = self.wait_for_tickets(tourney, succeeded, options["timeout"])
+        duration = max(ticketed.values(), default=start) - start
+        refused = Transaction.objects.filter(
+            payer__in=succeeded.keys(), payment_status=TransactionStatus.FAILED
+        ).count()
+        self.stdout.write(
+            f"Tickets: {len(ticketed)} created, {refused} payments refused, "
+            f"{len(ticketed) / duration if duration else 0:.1f} tickets/s"
+        )
+        latencies = [
+            ticketed_at - succeeded[uid][1]
+            for uid, ticketed_at in ticketed.items()
+            if uid in succeeded
+        ]
+        if latencies:
+            self.stdout.write(
+                "Checkout to ticket latency: "
+                f"p50 {percentile(latencies, 0.5):.3f}s, "
+                f"p95 {percentile(latencies, 0.95):.3f}s, "
+                f"max {max(latencies):.3f}s, "
+                f"mean {statistics.fmean(latencies):.3f}s"
+            )
+        stats = fake.stats
+        self.stdout.write(
+            f"HelloAsso: {stats.tokens} tokens, {stats.intents} intents, "
+            f"{stats.injected_errors} injected errors, {stats.notifications} notifications "
+            f"({stats.duplicates} duplicates, {stats.webhook_errors} webhook errors)"
+        )
+        for client in clients.values():
+            client.logout()
+        if len(ticketed) + refused < len(succeeded):
+            raise CommandError(
+                f"Only {len(ticketed) + refused} of {len(succeeded)} payments were processed"
+            )
+
+    def wait_for_tickets(self, tourney: EventTournament, succeeded: dict[int, Any],
+                         timeout: float) -> dict[int, float]:
+        """Wait for the paid registrations, and return when each ticket appeared"""
+        ticketed: dict[int, float] = {}
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            for user_id in Ticket.objects.filter(tournament=tourney).exclude(
+                user_id__in=ticketed.keys()
+            ).values_list("user_id", flat=True):
+                ticketed[user_id] = now
+            # Checkouts that failed also fail their transaction
+            refused = Transaction.objects.filter(
+                payer__in=succeeded.keys(), payment_status=TransactionStatus.FAILED
+            ).count()
+            if len(ticketed) + refused >= len(succeeded):
+                break
+            time.sleep(0.05)
+        return ticketed
+
+    def clean_up(self, tourney: EventTournament) -> None:
+        """Delete everything the benchmark created"""
+        users = User.objects.filter(username__startswith=f"{self.prefix}_")
+        emails = list(users.values_list("email", flat=True))
+        for mail in OutboxMail.objects.filter(to__overlap=emails):
+            mail.delete()
+            mail.release_attachments()
+        transactions = Transaction.objects.filter(payer__in=users)
+        Notification.objects.filter(transaction_uuid__in=transactions.values("id")).delete()
+        transactions.delete()
+        tourney.logo.delete(save=False)
+        event, game = tourney.event, tourney.game
+        event.delete()
+        users.delete()
+        game.delete()
@@ -0,0 +1,26 @@
+"""
+Command handler to reconcile the pending transactions with HelloAsso.
+
+The same reconciliation runs periodically in the scheduler, this command runs
+it right away, for instance after an outage of the webhook.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from insalan.payment.reconciliation import reconcile_transactions
+
+
+class Command(BaseCommand):
+    """The `reconcile_transactions` command handler class"""
+
+    help = "Settle the stale pending transactions with the state known to HelloAsso"
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        result = reconcile_transactions()
+        self.stdout.write(
+            f"Checked {result.checked} transactions: {result.notified} paid, "
+            f"{result.expired} expired, {result.errors} errors"
+        )
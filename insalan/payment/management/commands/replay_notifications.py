@@ -0,0 +1,48 @@
+"""
+Command handler to replay the HelloAsso notifications that failed.
+
+Fix what made them fail first (missing transaction, bug in a hook...), the
+notifications are then processed again, in the order they were received.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from insalan.payment.models import Notification
+from insalan.payment.notifications import replay_notifications
+
+
+class Command(BaseCommand):
+    """The `replay_notifications` command handler class"""
+
+    help = "Process the failed HelloAsso notifications again"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add declarations for the arguments this command will take"""
+        parser.add_argument(
+            "--id",
+            type=int,
+            action="append",
+            dest="ids",
+            help="Only replay this notification (can be repeated)",
+        )
+        parser.add_argument(
+            "--transaction",
+            help="Only replay the notifications of this transaction",
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        notifications = Notification.objects.filter(status=Notification.Status.FAILED)
+        if options["ids"]:
+            notifications = notifications.filter(id__in=options["ids"])
+        if options["transaction"]:
+            notifications = notifications.filter(transaction_uuid=options["transaction"])
+
+        total = notifications.count()
+        succeeded = replay_notifications(notifications)
+        self.stdout.write(f"Replayed {total} notifications, {succeeded} succeeded")
+        # Evaluated again: only the notifications that failed again are left
+        for notification in notifications.all():
+            self.stdout.write(f"  {notification.id} ({notification}): {notification.last_error}")
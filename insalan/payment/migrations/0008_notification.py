@@ -0,0 +1,37 @@
+# Generated by Django 4.1.12 on 2026-10-19 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0007_alter_product_associated_tournament_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dedupe_key', models.CharField(editable=False, max_length=64, unique=True, verbose_name='Clé de déduplication')),
+                ('transaction_uuid', models.UUIDField(editable=False, verbose_name='Transaction')),
+                ('event_type', models.CharField(blank=True, max_length=32, verbose_name="Type d'évènement")),
+                ('payload', models.JSONField(verbose_name='Contenu')),
+                ('status', models.CharField(choices=[('PE', 'En attente'), ('DO', 'Traitée'), ('FA', 'Échec')], default='PE', max_length=2, verbose_name='Statut')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Nombre de tentatives')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Dernière erreur')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Date de réception')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Date de traitement')),
+            ],
+            options={
+                'verbose_name': 'Notification HelloAsso',
+                'verbose_name_plural': 'Notifications HelloAsso',
+                'ordering': ['received_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['status', 'transaction_uuid', 'received_at'], name='notification_status_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.12 on 2026-10-19 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0008_notification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['payment_status', 'last_modification_date'], name='transaction_status_date_idx'),
+        ),
+    ]
@@ -2,7 +2,9 @@
 
 from __future__ import annotations
 
+import hashlib
 import itertools
+import json
 import logging
 import uuid
 from datetime import datetime
@@ -10,7 +12,7 @@ from decimal import Decimal
 from typing import Any, Callable, Type, TYPE_CHECKING
 
 from django.db import models
-from django.db.models import CharField, ForeignKey
+from django.db.models import CharField, F, ForeignKey, Sum
 from django.db.models.query import QuerySet
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -151,6 +153,13 @@ class Transaction(models.Model):
         """Meta information"""
 
         ordering = ["-last_modification_date"]
+        indexes = [
+            # Stale pending transactions, and lists by status
+            models.Index(
+                fields=["payment_status", "last_modification_date"],
+                name="transaction_status_date_idx",
+            ),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     payer = ForeignKey(
@@ -195,19 +204,17 @@ class Transaction(models.Model):
         verbose_name=_("Réductions")
     )
 
+    # Products of the transaction with their count, see `get_product_counts`
+    _product_counts: list[ProductCount] | None = None
+
     @staticmethod
     def new(**data: Any) -> Transaction:
         """create a new transaction based on products id list and a payer"""
-        fields = {}
-        fields["creation_date"] = timezone.make_aware(datetime.now())
-        fields["last_modification_date"] = fields["creation_date"]
-        fields["payer"] = data["payer"]
-        transaction = Transaction.objects.create(**fields)
-        data["products"].sort(key=lambda x: int(x.id))
-        for pid, grouper in itertools.groupby(data["products"]):
+        products = sorted(data["products"], key=lambda x: int(x.id))
+        counts: list[tuple[Product, int]] = []
+        for pid, grouper in itertools.groupby(products):
             # Validate that the products can be bought
             if not pid.can_be_bought_now():
-                transaction.delete()
                 raise ValidationError(
                     {
                         "error": _("Le produit %(id)s est actuellement indisponible")
@@ -215,23 +222,37 @@ class Transaction(models.Model):
                     }
                 )
             if pid.associated_tournament and not pid.associated_tournament.is_announced:
-                transaction.delete()
                 raise ValidationError(
                     {
                         "error": _("Le tournoi %(id)s est actuellement indisponible")
                         % {"id": pid.associated_tournament.id}
                     }
                 )
-            count = len(list(grouper))
-            proc = ProductCount.objects.create(
-                transaction=transaction,
-                product=pid,
-                count=count,
-            )
-            proc.save()
-        transaction.synchronize_amount()
+            counts.append((pid, len(list(grouper))))
+
+        fields: dict[str, Any] = {}
+        fields["creation_date"] = timezone.make_aware(datetime.now())
+        fields["last_modification_date"] = fields["creation_date"]
+        fields["payer"] = data["payer"]
+        # The products are already loaded, no need to aggregate them again
+        fields["amount"] = sum(
+            (product.price * count for product, count in counts), Decimal(0)
+        )
+        transaction = Transaction.objects.create(**fields)
+        transaction._product_counts = ProductCount.objects.bulk_create([
+            ProductCount(transaction=transaction, product=product, count=count)
+            for product, count in counts
+        ])
         return transaction
 
+    def get_product_counts(self) -> list[ProductCount]:
+        """Return the products of the transaction with their count, fetched once"""
+        if self._product_counts is None:
+            self._product_counts = list(
+                ProductCount.objects.filter(transaction=self).select_related("product")
+            )
+        return self._product_counts
+
     def product_callback(
         self,
         key: Callable[[Type[PaymentHooks]], Callable[[Transaction, Product, int], None]],
@@ -240,7 +261,7 @@ class Transaction(models.Model):
         # pylint: disable-next=import-outside-toplevel
         from insalan.payment.hooks import PaymentCallbackSystem
 
-        for proccount in ProductCount.objects.filter(transaction=self):
+        for proccount in self.get_product_counts():
             assert proccount.product is not None
             # Get callback class
             cls = PaymentCallbackSystem.retrieve_handler(proccount.product.category)
@@ -255,7 +276,7 @@ class Transaction(models.Model):
         # pylint: disable-next=import-outside-toplevel
         from insalan.payment.hooks import PaymentCallbackSystem
 
-        for proccount in ProductCount.objects.filter(transaction=self):
+        for proccount in self.get_product_counts():
             assert proccount.product is not None
             # Get callback class
             cls = PaymentCallbackSystem.retrieve_handler(proccount.product.category)
@@ -348,10 +369,10 @@ class Transaction(models.Model):
 
     def synchronize_amount(self) -> None:
         """Recompute the amount from the product list"""
-        self.amount = Decimal(0.00)
-        for proc in ProductCount.objects.filter(transaction=self):
-            assert proc.product is not None
-            self.amount += proc.product.price * proc.count
+        total = ProductCount.objects.filter(transaction=self).aggregate(
+            total=Sum(F("product__price") * F("count"))
+        )["total"]
+        self.amount = total if total is not None else Decimal(0.00)
         self.save()
 
     def touch(self) -> None:
@@ -477,3 +498,66 @@ class Discount(models.Model):
         self.used = True
         self.used_date = timezone.make_aware(datetime.now())
         self.save()
+
+
+class Notification(models.Model):
+    """
+    A notification received from HelloAsso
+
+    Notifications are stored as received and acknowledged right away, then
+    processed in the background, in order for each transaction.
+    """
+
+    class Status(models.TextChoices):
+        """Processing status of a notification"""
+        PENDING = "PE", _("En attente")
+        PROCESSED = "DO", _("Traitée")
+        FAILED = "FA", _("Échec")
+
+    class Meta:
+        """Meta information"""
+
+        verbose_name = _("Notification HelloAsso")
+        verbose_name_plural = _("Notifications HelloAsso")
+        ordering = ["received_at", "id"]
+        indexes = [
+            models.Index(
+                fields=["status", "transaction_uuid", "received_at"],
+                name="notification_status_idx",
+            ),
+        ]
+
+    id: int
+    dedupe_key = CharField(
+        max_length=64,
+        unique=True,
+        editable=False,
+        verbose_name=_("Clé de déduplication"),
+    )
+    transaction_uuid = models.UUIDField(editable=False, verbose_name=_("Transaction"))
+    event_type = CharField(max_length=32, blank=True, verbose_name=_("Type d'évènement"))
+    payload = models.JSONField(verbose_name=_("Contenu"))
+    status = CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name=_("Statut"),
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_("Nombre de tentatives"))
+    last_error = models.TextField(blank=True, default="", verbose_name=_("Dernière erreur"))
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Date de réception"))
+    processed_at = models.DateTimeField(
+        null=True, blank=True, verbose_name=_("Date de traitement")
+    )
+
+    def __str__(self) -> str:
+        return f"{self.event_type} {self.transaction_uuid}"
+
+    @staticmethod
+    def make_dedupe_key(payload: Any) -> str:
+        """
+        Key of a notification: HelloAsso sends the same body again when it
+        retries a notification
+        """
+        body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(body.encode()).hexdigest()
@@ -0,0 +1,288 @@
+"""
+Processing of the HelloAsso notifications
+
+The webhook only stores the notifications. They are processed here, by a pool
+of threads, in the order they were received for each transaction: the
+transaction row is locked while its notifications are processed, so a single
+worker handles a given transaction at a time, whichever process it runs in.
+
+Processing is idempotent, so a notification HelloAsso sent twice, or a failed
+notification replayed, does not create payments or tickets twice.
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any
+from uuid import UUID
+
+from django.db import connection, transaction
+from django.db.models import Min, QuerySet
+from django.utils import timezone
+
+from insalan import settings as app_settings
+
+from .models import Notification, Payment, Transaction
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=app_settings.HA_NOTIFICATION_WORKERS,
+    thread_name_prefix="helloasso-notifications",
+)
+
+
+class NotificationError(Exception):
+    """The content of a notification is invalid"""
+
+
+def handle_order(trans_obj: Transaction, data: Any) -> None:
+    """Tie the transaction to its order, and record the payments"""
+    # From "Order", get the payments
+    # Check that the id is an integer
+    order_id = data.get("id")
+    if not isinstance(order_id, int):
+        raise NotificationError(
+            f"Invalid ID for Order event, except integer, got {order_id}"
+        )
+
+    logger.info("Tied transaction %s to order ID %s", trans_obj.id, order_id)
+    trans_obj.order_id = order_id
+    trans_obj.touch()
+    trans_obj.save()
+
+    # Retrieve the payer's name which will be useful for the event
+    payer = trans_obj.payer
+    if payer is not None:
+        data_first_name = data.get("payer", {}).get("firstName", "")
+        data_last_name = data.get("payer", {}).get("lastName", "")
+        modified = False
+        if data_first_name != "" and payer.first_name == "":
+            payer.first_name = data_first_name
+            modified = True
+        if data_last_name != "" and payer.last_name == "":
+            payer.last_name = data_last_name
+            modified = True
+        if modified or payer.first_name == "" or payer.last_name == "":
+            payer.confirm_name = True
+        payer.save()
+
+    payments = data.get("payments")
+    if payments is None:
+        logger.warning(
+            "No payment data found while trying to validate transaction %s. Is that right?",
+            order_id,
+        )
+        return
+
+    for pay_data in payments:
+        pid = pay_data.get("id")
+        if pid is None:
+            logger.warning(
+                "No identifier found on payment for transaction %s!!", order_id
+            )
+            continue
+        amount = pay_data.get("amount")
+        if amount is None:
+            logger.warning(
+                "No amount found on payment for transaction %s's payment %s!!",
+                order_id,
+                pid,
+            )
+            continue
+        if not isinstance(amount, int):
+            logger.warning(
+                # pylint: disable-next=line-too-long
+                "Amount for payment %s of transaction %s is not an integer. This may be fine, but beware.",
+                pid,
+                order_id,
+            )
+        amount = Decimal(amount) / 100
+        _, created = Payment.objects.get_or_create(
+            id=pid, defaults={"amount": amount, "transaction": trans_obj}
+        )
+        if created:
+            logger.info(
+                "Created payment %d tied to transaction %s", pid, trans_obj.id
+            )
+
+
+def handle_payment(trans_obj: Transaction, data: Any) -> None:
+    """Apply the new state of a payment to the transaction"""
+    # Because we are in single payment, this is our signal to validate
+    pay_id = data.get("id")
+    if pay_id is None:
+        raise NotificationError("Payment ID is none for payment event!")
+    if not isinstance(pay_id, int):
+        raise NotificationError(f'Payment ID "{pay_id}" is not an integer')
+
+    # The payment could be "None" if we haven't received "Order" yet
+    pay_obj = Payment.objects.filter(id=pay_id).first()
+    if pay_obj is not None and pay_obj.transaction_id != trans_obj.id:
+        raise NotificationError(
+            # pylint: disable-next=line-too-long
+            f"Mismatch! Payment {pay_id} is known to belong to transaction {pay_obj.transaction_id} but HA metadata says {trans_obj.id}"
+        )
+
+    order_id = data.get("order", {}).get("id")
+    if order_id is None:
+        raise NotificationError(f"Payment {pay_id} has no order field or no order.id field")
+    if not isinstance(order_id, int):
+        raise NotificationError(f"Payment {pay_id} has an order.id field that is not int")
+
+    if pay_obj is not None and trans_obj.order_id != order_id:
+        raise NotificationError(
+            # pylint: disable-next=line-too-long
+            f"Mismatch! Payment {pay_id} is known to belong to order {trans_obj.order_id} but HA data says {order_id}"
+        )
+    if pay_obj is None:
+        logger.warning(
+            "Validating transaction %s based on payment %s to be generated later",
+            trans_obj.id,
+            pay_id,
+        )
+
+    # Check the state. The transitions are no-ops when the transaction is
+    # already in the target state, which makes replays harmless.
+    state = data.get("state")
+    if state == "Authorized":
+        # Ok we should be good now
+        trans_obj.validate_transaction()
+
+    elif state in ["Refused", "Unknown"]:
+        # This code should show that a payment failed
+        trans_obj.fail_transaction()
+
+    elif state in ["Refunded"]:
+        # Refund
+        trans_obj.refund_transaction()
+
+    else:
+        logger.warning(
+            'Payment %s shows status "%s" unknown or already assigned',
+            pay_id,
+            state,
+        )
+
+
+def apply_notification(notification: Notification, trans_obj: Transaction) -> None:
+    """Apply a notification to its transaction"""
+    data = notification.payload.get("data") or {}
+    if notification.event_type == "Order":
+        handle_order(trans_obj, data)
+    elif notification.event_type == "Form":
+        # Those notifications are mostly useless, it's about changes to the
+        # org
+        pass
+    elif notification.event_type == "Payment":
+        handle_payment(trans_obj, data)
+    else:
+        raise NotificationError(
+            f"Unrecognized payment notification event type {notification.event_type}"
+        )
+
+
+def process_transaction(transaction_uuid: UUID) -> int:
+    """
+    Process the pending notifications of a transaction, in order
+
+    Return the number of notifications processed, 0 if another worker is
+    already processing this transaction.
+    """
+    with transaction.atomic():
+        trans_obj = (
+            Transaction.objects.select_for_update(skip_locked=True)
+            .filter(id=transaction_uuid)
+            .first()
+        )
+        if trans_obj is None and Transaction.objects.filter(id=transaction_uuid).exists():
+            # Locked by another worker, which will process the notifications
+            return 0
+        notifications = list(
+            Notification.objects.select_for_update(skip_locked=True).filter(
+                transaction_uuid=transaction_uuid, status=Notification.Status.PENDING
+            )
+        )
+
+        for notification in notifications:
+            notification.attempts += 1
+            try:
+                if trans_obj is None:
+                    raise NotificationError(f"Unable to find transaction {transaction_uuid}")
+                with transaction.atomic():
+                    apply_notification(notification, trans_obj)
+            # A broken notification must not block the others
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to process notification %s", notification.id)
+                notification.status = Notification.Status.FAILED
+                notification.last_error = str(err)
+                if trans_obj is not None:
+                    # Forget the changes that were rolled back
+                    trans_obj.refresh_from_db()
+            else:
+                notification.status = Notification.Status.PROCESSED
+                notification.last_error = ""
+                notification.processed_at = timezone.now()
+
+        Notification.objects.bulk_update(
+            notifications, ["status", "attempts", "last_error", "processed_at"]
+        )
+    return len(notifications)
+
+
+def _process_in_thread(transaction_uuid: UUID) -> int:
+    """Process a transaction from a thread of the pool"""
+    try:
+        return process_transaction(transaction_uuid)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to process the notifications of %s", transaction_uuid)
+        return 0
+    finally:
+        # Threads of the pool each have their own connection
+        connection.close()
+
+
+def process_notifications() -> int:
+    """Process every pending notification, and return how many were processed"""
+    transaction_uuids = [
+        row["transaction_uuid"]
+        for row in Notification.objects.filter(status=Notification.Status.PENDING)
+        .values("transaction_uuid")
+        .annotate(first=Min("received_at"))
+        .order_by("first")
+    ]
+    return sum(executor.map(_process_in_thread, transaction_uuids))
+
+
+def schedule_processing(transaction_uuid: UUID) -> None:
+    """Process the notifications of a transaction in the background"""
+    if "test" in sys.argv:
+        # Tests expect the notification to be processed when the view returns
+        process_transaction(transaction_uuid)
+        return
+    transaction.on_commit(lambda: executor.submit(_process_in_thread, transaction_uuid))
+
+
+def replay_notifications(notifications: QuerySet[Notification]) -> int:
+    """
+    Process failed notifications again, and return how many succeeded
+
+    They are processed in the current thread, after the pending notifications
+    received before them for the same transaction.
+    """
+    transaction_uuids = set(
+        notifications.filter(status=Notification.Status.FAILED)
+        .values_list("transaction_uuid", flat=True)
+    )
+    replayed = list(
+        notifications.filter(status=Notification.Status.FAILED).values_list("id", flat=True)
+    )
+    Notification.objects.filter(id__in=replayed).update(status=Notification.Status.PENDING)
+    for transaction_uuid in transaction_uuids:
+        process_transaction(transaction_uuid)
+    return Notification.objects.filter(
+        id__in=replayed, status=Notification.Status.PROCESSED
+    ).count()
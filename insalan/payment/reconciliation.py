@@ -0,0 +1,176 @@
+"""
+Reconciliation of the transactions with HelloAsso
+
+A transaction stays pending until its notifications are received. When one is
+lost, the state of the checkout intent is fetched back from HelloAsso: paid
+intents are turned into the notifications we should have received, and
+processed like them, while intents that were abandoned are expired.
+"""
+
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any
+from uuid import UUID
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from insalan import settings as app_settings
+
+from .helloasso import HelloAssoError, get_client
+from .models import Notification, Transaction, TransactionStatus
+from .notifications import process_transaction
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReconciliationResult:
+    """What a reconciliation did"""
+    checked: int = 0
+    notified: int = 0
+    expired: int = 0
+    errors: int = 0
+
+
+def stale_transactions() -> list[Transaction]:
+    """Pending transactions that were not modified for a while"""
+    threshold = timezone.now() - timedelta(seconds=app_settings.HA_RECONCILE_AFTER)
+    # Served by the (payment_status, last_modification_date) index
+    return list(
+        Transaction.objects.filter(
+            payment_status=TransactionStatus.PENDING,
+            last_modification_date__lt=threshold,
+        )
+        .order_by("last_modification_date")
+        .only("id", "intent_id", "creation_date")
+    )
+
+
+def intent_notifications(trans_obj: Transaction, intent: dict[str, Any]) -> list[Notification]:
+    """
+    The Order and Payment notifications HelloAsso sends for a paid intent,
+    none if it was not paid yet
+    """
+    order = intent.get("order")
+    if not order:
+        return []
+    metadata = {"uuid": str(trans_obj.id)}
+    payments = order.get("payments") or []
+    payloads: list[dict[str, Any]] = [{
+        "eventType": "Order",
+        "data": {
+            "id": order.get("id"),
+            "payments": [
+                {"id": payment.get("id"), "amount": payment.get("amount")}
+                for payment in payments
+            ],
+        },
+        "metadata": metadata,
+    }]
+    payloads += [
+        {
+            "eventType": "Payment",
+            "data": {
+                "id": payment.get("id"),
+                "amount": payment.get("amount"),
+                "state": payment.get("state"),
+                "order": {"id": order.get("id")},
+            },
+            "metadata": metadata,
+        }
+        for payment in payments
+    ]
+    return [
+        Notification(
+            dedupe_key=Notification.make_dedupe_key(payload),
+            transaction_uuid=trans_obj.id,
+            event_type=payload["eventType"],
+            payload=payload,
+        )
+        for payload in payloads
+    ]
+
+
+def fetch_intent(intent_id: int) -> dict[str, Any] | None:
+    """
+    Fetch a checkout intent from a thread of the pool, None if HelloAsso does
+    not know it
+    """
+    try:
+        return get_client().get_checkout_intent(intent_id)
+    except HelloAssoError as err:
+        if err.status == 404:
+            return None
+        raise
+    finally:
+        connection.close()
+
+
+def reconcile_transactions() -> ReconciliationResult:
+    """Settle the stale pending transactions with the state known to HelloAsso"""
+    result = ReconciliationResult()
+    stale = stale_transactions()
+    result.checked = len(stale)
+    if not stale:
+        return result
+
+    expiry = timezone.now() - timedelta(seconds=app_settings.HA_INTENT_EXPIRY)
+    expired: list[UUID] = []
+    notifications: list[Notification] = []
+    batch_size = app_settings.HA_RECONCILE_BATCH
+    with ThreadPoolExecutor(
+        max_workers=app_settings.HA_POOL_SIZE, thread_name_prefix="helloasso-reconcile"
+    ) as pool:
+        for start in range(0, len(stale), batch_size):
+            batch = stale[start:start + batch_size]
+            futures = []
+            for trans_obj in batch:
+                if trans_obj.intent_id is not None:
+                    futures.append((trans_obj, pool.submit(fetch_intent, trans_obj.intent_id)))
+                elif trans_obj.creation_date < expiry:
+                    # The intent could not be created, nothing was paid
+                    expired.append(trans_obj.id)
+            for trans_obj, future in futures:
+                try:
+                    intent = future.result()
+                except HelloAssoError as err:
+                    logger.warning("Unable to reconcile transaction %s: %s", trans_obj.id, err)
+                    result.errors += 1
+                    continue
+                found = intent_notifications(trans_obj, intent) if intent is not None else []
+                if found:
+                    notifications += found
+                elif trans_obj.creation_date < expiry:
+                    expired.append(trans_obj.id)
+
+    if notifications:
+        # The notifications may have been received meanwhile, they are not
+        # recorded twice
+        Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+        paid = {notification.transaction_uuid for notification in notifications}
+        result.notified = len(paid)
+        logger.info("Recovered the notifications of %d transactions", result.notified)
+        for transaction_uuid in paid:
+            process_transaction(transaction_uuid)
+
+    for transaction_id in expired:
+        # Failed one at a time, so that the failure hooks run, skipping the
+        # transactions a notification is being processed for
+        with transaction.atomic():
+            abandoned = (
+                Transaction.objects.select_for_update(skip_locked=True)
+                .filter(id=transaction_id, payment_status=TransactionStatus.PENDING)
+                .first()
+            )
+            if abandoned is None:
+                continue
+            abandoned.fail_transaction()
+        result.expired += 1
+    if result.expired:
+        logger.info("Expired %d abandoned transactions", result.expired)
+    return result
@@ -11,10 +11,43 @@ from .models import Transaction, Product
 logger = logging.getLogger(__name__)
 
 
+class BulkPrimaryKeyListField(serializers.ManyRelatedField):
+    """
+    List of primary keys resolved with a single query, instead of one per key
+
+    Duplicates are kept, a product bought twice is listed twice.
+    """
+
+    def to_internal_value(self, data: Any) -> list[Any]:
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+
+        child = self.child_relation
+        keys = []
+        for key in data:
+            if isinstance(key, bool):
+                child.fail("incorrect_type", data_type=type(key).__name__)
+            try:
+                keys.append(int(key))
+            except (TypeError, ValueError):
+                child.fail("incorrect_type", data_type=type(key).__name__)
+        objects = child.get_queryset().in_bulk(set(keys))
+        for key in keys:
+            if key not in objects:
+                child.fail("does_not_exist", pk_value=key)
+        return [objects[key] for key in keys]
+
+
 class TransactionSerializer(serializers.ModelSerializer[Transaction]):
 
     payer = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-    products = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), many=True)
+    products = BulkPrimaryKeyListField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Product.objects.select_related("associated_tournament")
+        )
+    )
 
     class Meta:
         model = Transaction
@@ -1 +1,725 @@
-# Create your tests here.
+"""Payment Module Tests"""
+
+import json
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import FileResponse
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from insalan.payment.fake_helloasso import FakeHelloAsso
+from insalan.payment.helloasso import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HelloAssoClient,
+    HelloAssoError,
+    reset_client,
+)
+from insalan.payment.models import (
+    Discount,
+    Notification,
+    Payment,
+    Product,
+    ProductCount,
+    Transaction,
+    TransactionStatus,
+)
+from insalan.payment.reconciliation import reconcile_transactions
+from insalan.payment.tokens import TOKEN_CACHE_KEY, Token
+from insalan.testing import asgi_body
+from insalan.user.models import User
+
+
+def make_response(status_code: int, body: object) -> MagicMock:
+    """Build a fake `requests` response"""
+    response = MagicMock(spec=requests.Response)
+    response.status_code = status_code
+    response.ok = status_code < 400
+    response.json.return_value = body
+    response.text = str(body)
+    return response
+
+
+def token_response(access: str, expires_in: int = 1800) -> MagicMock:
+    """Build a fake response of the OAuth endpoint"""
+    return make_response(
+        200,
+        {"access_token": access, "refresh_token": f"refresh-{access}", "expires_in": expires_in},
+    )
+
+
+class TokenTestCase(SimpleTestCase):
+    """Tests of the HelloAsso OAuth token"""
+
+    def setUp(self) -> None:
+        cache.delete(TOKEN_CACHE_KEY)
+        self.session = MagicMock(spec=requests.Session)
+        self.token = Token(self.session)
+        self.addCleanup(self.token.stop)
+        self.addCleanup(cache.delete, TOKEN_CACHE_KEY)
+
+    def test_token_is_reused(self) -> None:
+        """Test that a valid token is obtained only once"""
+        self.session.post.return_value = token_response("first")
+
+        self.assertEqual(self.token.get_token(), "first")
+        self.assertEqual(self.token.get_token(), "first")
+        self.session.post.assert_called_once()
+        self.assertEqual(
+            self.session.post.call_args.kwargs["data"]["grant_type"], "client_credentials"
+        )
+
+    def test_token_is_shared(self) -> None:
+        """Test that a token obtained by another worker is adopted"""
+        self.session.post.return_value = token_response("first")
+        self.token.get_token()
+
+        other = Token(self.session)
+        self.addCleanup(other.stop)
+        self.assertEqual(other.get_token(), "first")
+        self.session.post.assert_called_once()
+
+    def test_refresh_token_is_used(self) -> None:
+        """Test that an expired token is refreshed with the refresh token"""
+        self.session.post.return_value = token_response("first")
+        self.token.get_token()
+        self.token.invalidate()
+
+        self.session.post.return_value = token_response("second")
+        self.assertEqual(self.token.get_token(), "second")
+        data = self.session.post.call_args.kwargs["data"]
+        self.assertEqual(data["grant_type"], "refresh_token")
+        self.assertEqual(data["refresh_token"], "refresh-first")
+
+    def test_refresh_falls_back_on_credentials(self) -> None:
+        """Test that a rejected refresh token falls back on the credentials"""
+        self.session.post.return_value = token_response("first")
+        self.token.get_token()
+        self.token.invalidate()
+
+        self.session.post.side_effect = [
+            make_response(400, {"error": "invalid_grant"}),
+            token_response("second"),
+        ]
+        with self.assertLogs("insalan.payment.tokens", level="WARNING"):
+            self.assertEqual(self.token.get_token(), "second")
+        self.assertEqual(
+            self.session.post.call_args.kwargs["data"]["grant_type"], "client_credentials"
+        )
+
+    def test_background_refresh(self) -> None:
+        """Test that the token is refreshed before it expires"""
+        self.session.post.return_value = token_response("first", expires_in=1)
+        self.token.get_token()
+        assert self.token._timer is not None  # pylint: disable=protected-access
+
+        self.session.post.return_value = token_response("second")
+        self.token._timer.join(timeout=5)  # pylint: disable=protected-access
+        self.assertEqual(self.token.bearer_token, "second")
+        self.assertEqual(self.token.get_token(), "second")
+
+    def test_unreachable(self) -> None:
+        """Test that a network error is reported as a RuntimeError"""
+        self.session.post.side_effect = requests.exceptions.ConnectionError()
+        with self.assertLogs("insalan.payment.tokens", level="ERROR"):
+            self.assertRaises(RuntimeError, self.token.get_token)
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    """Tests of the circuit breaker"""
+
+    def test_opens_and_recovers(self) -> None:
+        """Test that the circuit opens after failures and closes after a success"""
+        breaker = CircuitBreaker(threshold=2, cooldown=30)
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.before_call()
+        with self.assertLogs("insalan.payment.helloasso", level="ERROR"):
+            breaker.record_failure()
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+        # After the cooldown, a single call goes through
+        assert breaker.opened_at is not None
+        breaker.opened_at -= 30
+        breaker.before_call()
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+        breaker.record_success()
+        breaker.before_call()
+
+    def test_failed_trial_reopens(self) -> None:
+        """Test that a failure after the cooldown opens the circuit again"""
+        breaker = CircuitBreaker(threshold=1, cooldown=30)
+        with self.assertLogs("insalan.payment.helloasso", level="ERROR"):
+            breaker.record_failure()
+            assert breaker.opened_at is not None
+            breaker.opened_at -= 30
+            breaker.before_call()
+            breaker.record_failure()
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+
+class HelloAssoClientTestCase(SimpleTestCase):
+    """Tests of the HelloAsso client"""
+
+    def setUp(self) -> None:
+        cache.delete(TOKEN_CACHE_KEY)
+        self.client_ha = HelloAssoClient()
+        self.addCleanup(self.client_ha.close)
+        self.addCleanup(cache.delete, TOKEN_CACHE_KEY)
+        session = MagicMock(spec=requests.Session)
+        session.post.return_value = token_response("token")
+        self.client_ha.session = session
+        self.client_ha.token.session = session
+        self.session = session
+
+    def test_unexpected_error_in_trial(self) -> None:
+        """Test that an unexpected error during the trial call does not block the circuit"""
+        self.client_ha.breaker = CircuitBreaker(threshold=1, cooldown=30)
+        self.client_ha.breaker.opened_at = time.monotonic() - 30
+        self.session.post.return_value = make_response(200, {"unexpected": "body"})
+
+        with self.assertLogs("insalan.payment.helloasso", level="ERROR"), \
+                self.assertRaises(KeyError):
+            self.client_ha.create_checkout_intent({"totalAmount": 100})
+
+        # Open again, and the next trial is let through after the cooldown
+        self.assertRaises(CircuitOpenError, self.client_ha.breaker.before_call)
+        assert self.client_ha.breaker.opened_at is not None
+        self.client_ha.breaker.opened_at -= 30
+        self.client_ha.breaker.before_call()
+
+    def test_checkout_intent(self) -> None:
+        """Test that intents are created with the bearer token"""
+        self.session.request.return_value = make_response(
+            200, {"id": 42, "redirectUrl": "https://example.net/pay"}
+        )
+        result = self.client_ha.create_checkout_intent({"totalAmount": 100})
+
+        self.assertEqual(result["id"], 42)
+        args = self.session.request.call_args
+        self.assertEqual(args.args[0], "POST")
+        self.assertTrue(args.args[1].endswith("/checkout-intents"))
+        self.assertEqual(args.kwargs["headers"]["authorization"], "Bearer token")
+        self.assertEqual(args.kwargs["json"], {"totalAmount": 100})
+
+    def test_unauthorized_retries_once(self) -> None:
+        """Test that a rejected token is replaced once"""
+        self.session.request.side_effect = [
+            make_response(401, {}),
+            make_response(200, {"id": 42, "redirectUrl": ""}),
+        ]
+        self.session.post.side_effect = [token_response("old"), token_response("new")]
+
+        self.client_ha.create_checkout_intent({})
+        self.assertEqual(
+            self.session.request.call_args.kwargs["headers"]["authorization"], "Bearer new"
+        )
+
+    def test_breaker_opens(self) -> None:
+        """Test that HelloAsso is not called anymore once the circuit is open"""
+        self.session.request.return_value = make_response(503, {})
+        threshold = self.client_ha.breaker.threshold
+        with self.assertLogs("insalan.payment.helloasso", level="ERROR"):
+            for _ in range(threshold):
+                self.assertRaises(HelloAssoError, self.client_ha.create_checkout_intent, {})
+        self.assertRaises(CircuitOpenError, self.client_ha.create_checkout_intent, {})
+        self.assertEqual(self.session.request.call_count, threshold)
+
+
+class PayViewTestCase(TestCase):
+    """Tests of the payment view"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="payer", email="payer@example.net", password="password"
+        )
+        self.product = Product.objects.create(
+            price=10,
+            name="Produit",
+            desc="",
+            available_until=timezone.now() + timedelta(days=1),
+        )
+        self.client.force_login(self.user)
+        # Pizza products have no payment handler
+        for hook in ("run_prepare_hooks", "run_failure_hooks"):
+            patcher = patch.object(Transaction, hook, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_pay(self) -> None:
+        """Test that the intent is created and tied to the transaction"""
+        with patch("insalan.payment.views.get_client") as get_client:
+            get_client.return_value.create_checkout_intent.return_value = {
+                "id": 42,
+                "redirectUrl": "https://example.net/pay",
+            }
+            response = self.client.post(
+                reverse("payment:pay"), {"products": [self.product.id]}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["redirect_url"], "https://example.net/pay")
+        body = get_client.return_value.create_checkout_intent.call_args.args[0]
+        self.assertEqual(body["totalAmount"], 1000)
+        self.assertEqual(Transaction.objects.get().intent_id, 42)
+
+    def pay(self, products: list[int]) -> tuple[int, int]:
+        """Pay products, and return the amount sent to HelloAsso and the query count"""
+        with patch("insalan.payment.views.get_client") as get_client, \
+                CaptureQueriesContext(connection) as queries:
+            get_client.return_value.create_checkout_intent.return_value = {
+                "id": 42,
+                "redirectUrl": "https://example.net/pay",
+            }
+            response = self.client.post(reverse("payment:pay"), {"products": products})
+        self.assertEqual(response.status_code, 200)
+        body = get_client.return_value.create_checkout_intent.call_args.args[0]
+        return body["totalAmount"], len(queries)
+
+    def test_pay_several_products(self) -> None:
+        """Test that the queries of a checkout do not depend on its products"""
+        others = Product.objects.bulk_create([
+            Product(
+                price=price,
+                name=f"Produit {price}",
+                desc="",
+                available_until=timezone.now() + timedelta(days=1),
+            )
+            for price in (5, 8)
+        ])
+        Discount.objects.bulk_create([
+            Discount(user=self.user, product=others[0], discount=2, reason="Staff"),
+            Discount(user=self.user, product=others[1], discount=3, reason="Staff"),
+        ])
+
+        _, single = self.pay([self.product.id])
+        amount, several = self.pay([others[1].id, self.product.id, others[0].id, self.product.id])
+
+        self.assertEqual(amount, 2800)
+        self.assertEqual(several, single + 1)  # Adding the discounts
+        trans_obj = Transaction.objects.get(intent_id=42, amount=Decimal(33))
+        self.assertEqual(trans_obj.discounts.count(), 2)
+        self.assertEqual(
+            dict(ProductCount.objects.filter(transaction=trans_obj)
+                 .values_list("product_id", "count")),
+            {self.product.id: 2, others[0].id: 1, others[1].id: 1},
+        )
+        trans_obj.amount = Decimal(0)
+        trans_obj.synchronize_amount()
+        self.assertEqual(trans_obj.amount, 33)
+
+    def test_pay_unknown_product(self) -> None:
+        """Test that unknown products are rejected"""
+        response = self.client.post(reverse("payment:pay"), {"products": [self.product.id, 999]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("999", response.json()["products"][0])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_pay_unavailable(self) -> None:
+        """Test that the transaction fails when HelloAsso is unavailable"""
+        with patch("insalan.payment.views.get_client") as get_client, \
+                self.assertLogs("insalan.payment.views", level="ERROR"):
+            get_client.return_value.create_checkout_intent.side_effect = HelloAssoError(
+                "Indisponible"
+            )
+            response = self.client.post(
+                reverse("payment:pay"), {"products": [self.product.id]}
+            )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(Transaction.objects.get().payment_status, TransactionStatus.FAILED)
+
+
+class NotificationsTestCase(TestCase):
+    """Tests of the HelloAsso notifications"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="payer", email="payer@example.net", password="password"
+        )
+        self.transaction = Transaction.objects.create(
+            payer=self.user,
+            creation_date=timezone.now(),
+            last_modification_date=timezone.now(),
+            amount=10,
+        )
+        # The transaction has no product, hence no hook to run
+        patcher = patch.object(Transaction, "run_success_hooks")
+        self.success_hooks = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def notify(self, event_type: str, data: dict[str, object],
+               transaction_uuid: object = None) -> int:
+        """Send a notification to the webhook, and return the status code"""
+        body = {
+            "eventType": event_type,
+            "data": data,
+            "metadata": {"uuid": str(transaction_uuid or self.transaction.id)},
+        }
+        response = self.client.post(
+            reverse("payment:notifications"), body, content_type="application/json"
+        )
+        return response.status_code
+
+    def order(self) -> dict[str, object]:
+        """Data of an Order notification"""
+        return {
+            "id": 12,
+            "payer": {"firstName": "Jane", "lastName": "Doe"},
+            "payments": [{"id": 34, "amount": 1000}],
+        }
+
+    def payment(self, state: str = "Authorized") -> dict[str, object]:
+        """Data of a Payment notification"""
+        return {"id": 34, "state": state, "order": {"id": 12}}
+
+    def test_payment_flow(self) -> None:
+        """Test that an order then its payment validate the transaction"""
+        self.assertEqual(self.notify("Order", self.order()), 200)
+        self.assertEqual(self.notify("Payment", self.payment()), 200)
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.order_id, 12)
+        self.assertEqual(self.transaction.payment_status, TransactionStatus.SUCCEEDED)
+        self.assertEqual(Payment.objects.get().amount, 10)
+        self.success_hooks.assert_called_once()
+        self.assertFalse(
+            Notification.objects.exclude(status=Notification.Status.PROCESSED).exists()
+        )
+
+    def test_duplicates(self) -> None:
+        """Test that a notification sent again is only processed once"""
+        for _ in range(2):
+            self.assertEqual(self.notify("Order", self.order()), 200)
+            self.assertEqual(self.notify("Payment", self.payment()), 200)
+
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.success_hooks.assert_called_once()
+
+    def test_invalid(self) -> None:
+        """Test that notifications without a transaction are rejected"""
+        response = self.client.post(
+            reverse("payment:notifications"), {"eventType": "Order"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        with self.assertLogs("insalan.payment.views", level="ERROR"):
+            self.assertEqual(self.notify("Order", {}, transaction_uuid="invalid"), 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_failure_is_isolated(self) -> None:
+        """Test that a broken notification fails alone"""
+        with self.assertLogs("insalan.payment.notifications", level="ERROR"):
+            self.assertEqual(self.notify("Payment", {"id": "abc"}), 200)
+        self.assertEqual(self.notify("Order", self.order()), 200)
+
+        failed = Notification.objects.get(status=Notification.Status.FAILED)
+        self.assertEqual(failed.event_type, "Payment")
+        self.assertIn("not an integer", failed.last_error)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.order_id, 12)
+
+    def test_replay(self) -> None:
+        """Test that failed notifications can be replayed"""
+        transaction_uuid = uuid.uuid4()
+        with self.assertLogs("insalan.payment.notifications", level="ERROR"):
+            self.assertEqual(self.notify("Order", self.order(), transaction_uuid), 200)
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, Notification.Status.FAILED)
+        self.assertIn("Unable to find transaction", notification.last_error)
+
+        Transaction.objects.create(
+            id=transaction_uuid,
+            payer=self.user,
+            creation_date=timezone.now(),
+            last_modification_date=timezone.now(),
+        )
+        out = StringIO()
+        call_command("replay_notifications", transaction=str(transaction_uuid), stdout=out)
+
+        self.assertIn("Replayed 1 notifications, 1 succeeded", out.getvalue())
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, Notification.Status.PROCESSED)
+        self.assertEqual(notification.attempts, 2)
+        self.assertEqual(Transaction.objects.get(id=transaction_uuid).order_id, 12)
+
+
+class FakeHelloAssoTestCase(SimpleTestCase):
+    """Tests of the HelloAsso stand-in, through the real client"""
+
+    def setUp(self) -> None:
+        self.received: list[dict[str, object]] = []
+        received = self.received
+
+        class Webhook(BaseHTTPRequestHandler):
+            """Records the notifications"""
+
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                """Notification endpoint"""
+                length = int(self.headers["Content-Length"])
+                received.append(json.loads(self.rfile.read(length)))
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *_: object) -> None:
+                pass
+
+        webhook = ThreadingHTTPServer(("127.0.0.1", 0), Webhook)
+        threading.Thread(target=webhook.serve_forever, daemon=True).start()
+        self.addCleanup(webhook.server_close)
+        self.addCleanup(webhook.shutdown)
+        self.webhook_url = f"http://127.0.0.1:{webhook.server_address[1]}/"
+
+        cache.delete(TOKEN_CACHE_KEY)
+        self.addCleanup(cache.delete, TOKEN_CACHE_KEY)
+        self.client_ha = HelloAssoClient()
+        self.addCleanup(self.client_ha.close)
+
+    def test_checkout_is_paid(self) -> None:
+        """Test that a checkout intent is followed by its notifications"""
+        with FakeHelloAsso(self.webhook_url) as fake, \
+                patch("insalan.settings.HA_URL", fake.url):
+            intent = self.client_ha.create_checkout_intent({
+                "totalAmount": 2000,
+                "payer": {"firstName": "Jane", "lastName": "Doe"},
+                "metadata": {"uuid": "transaction"},
+            })
+        # Stopping the fake waits for the notifications
+
+        self.assertEqual(intent["redirectUrl"], f"{fake.url}/checkout/{intent['id']}")
+        self.assertEqual(fake.stats.tokens, 1)
+        self.assertEqual(
+            [notification["eventType"] for notification in self.received], ["Order", "Payment"]
+        )
+        order, payment = self.received  # pylint: disable=unbalanced-tuple-unpacking
+        self.assertEqual(order["metadata"], {"uuid": "transaction"})
+        self.assertEqual(order["data"]["payments"][0]["amount"], 2000)  # type: ignore[index]
+        self.assertEqual(payment["data"]["state"], "Authorized")  # type: ignore[index]
+
+    def test_injected_failures(self) -> None:
+        """Test that failures and refusals can be injected"""
+        with FakeHelloAsso(self.webhook_url, failure_rate=1) as fake, \
+                patch("insalan.settings.HA_URL", fake.url), \
+                self.assertLogs("insalan.payment", level="ERROR"):
+            self.assertRaises(HelloAssoError, self.client_ha.create_checkout_intent, {})
+        self.assertEqual(fake.stats.injected_errors, 1)
+
+        with FakeHelloAsso(self.webhook_url, refusal_rate=1) as fake, \
+                patch("insalan.settings.HA_URL", fake.url):
+            self.client_ha.create_checkout_intent({"totalAmount": 2000})
+        self.assertEqual(self.received[-1]["data"]["state"], "Refused")  # type: ignore[index]
+
+    def test_unknown_token(self) -> None:
+        """Test that tokens the fake did not issue are rejected"""
+        with FakeHelloAsso() as fake:
+            response = requests.post(
+                f"{fake.url}/v5/organizations/insalan/checkout-intents",
+                json={"totalAmount": 2000},
+                headers={"Authorization": "Bearer invalid"},
+                timeout=5,
+            )
+        self.assertEqual(response.status_code, 401)
+
+    def test_lost_notifications(self) -> None:
+        """Test that lost notifications leave the payment visible to the API"""
+        with FakeHelloAsso(self.webhook_url, loss_rate=1) as fake, \
+                patch("insalan.settings.HA_URL", fake.url):
+            intent = self.client_ha.create_checkout_intent({"totalAmount": 2000})
+        with fake, patch("insalan.settings.HA_URL", fake.url):
+            state = self.client_ha.get_checkout_intent(intent["id"])
+
+        self.assertEqual(self.received, [])
+        self.assertEqual(fake.stats.lost, 2)
+        self.assertEqual(state["order"]["payments"][0]["state"], "Authorized")
+
+
+class ReconciliationTestCase(TestCase):
+    """Tests of the reconciliation of the pending transactions"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(
+            username="payer", email="payer@example.net", password="password"
+        )
+        # Without a webhook, the payments are only known to the API
+        self.fake = FakeHelloAsso()
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        url_patcher = patch("insalan.settings.HA_URL", self.fake.url)
+        url_patcher.start()
+        self.addCleanup(url_patcher.stop)
+        reset_client()
+        self.addCleanup(reset_client)
+        patcher = patch.object(Transaction, "run_success_hooks")
+        self.success_hooks = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def transaction(self, age: timedelta, intent_id: int | None = None) -> Transaction:
+        """Create a pending transaction created and last modified `age` ago"""
+        date = timezone.now() - age
+        return Transaction.objects.create(
+            payer=self.user,
+            creation_date=date,
+            last_modification_date=date,
+            intent_id=intent_id,
+            amount=20,
+        )
+
+    def test_lost_notifications(self) -> None:
+        """Test that a paid intent validates its transaction"""
+        intent = self.fake.create_intent({"totalAmount": 2000})
+        trans_obj = self.transaction(timedelta(minutes=20), intent.id)
+        intent.body["metadata"] = {"uuid": str(trans_obj.id)}
+        self.fake.pay(intent)
+
+        result = reconcile_transactions()
+
+        self.assertEqual((result.checked, result.notified, result.expired), (1, 1, 0))
+        trans_obj.refresh_from_db()
+        self.assertEqual(trans_obj.payment_status, TransactionStatus.SUCCEEDED)
+        self.assertEqual(trans_obj.order_id, intent.order_id)
+        self.assertEqual(Payment.objects.get().amount, 20)
+        self.success_hooks.assert_called_once()
+        self.assertEqual(reconcile_transactions().checked, 0)
+
+    def test_expiry(self) -> None:
+        """Test that only the abandoned intents are expired"""
+        unpaid = self.fake.create_intent({"totalAmount": 2000})
+        abandoned = self.transaction(timedelta(hours=2), unpaid.id)
+        unknown = self.transaction(timedelta(hours=2), 404)
+        recent = self.transaction(timedelta(minutes=20), unpaid.id)
+        fresh = self.transaction(timedelta(minutes=1), unpaid.id)
+
+        with self.assertLogs("insalan.payment", level="ERROR"), \
+                patch.object(Transaction, "run_failure_hooks") as failure_hooks:
+            result = reconcile_transactions()
+
+        self.assertEqual((result.checked, result.expired, result.errors), (3, 2, 0))
+        # The products of the expired transactions are released
+        self.assertEqual(failure_hooks.call_count, 2)
+        statuses = dict(Transaction.objects.values_list("id", "payment_status"))
+        self.assertEqual(statuses[abandoned.id], TransactionStatus.FAILED)
+        self.assertEqual(statuses[unknown.id], TransactionStatus.FAILED)
+        self.assertEqual(statuses[recent.id], TransactionStatus.PENDING)
+        self.assertEqual(statuses[fresh.id], TransactionStatus.PENDING)
+        self.success_hooks.assert_not_called()
+
+    def test_list_by_status(self) -> None:
+        """Test that the transactions can be listed by state"""
+        failed = self.transaction(timedelta(hours=1))
+        failed.fail_transaction()
+        self.transaction(timedelta(hours=1))
+        self.client.force_login(
+            User.objects.create(username="admin", is_superuser=True, is_staff=True)
+        )
+
+        response = self.client.get(reverse("payment:transactions"), {"status": "FAILED"})
+
+        self.assertEqual([row["id"] for row in response.json()], [str(failed.id)])
+        self.assertEqual(len(self.client.get(reverse("payment:transactions")).json()), 2)
+
+
+class AdminExportTestCase(TestCase):
+    """Tests of the CSV exports of the payments and transactions"""
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser("admin@example.net", "admin", "password")
+        self.client.force_login(self.admin)
+        self.products = [
+            Product.objects.create(
+                price=10,
+                name=f"Produit {i}",
+                desc="",
+                available_until=timezone.now() + timedelta(days=1),
+            )
+            for i in range(2)
+        ]
+
+    def add_payment(self, status: TransactionStatus) -> Payment:
+        """Create a transaction of both products, with its payment"""
+        trans_obj = Transaction.objects.create(
+            payer=self.admin,
+            payment_status=status,
+            creation_date=timezone.now(),
+            last_modification_date=timezone.now(),
+            amount=20,
+        )
+        for product in self.products:
+            ProductCount.objects.create(transaction=trans_obj, product=product, count=1)
+        return Payment.objects.create(
+            id=Payment.objects.count() + 1, transaction=trans_obj, amount=20
+        )
+
+    def export(self, model: str) -> tuple[list[str], int]:
+        """Export every object of a model, return the lines and the number of queries"""
+        model_class = Payment if model == "payment" else Transaction
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse(f"admin:payment_{model}_changelist"),
+                {
+                    "action": "export",
+                    ACTION_CHECKBOX_NAME: [
+                        str(pk) for pk in model_class.objects.values_list("pk", flat=True)
+                    ],
+                },
+            )
+            # Sent the way the ASGI server does
+            content = asgi_body(response).decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        # Written to a file rather than kept in memory
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(int(response["Content-Length"]), len(content.encode()))
+        return content.splitlines(), len(queries)
+
+    def test_export_payments(self) -> None:
+        """Test that the payments are exported with a constant number of queries"""
+        payment = self.add_payment(TransactionStatus.SUCCEEDED)
+        lines, queries = self.export("payment")
+        self.assertEqual(
+            lines[0], "id;prix;type;statut;date de paiement;date de dernière modification"
+        )
+        self.assertEqual(
+            lines[1].split(";")[:4], [str(payment.id), "20.00", "Produit 0, Produit 1", "SUCCEEDED"]
+        )
+
+        pending = self.add_payment(TransactionStatus.PENDING)
+        self.add_payment(TransactionStatus.SUCCEEDED)
+        lines, more_queries = self.export("payment")
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(queries, more_queries)
+        # Pending payments are exported as failed
+        self.assertEqual(lines[2].split(";")[0], str(pending.id))
+        self.assertEqual(lines[2].split(";")[3], "FAILED")
+
+    def test_export_transactions(self) -> None:
+        """Test that the transactions are exported with a constant number of queries"""
+        self.add_payment(TransactionStatus.SUCCEEDED)
+        lines, queries = self.export("transaction")
+        self.assertEqual(lines[0].split(";")[:6], [
+            "id", "payeur", "courriel", "produits", "montant", "statut"
+        ])
+        self.assertEqual(lines[1].split(";")[1:6], [
+            self.admin.username, self.admin.email, "Produit 0, Produit 1", "20.00", "Réussie"
+        ])
+
+        self.add_payment(TransactionStatus.PENDING)
+        lines, more_queries = self.export("transaction")
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(queries, more_queries)
@@ -3,11 +3,13 @@
 from __future__ import annotations
 
 import logging
+import threading
 import time
 from typing import Any
 
 import requests
 
+from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
 
 import insalan.settings as app_settings
@@ -15,36 +17,37 @@ import insalan.settings as app_settings
 
 logger = logging.getLogger(__name__)
 
+# Key of the token in the Django cache, so that workers can share it when the
+# cache backend is shared between them
+TOKEN_CACHE_KEY = "payment:helloasso-token"
+
 
 class Token:
     """
-    HelloAsso OAuth2 Token Singleton
+    HelloAsso OAuth2 Token
 
-    This class simply holds the token as a singleton, and is used to refresh it
-    when needed.
+    This class holds the token, and refreshes it in the background shortly
+    before it expires, so that requests never wait for an OAuth round-trip in
+    the common case. It is thread-safe: a single refresh happens at a time.
     """
 
-    instance = None
-
-    def __init__(self) -> None:
+    def __init__(self, session: requests.Session) -> None:
         """Initialize the Token retrieval instance"""
-        if Token.instance is None:
-            Token.instance = self
-
+        self.session = session
         self.expiration_date: float | None = None
+        self.refresh_date: float | None = None
         self.bearer_token: str | None = None
         self.refresh_token: str | None = None
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
 
-        self.obtain_token()
-
-    @classmethod
-    def get_instance(cls) -> Token:
-        """Get the potential singleinstance of the Token"""
-        if cls.instance is None:
-            token = cls()
-            return token
-
-        return cls.instance
+    def is_valid(self) -> bool:
+        """Whether the token can still be used for a while"""
+        return (
+            self.bearer_token is not None
+            and self.refresh_date is not None
+            and time.time() < self.refresh_date
+        )
 
     def obtain_token(self, secret: str | None = None) -> None:
         """
@@ -68,17 +71,17 @@ class Token:
                 "refresh_token": refresh_token,
             }
         try:
-            request = requests.post(
+            request = self.session.post(
                 url=f"{app_settings.HA_URL}/oauth2/token",
                 headers={"Content-Type": "application/x-www-form-urlencoded"},
                 data=data,
-                timeout=45,
+                timeout=app_settings.HA_TIMEOUT,
             )
         except requests.exceptions.RequestException as err:
             logger.error("Unable to obtain token: %s", err)
             # Clean everything
-            Token.instance = None
             self.expiration_date = None
+            self.refresh_date = None
             self.bearer_token = None
             self.refresh_token = None
             # Propagate errors
@@ -97,24 +100,96 @@ class Token:
                 _("Impossible de rafraichir le jeton HelloAsso: %s") % result["error_description"]
             )
 
-        self.assign_token_data(request.json())
+        self.assign_token_data(result)
 
     def assign_token_data(self, data: Any) -> None:
         """Assign data from the json body"""
         # Store our tokens, but also keep track of the refresh time
-        self.expiration_date = time.time() + int(data["expires_in"])
+        expires_in = int(data["expires_in"])
+        self.expiration_date = time.time() + expires_in
+        self.refresh_date = self.expiration_date - min(
+            app_settings.HA_TOKEN_REFRESH_MARGIN, expires_in / 2
+        )
         self.bearer_token = data["access_token"]
         self.refresh_token = data["refresh_token"]
+        cache.set(
+            TOKEN_CACHE_KEY,
+            {
+                "expiration_date": self.expiration_date,
+                "refresh_date": self.refresh_date,
+                "bearer_token": self.bearer_token,
+                "refresh_token": self.refresh_token,
+            },
+            expires_in,
+        )
+        self.schedule_refresh()
+
+    def load_shared_token(self) -> bool:
+        """Adopt the token another worker stored in the cache, if still valid"""
+        shared = cache.get(TOKEN_CACHE_KEY)
+        if shared is None:
+            return False
+        self.expiration_date = shared["expiration_date"]
+        self.refresh_date = shared["refresh_date"]
+        self.bearer_token = shared["bearer_token"]
+        self.refresh_token = shared["refresh_token"]
+        return self.is_valid()
 
     def get_token(self) -> str:
-        """Return the singleton's token"""
-        # Should we refresh?
-        assert self.expiration_date is not None
-        if time.time() >= self.expiration_date:
-            self.refresh()
+        """Return the token, only waiting for HelloAsso if it has expired"""
+        if not self.is_valid():
+            with self._lock:
+                # Another thread may have refreshed it while we were waiting
+                if not self.is_valid() and not self.load_shared_token():
+                    self.refresh()
         assert self.bearer_token is not None
         return self.bearer_token
 
     def refresh(self) -> None:
         """Refresh our HelloAsso token"""
-        self.obtain_token(secret=self.refresh_token)
+        if self.refresh_token is not None:
+            try:
+                self.obtain_token(secret=self.refresh_token)
+                return
+            except RuntimeError as err:
+                # The refresh token may have been used by another worker
+                logger.warning("Unable to refresh the HelloAsso token: %s", err)
+        self.obtain_token()
+
+    def invalidate(self) -> None:
+        """Forget the bearer token, so that the next request gets a new one"""
+        with self._lock:
+            self.bearer_token = None
+            self.refresh_date = None
+            cache.delete(TOKEN_CACHE_KEY)
+
+    def schedule_refresh(self) -> None:
+        """Plan a background refresh shortly before the token expires"""
+        if self._timer is not None:
+            self._timer.cancel()
+        assert self.refresh_date is not None
+        self._timer = threading.Timer(
+            max(self.refresh_date - time.time(), 0),
+            self.background_refresh,
+            args=(self.expiration_date,),
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def background_refresh(self, expiration_date: float) -> None:
+        """Refresh the token from the background timer"""
+        with self._lock:
+            # Nothing to do if it was refreshed in the meantime
+            if self.expiration_date != expiration_date:
+                return
+            try:
+                self.refresh()
+            except RuntimeError as err:
+                # The next request will try again
+                logger.error("Background refresh of the HelloAsso token failed: %s", err)
+
+    def stop(self) -> None:
+        """Cancel the planned refresh"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
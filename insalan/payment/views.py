@@ -1,12 +1,10 @@
 """Views for the Payment module"""
 
-import json
 import logging
-from decimal import Decimal
 from typing import Any
+from uuid import UUID
 
-import requests
-
+from django.db.models import QuerySet
 from django.utils.translation import gettext_lazy as _
 
 from drf_yasg.utils import swagger_auto_schema  # type: ignore[import]
@@ -22,8 +20,9 @@ from insalan import settings as app_settings
 from insalan.payment import serializers
 from insalan.user.models import User
 
-from .models import Transaction, Product, Payment, Discount
-from .tokens import Token
+from .helloasso import HelloAssoError, get_client
+from .models import Transaction, Product, Discount, Notification
+from .notifications import schedule_processing
 
 logger = logging.getLogger(__name__)
 
@@ -157,13 +156,22 @@ class ProductDetails(generics.RetrieveUpdateDestroyAPIView[Product]):
 
 class TransactionList(generics.ListAPIView[Transaction]):  # pylint: disable=unsubscriptable-object
     """
-    Get all transactions
+    Get all transactions, or only those in a given state with `?status=`
     """
     paginator = None
     serializer_class = serializers.TransactionSerializer
-    queryset = Transaction.objects.all().order_by("last_modification_date")
+    queryset = Transaction.objects.prefetch_related("products", "discounts").order_by(
+        "last_modification_date"
+    )
     permission_classes = [permissions.IsAdminUser]
 
+    def get_queryset(self) -> QuerySet[Transaction]:
+        queryset = super().get_queryset()
+        payment_status = self.request.query_params.get("status")
+        if payment_status is not None:
+            queryset = queryset.filter(payment_status=payment_status)
+        return queryset
+
 
 # pylint: disable-next=unsubscriptable-object
 class TransactionPerId(generics.RetrieveAPIView[Transaction]):
@@ -260,165 +268,33 @@ class Notifications(APIView):
     def post(self, request: Request) -> Response:
         """Notification POST"""
 
-        logger.error("Received notification: %s", request.data)
+        logger.info("Received notification: %s", request.data)
         data = request.data
-        if not data.get("metadata") or not data["metadata"].get("uuid"):
+        if not isinstance(data, dict) or not isinstance(data.get("metadata"), dict) \
+                or not data["metadata"].get("uuid"):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         # Access to .metadata.uuid is verified
-        uuid = data["metadata"]["uuid"]
         try:
-            trans_obj = Transaction.objects.get(id=uuid)
-        except Transaction.DoesNotExist:
-            logger.error("Unable to find transaction %s", uuid)
+            transaction_uuid = UUID(str(data["metadata"]["uuid"]))
+        except ValueError:
+            logger.error("Invalid transaction UUID %s", data["metadata"]["uuid"])
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        ntype = data.get("eventType")  # defaults to None
-        data = data.get("data", {})
-
-        if ntype == "Order":
-            # From "Order", get the payments
-            # Check that the id is an integer
-            order_id = data.get("id")
-            if not isinstance(order_id, int):
-                logger.error(
-                    "Invalid ID for Order event, except integer, got %s", order_id
-                )
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            logger.info("Tied transaction %s to order ID %s", trans_obj.id, order_id)
-            trans_obj.order_id = order_id
-            trans_obj.touch()
-            trans_obj.save()
-
-            # Retrieve the payer's name which will be useful for the event
-            payer = trans_obj.payer
-            if payer is not None:
-                data_first_name = data.get("payer", {}).get("firstName", "")
-                data_last_name = data.get("payer", {}).get("lastName", "")
-                modified = False
-                if data_first_name != "" and payer.first_name == "":
-                    payer.first_name = data_first_name
-                    modified = True
-                if data_last_name != "" and payer.last_name == "":
-                    payer.last_name = data_last_name
-                    modified = True
-                if modified or payer.first_name == "" or payer.last_name == "":
-                    payer.confirm_name = True
-                payer.save()
-
-            payments = data.get("payments")
-            if payments is None:
-                logger.warning(
-                    "No payment data found while trying to validate transaction %s. Is that right?",
-                    order_id,
-                )
-                return Response(status=status.HTTP_200_OK)
-
-            for pay_data in payments:
-                pid = pay_data.get("id")
-                if pid is None:
-                    logger.warning(
-                        "No identifier found on payment for transaction %s!!", order_id
-                    )
-                    continue
-                amount = pay_data.get("amount")
-                if amount is None:
-                    logger.warning(
-                        "No amount found on payment for transaction %s's payment %s!!",
-                        order_id,
-                        pid,
-                    )
-                    continue
-                if not isinstance(amount, int):
-                    logger.warning(
-                        # pylint: disable-next=line-too-long
-                        "Amount for payment %s of transaction %s is not an integer. This may be fine, but beware.",
-                        pid,
-                        order_id,
-                    )
-                amount = Decimal(amount) / 100
-                Payment.objects.create(id=pid, amount=amount, transaction=trans_obj)
-                logger.info(
-                    "Created payment %d tied to transaction %s", pid, trans_obj.id
-                )
-
-        elif ntype == "Form":
-            # Those notifications are mostly useless, it's about changes to the
-            # org
-            pass
-        elif ntype == "Payment":
-            # Because we are in single payment, this is our signal to validate
-            pay_id = data.get("id")
-            if pay_id is None:
-                logger.error("Payment ID is none for payment event!")
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            if not isinstance(pay_id, int):
-                logger.error('Payment ID "%s" is not an integer')
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            # The payment could be "None" if we haven't received "Order" yet
-            pay_objs = list(Payment.objects.filter(id=pay_id)) + [None]
-            pay_obj = pay_objs[0]
-            if pay_obj is not None and pay_obj.transaction != trans_obj:
-                logger.error(
-                    # pylint: disable-next=line-too-long
-                    "Mismatch! Payment %s is known to belong to transaction %s but HA metadata says %s",
-                    pay_id,
-                    trans_obj.id,
-                    pay_obj.transaction.id,
-                )
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            order_id = data.get("order", {}).get("id")
-            if order_id is None:
-                logger.error(
-                    "Payment %s has no order field or no order.id field", pay_id
-                )
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            if not isinstance(order_id, int):
-                logger.error("Payment %s has an order.id field that is not int", pay_id)
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            if pay_obj is not None and trans_obj.order_id != order_id:
-                logger.error(
-                    "Mismatch! Payment %s is known to belong to transaction %s but HA data says %s",
-                    pay_id,
-                    trans_obj.order_id,
-                    order_id,
-                )
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            if pay_obj is None:
-                logger.warning(
-                    "Validating transaction %s based on payment %s to be generated later",
-                    trans_obj.id,
-                    pay_id,
-                )
-
-            # Check the state
-            state = data.get("state")
-            if state == "Authorized":
-                # Ok we should be good now
-                trans_obj.validate_transaction()
-
-            elif state in ["Refused", "Unknown"]:
-                # This code should show that a payment failed
-                trans_obj.fail_transaction()
-
-            elif state in ["Refunded"]:
-                # Refund
-                trans_obj.refund_transaction()
-
-            else:
-                logger.warning(
-                    'Payment %s shows status "%s" unknown or already assigned',
-                    pay_id,
-                    state,
-                )
-
+        # The notification is only stored here, and acknowledged right away:
+        # HelloAsso sends it again when we are slow to answer
+        _, created = Notification.objects.get_or_create(
+            dedupe_key=Notification.make_dedupe_key(data),
+            defaults={
+                "transaction_uuid": transaction_uuid,
+                "event_type": str(data.get("eventType") or "")[:32],
+                "payload": data,
+            },
+        )
+        if created:
+            schedule_processing(transaction_uuid)
         else:
-            logger.error("Unrecognized payment notification event type %s", ntype)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+            logger.info("Ignoring duplicate notification for %s", transaction_uuid)
 
         return Response(status=status.HTTP_200_OK)
 
@@ -434,7 +310,6 @@ class PayView(generics.CreateAPIView[Transaction]):  # pylint: disable=unsubscri
 
     def create(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         """Process a payment request"""
-        token = Token.get_instance()
         assert isinstance(request.user, User), 'User must be authenticated to access this route.'
         payer = request.user
         data = request.data.copy()
@@ -461,15 +336,22 @@ class PayView(generics.CreateAPIView[Transaction]):  # pylint: disable=unsubscri
             amount = transaction_obj.amount
 
             # If the user has a discount for some products, apply them
-            for product in transaction_obj.products.all():
-                discounts = Discount.objects.filter(user=payer, product=product, used=False)
-                for discount in discounts:
-                    # Check if the discount is applicable
-                    if amount >= discount.discount:
-                        amount -= discount.discount
-
-                        # Add the discount to the transaction object
-                        transaction_obj.discounts.add(discount)
+            applied = []
+            discounts = Discount.objects.filter(
+                user=payer,
+                product__in=[
+                    proccount.product_id for proccount in transaction_obj.get_product_counts()
+                ],
+                used=False,
+            ).order_by("product_id", "id")
+            for discount in discounts:
+                # Check if the discount is applicable
+                if amount >= discount.discount:
+                    amount -= discount.discount
+                    applied.append(discount)
+            # Add the discounts to the transaction object
+            if applied:
+                transaction_obj.discounts.add(*applied)
 
             # helloasso intent
             helloasso_amount = int(
@@ -492,20 +374,18 @@ class PayView(generics.CreateAPIView[Transaction]):  # pylint: disable=unsubscri
                     "uuid": str(transaction_obj.id),
                 },
             }
-            headers = {
-                "authorization": "Bearer " + token.get_token(),
-                "Content-Type": "application/json",
-            }
-
-            checkout_init = requests.post(
-                # pylint: disable-next=line-too-long
-                f"{app_settings.HA_URL}/v5/organizations/{app_settings.HA_ORG_SLUG}/checkout-intents",
-                data=json.dumps(intent_body),
-                headers=headers,
-                timeout=45,
-            )  # initiate a helloasso intent
-            logger.debug(checkout_init.text)
-            checkout_json = checkout_init.json()
+            try:
+                # initiate a helloasso intent
+                checkout_json = get_client().create_checkout_intent(intent_body)
+            except HelloAssoError as err:
+                logger.error(
+                    "Unable to create the intent of transaction %s: %s", transaction_obj.id, err
+                )
+                transaction_obj.fail_transaction()
+                return Response(
+                    {"err": _("Le service de paiement est indisponible")},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
             redirect_url = checkout_json["redirectUrl"]
             intent_id = checkout_json["id"]
             transaction_obj.intent_id = intent_id
@@ -568,6 +448,15 @@ class PayView(generics.CreateAPIView[Transaction]):  # pylint: disable=unsubscri
                         description=_("Données de transaction invalides")
                     )
                 }
+            ),
+            503: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "err": openapi.Schema(
+                        type=openapi.TYPE_STRING,
+                        description=_("Le service de paiement est indisponible")
+                    )
+                }
             )
         }
     )
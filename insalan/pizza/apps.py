@@ -2,8 +2,19 @@
 from django.apps import AppConfig
 from django.utils.translation import gettext_lazy as _
 
+from insalan import settings as app_settings
+from insalan.scheduler import register_job
+
+
 class PizzaConfig(AppConfig):
     """Configuration of the Pizza App"""
     default_auto_field = "django.db.models.BigAutoField"
     name = "insalan.pizza"
     verbose_name = _("Pizza")
+
+    def ready(self) -> None:
+        """Called when the module is ready"""
+        # pylint: disable-next=import-outside-toplevel
+        from .kitchen import warm_documents
+
+        register_job("kitchen-documents", warm_documents, app_settings.KITCHEN_WARM_INTERVAL)
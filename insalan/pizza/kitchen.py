@@ -0,0 +1,197 @@
+"""
+Kitchen documents of the pizza exports
+
+Each export is turned into a PDF of order tickets, grouped by delivery, to be
+printed for the team Bouffe, and a CSV of the number of each pizza, for the
+pizzeria. Both are rendered in a single pass over the orders of the export,
+off the request thread, and cached on disk under `CACHE_ROOT`: an export never
+changes once created. The recent exports whose documents are missing (after a
+deployment emptied the cache...) are rendered again by a periodic job.
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from io import BytesIO, StringIO
+from datetime import timedelta
+from itertools import groupby
+from os import path
+
+from django.db import close_old_connections
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from insalan import settings as app_settings
+from insalan.scheduler import scheduler
+
+from .models import Order, PaymentMethod, PizzaExport
+
+logger = logging.getLogger(__name__)
+
+KITCHEN_CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+}
+
+# Layout of the tickets, in points: two columns of tickets per page
+TICKET_MARGIN = 36
+TICKET_LINE = 14
+TICKET_COLUMNS = 2
+
+# Exports being rendered by this process
+_pending: set[int] = set()
+_pending_lock = threading.Lock()
+
+
+def export_path(export: PizzaExport, fmt: str) -> str:
+    """
+    Where a document of an export is cached
+
+    The creation date is part of the name, so that a file left by an export
+    which was deleted is never served for another one.
+    """
+    stamp = int(export.created_at.timestamp())
+    return path.join(app_settings.CACHE_ROOT, "pizza-exports", f"{export.id}-{stamp}.{fmt}")
+
+
+def cached_document(export: PizzaExport, fmt: str) -> str | None:
+    """Path of a document of an export, None if it was not rendered yet"""
+    file_path = export_path(export, fmt)
+    return file_path if path.exists(file_path) else None
+
+
+def render_export(export: PizzaExport) -> None:
+    """Render the PDF and CSV documents of an export, and cache them on disk"""
+    orders = (
+        Order.objects.filter(orders=export)
+        .select_related("user_obj", "time_slot")
+        .prefetch_related("pizza")
+        .order_by("time_slot__delivery_time", "id")
+    )
+    payment_methods = dict(PaymentMethod.choices)
+    totals: Counter[str] = Counter()
+
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle(f"Export {export.id}")
+    page_width, page_height = A4
+    column_width = (page_width - 2 * TICKET_MARGIN) / TICKET_COLUMNS
+
+    top = page_height - TICKET_MARGIN - 2 * TICKET_LINE
+
+    def draw_header(header: str) -> None:
+        pdf.setFont("Helvetica-Bold", 16)
+        pdf.drawString(TICKET_MARGIN, page_height - TICKET_MARGIN, f"Livraison {header}")
+
+    first = True
+    for delivery_time, group in groupby(orders, key=lambda order: order.time_slot.delivery_time):
+        # Every delivery starts on a new page, and its header is repeated on
+        # the pages it overflows to
+        if not first:
+            pdf.showPage()
+        first = False
+        header = timezone.localtime(delivery_time).strftime("%d/%m/%Y %H:%M")
+        draw_header(header)
+        column = 0
+        y = top
+        for order in group:
+            pizzas = Counter(pizza.name for pizza in order.pizza.all())
+            totals.update(pizzas)
+            lines = [
+                f"{payment_methods.get(order.payment_method, order.payment_method)}"
+                f" - {order.price:.2f} €" + ("" if order.paid else " - non payée"),
+                *(f"{count} x {name}" for name, count in sorted(pizzas.items())),
+            ]
+            height = (len(lines) + 2) * TICKET_LINE
+            if y - height < TICKET_MARGIN:
+                column += 1
+                y = top
+                if column == TICKET_COLUMNS:
+                    pdf.showPage()
+                    draw_header(header)
+                    column = 0
+            x = TICKET_MARGIN + column * column_width
+            pdf.rect(x, y - height + TICKET_LINE / 2, column_width - TICKET_LINE, height)
+            pdf.setFont("Helvetica-Bold", 11)
+            pdf.drawString(x + 6, y - TICKET_LINE / 2, f"#{order.id} {order.get_username()}")
+            pdf.setFont("Helvetica", 10)
+            for i, line in enumerate(lines, start=1):
+                pdf.drawString(x + 6, y - TICKET_LINE / 2 - i * TICKET_LINE, line)
+            y -= height + TICKET_LINE / 2
+    pdf.save()
+
+    output = StringIO()
+    writer = csv.writer(output, delimiter=";")
+    writer.writerow(["pizza", "quantité"])
+    for name, count in sorted(totals.items()):
+        writer.writerow([name, count])
+
+    _dump(export_path(export, "pdf"), buffer.getvalue())
+    _dump(export_path(export, "csv"), output.getvalue().encode())
+
+
+def _dump(file_path: str, data: bytes) -> None:
+    # Write to a temporary file first so that the view never serves a
+    # truncated document
+    os.makedirs(path.dirname(file_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.dirname(file_path))
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def _render_in_background(export_id: int) -> None:
+    """Render an export from a thread of the scheduler"""
+    try:
+        export = PizzaExport.objects.filter(id=export_id).first()
+        if export is not None:
+            render_export(export)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Unable to render the pizza export %d", export_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(export_id)
+        close_old_connections()
+
+
+def schedule_render(export: PizzaExport) -> None:
+    """Render the documents of an export in the background, once at a time"""
+    if "test" in sys.argv:
+        # Tests expect the documents once the request returns
+        render_export(export)
+        return
+    with _pending_lock:
+        if export.id in _pending:
+            return
+        _pending.add(export.id)
+    scheduler.add_job(_render_in_background, args=[export.id])
+
+
+def remove_documents(export: PizzaExport) -> None:
+    """Remove the cached documents of an export"""
+    for fmt in KITCHEN_CONTENT_TYPES:
+        try:
+            os.remove(export_path(export, fmt))
+        except FileNotFoundError:
+            pass
+
+
+def warm_documents() -> int:
+    """Render the recent exports without cached documents, return their number"""
+    since = timezone.now() - timedelta(seconds=app_settings.KITCHEN_WARM_AGE)
+    rendered = 0
+    for export in PizzaExport.objects.filter(created_at__gte=since).order_by("-created_at"):
+        if all(cached_document(export, fmt) for fmt in KITCHEN_CONTENT_TYPES):
+            continue
+        with _pending_lock:
+            if export.id in _pending:
+                continue
+        render_export(export)
+        rendered += 1
+    return rendered
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.12 on 2026-10-19 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizza', '0003_alter_pizza_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64, verbose_name='Empreinte'),
+        ),
+    ]
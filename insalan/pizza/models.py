@@ -11,6 +11,10 @@ It includes the following models:
 
 from __future__ import annotations
 
+import hashlib
+import json
+from collections.abc import Iterable
+from decimal import Decimal
 from typing import Any, cast, TYPE_CHECKING
 
 from django.contrib.postgres.fields import ArrayField
@@ -231,6 +235,22 @@ class TimeSlot(models.Model):
         """
         return Order.objects.filter(time_slot=self).values_list("id", flat=True).order_by("-id")
 
+    @staticmethod
+    def count_pizzas(timeslot_ids: Iterable[int]) -> dict[int, dict[int, int]]:
+        """
+        Count the pizzas ordered in each timeslot by pizza id, in a single query
+        """
+        counts: dict[int, dict[int, int]] = {timeslot_id: {} for timeslot_id in timeslot_ids}
+        rows = (
+            PizzaOrder.objects.filter(order__time_slot__in=list(counts))
+            .values_list("order__time_slot", "pizza")
+            .annotate(count=models.Count("id"))
+            .order_by("order__time_slot", "pizza")
+        )
+        for timeslot_id, pizza_id, count in rows:
+            counts[timeslot_id][pizza_id] = count
+        return counts
+
 class PizzaOrder(models.Model):
     """Pizza order model"""
     order = models.ForeignKey('Order', on_delete=models.CASCADE)
@@ -296,6 +316,33 @@ class Order(models.Model):
         verbose_name=_("Date de création"),
         auto_now_add=True,
     )
+    # Hash of the content of the order, to detect duplicated orders
+    fingerprint = models.CharField(
+        verbose_name=_("Empreinte"),
+        max_length=64,
+        blank=True,
+        default="",
+        editable=False,
+        db_index=True,
+    )
+
+    @staticmethod
+    def make_fingerprint(
+        user: str | None,
+        time_slot_id: int,
+        payment_method: str,
+        price: Decimal,
+        pizza_ids: Iterable[int],
+    ) -> str:
+        """Hash the content of an order, whatever the order of its pizzas"""
+        content = [
+            user or "",
+            time_slot_id,
+            payment_method,
+            str(Decimal(price).normalize()),
+            sorted(pizza_ids),
+        ]
+        return hashlib.sha256(json.dumps(content).encode()).hexdigest()
 
     def get_pizza_ids(self) -> list[int]:
         """Retrieve pizza associated to an order with their id."""
@@ -360,3 +407,19 @@ class PizzaExport(models.Model):
         retrieve the timeslot associated to the export
         """
         return self.time_slot
+
+    @staticmethod
+    def count_pizzas(export_ids: Iterable[int]) -> dict[int, dict[str, int]]:
+        """
+        Count the pizzas of each export by name, in a single query
+        """
+        counts: dict[int, dict[str, int]] = {export_id: {} for export_id in export_ids}
+        rows = (
+            PizzaOrder.objects.filter(order__orders__in=list(counts))
+            .values_list("order__orders", "pizza__name")
+            .annotate(count=models.Count("id"))
+            .order_by("order__orders", "pizza__name")
+        )
+        for export_id, name, count in rows:
+            counts[export_id][name] = count
+        return counts
@@ -4,9 +4,10 @@ from __future__ import annotations
 
 from decimal import Decimal
 from datetime import timedelta
-from typing import Any, List, TYPE_CHECKING
+from typing import Any, List, TYPE_CHECKING, cast
 
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 
@@ -60,41 +61,55 @@ class CreateOrderSerializer(serializers.ModelSerializer[Order]):
     def create(self, validated_data: Any) -> Order:
         """Create an order"""
         price_type = validated_data.pop('type')
-        pizza = validated_data.pop("pizza")
+        try:
+            pizza = [int(p) for p in validated_data.pop("pizza")]
+        except (TypeError, ValueError) as err:
+            raise ValidationError("unknown pizza") from err
         if "payment_method" not in validated_data:
             payment_method = PaymentMethod.CB
         else:
             payment_method = validated_data["payment_method"]
 
-        price: Decimal
-        if payment_method == PaymentMethod.FR:
-            price = Decimal(0)
-        elif price_type == "staff":
-            price = TimeSlot.objects.get(id=validated_data["time_slot"].id).staff_price * len(pizza)
-        elif price_type == "player":
-            price = TimeSlot.objects.get(
-                id=validated_data["time_slot"].id
-            ).player_price * len(pizza)
-        else:
-            price = TimeSlot.objects.get(
+        if Pizza.objects.filter(id__in=set(pizza)).count() != len(set(pizza)):
+            raise ValidationError("unknown pizza")
+
+        with transaction.atomic():
+            # Orders of a timeslot are placed one at a time, so that the
+            # capacity cannot be exceeded by concurrent orders
+            time_slot = TimeSlot.objects.select_for_update().get(
                 id=validated_data["time_slot"].id
-            ).external_price * len(pizza)
-        validated_data["price"] = price
-
-        # check if the order is a duplicate
-        for order in Order.objects.filter(
-            user=validated_data.get("user"),
-            time_slot=validated_data["time_slot"].id,
-            payment_method=payment_method,
-            price=float(price),
-            created_at__gt=timezone.now() - timedelta(minutes=DUPLICATED_ORDER_DELTA_TIME)
-        ):
-            if sorted(order.get_pizza_ids()) == sorted(pizza):
+            )
+            validated_data["time_slot"] = time_slot
+
+            price: Decimal
+            if payment_method == PaymentMethod.FR:
+                price = Decimal(0)
+            elif price_type == "staff":
+                price = time_slot.staff_price * len(pizza)
+            elif price_type == "player":
+                price = time_slot.player_price * len(pizza)
+            else:
+                price = time_slot.external_price * len(pizza)
+            validated_data["price"] = price
+
+            # check if the order is a duplicate
+            fingerprint = Order.make_fingerprint(
+                validated_data.get("user"), time_slot.id, payment_method, price, pizza
+            )
+            if Order.objects.filter(
+                fingerprint=fingerprint,
+                created_at__gt=timezone.now() - timedelta(minutes=DUPLICATED_ORDER_DELTA_TIME)
+            ).exists():
                 raise ValidationError("duplicated order")
 
-        order = Order.objects.create(**validated_data)
-        for p in pizza:
-            PizzaOrder.objects.create(order=order, pizza=Pizza.objects.get(id=p))
+            ordered = PizzaOrder.objects.filter(order__time_slot=time_slot).count()
+            if ordered + len(pizza) > time_slot.pizza_max:
+                raise ValidationError("timeslot full")
+
+            order = Order.objects.create(fingerprint=fingerprint, **validated_data)
+            PizzaOrder.objects.bulk_create(
+                [PizzaOrder(order=order, pizza_id=p) for p in pizza]
+            )
         return order
 
     def to_representation(self, instance: Order) -> Any:
@@ -126,6 +141,14 @@ class TimeSlotSerializer(serializers.ModelSerializer[TimeSlot]):
         fields = "__all__"
 
 
+class TimeSlotDetailSerializer(serializers.ModelSerializer[TimeSlot]):
+    """Serializer for a timeslot model, without its orders and products"""
+
+    class Meta:
+        model = TimeSlot
+        exclude = ("player_product", "staff_product", "external_product")
+
+
 class TimeSlotIdSerializer(serializers.ModelSerializer[TimeSlot]):
     """Serializer for a timeslot model"""
 
@@ -149,17 +172,11 @@ class PizzaByTimeSlotSerializer(serializers.ModelSerializer[TimeSlot]):
         fields = ("id", "pizza", "delivery_time", "start", "end", "pizza_max", "public", "ended")
 
     def get_pizza(self, obj: TimeSlot) -> dict[int, int]:
-        result: dict[int, int] = {}
         # for each pizza type in the timeslot, count the number of pizza ordered
-        pizzas = PizzaOrder.objects.filter(
-            order__time_slot__id=obj.id
-        ).values("pizza__id").distinct()
-        for pizza in pizzas:
-            result[pizza["pizza__id"]] = PizzaOrder.objects.filter(
-                order__time_slot__id=obj.id,
-                pizza__id=pizza["pizza__id"]
-            ).count()
-        return result
+        # The views listing timeslots count them for a whole page
+        if "pizza_counts" in self.context:
+            return cast(dict[int, int], self.context["pizza_counts"][obj.id])
+        return TimeSlot.count_pizzas([obj.id])[obj.id]
 
 
 class PizzaExportSerializer(serializers.ModelSerializer[PizzaExport]):
@@ -170,5 +187,8 @@ class PizzaExportSerializer(serializers.ModelSerializer[PizzaExport]):
         model = PizzaExport
         fields = "__all__"
 
-    def get_orders(self, obj: PizzaExport) -> ValuesQuerySet[Order, int]:
+    def get_orders(self, obj: PizzaExport) -> ValuesQuerySet[Order, int] | dict[str, int]:
+        # The views computing the pizza counts of the exports give them instead
+        if "pizza_counts" in self.context:
+            return cast(dict[str, int], self.context["pizza_counts"][obj.id])
         return obj.get_orders_id()
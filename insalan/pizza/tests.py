@@ -6,15 +6,23 @@ The tests cover the following functionalities:
 
 """
 
+import json
+import tempfile
 from datetime import timedelta
+from os import path
+from unittest.mock import patch
 
 from django.test import TestCase
 from django.urls import reverse
 from django.utils import timezone
+from reportlab.pdfgen import canvas
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from insalan import settings as app_settings
+from insalan.pizza import kitchen
 from insalan.pizza.models import Pizza, TimeSlot, Order, PizzaOrder, PizzaExport
+from insalan.testing import asgi_body
 from insalan.user.models import User
 
 
@@ -113,6 +121,29 @@ class PizzaEndpointsTestCase(TestCase):
         self.assertEqual(len(response.data["results"]), 1)
         self.assertEqual(response.data["results"][0]["id"], self.time_slot.id)
 
+    def test_pizza_by_timeslot_queries(self) -> None:
+        """Test that the pizzas of a page of timeslots are counted in a single query"""
+        for _ in range(3):
+            time_slot = TimeSlot.objects.create(
+                start=timezone.now(),
+                end=timezone.now() + timedelta(hours=1),
+                delivery_time=timezone.now() + timedelta(hours=2),
+                pizza_max=100,
+            )
+            order = Order.objects.create(time_slot=time_slot, user="Test user", price=10)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza2)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza2)
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        # session, user, timeslots count, timeslots, pizza counts
+        with self.assertNumQueries(5):
+            response = client.get(reverse("pizza/list/by-timeslot"))
+        self.assertEqual(len(response.data["results"]), 4)
+        self.assertEqual(
+            response.data["results"][0]["pizza"], {self.pizza1.id: 1, self.pizza2.id: 1}
+        )
+        self.assertEqual(response.data["results"][3]["pizza"], {self.pizza2.id: 2})
+
     def test_pizza_by_timeslot_unauthorized(self) -> None:
         """Test the pizza by timeslot endpoint with unauthorized user"""
         client = APIClient()
@@ -325,6 +356,42 @@ class PizzaEndpointsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["id"], self.time_slot.id)
 
+    def add_orders(self, count: int) -> None:
+        """Add orders of two pizzas to the timeslot"""
+        for i in range(count):
+            order = Order.objects.create(
+                time_slot=self.time_slot, user=f"user{i}", user_obj=self.admin_user, price=10
+            )
+            PizzaOrder.objects.create(order=order, pizza=self.pizza1)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza2)
+
+    def test_timeslot_detail_queries(self) -> None:
+        """Test that the orders of a timeslot are read in a fixed number of queries"""
+        self.add_orders(5)
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        # session, user, timeslot, its pizzas, orders, their pizzas
+        with self.assertNumQueries(6):
+            response = client.get(
+                reverse("timeslot/detail", kwargs={"pk": self.time_slot.id})
+            )
+        self.assertEqual(len(response.data["orders"]), 6)
+        self.assertEqual(response.data["orders"][0]["user"], "admin")
+        self.assertEqual(response.data["orders"][0]["pizza"], [self.pizza1.id, self.pizza2.id])
+        self.assertNotIn("time_slot", response.data["orders"][0])
+        self.assertNotIn("player_product", response.data)
+
+    def test_timeslot_detail_asgi(self) -> None:
+        """Test that the timeslot detail is sent as is by the ASGI server"""
+        self.add_orders(4)
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        response = client.get(reverse("timeslot/detail", kwargs={"pk": self.time_slot.id}))
+        self.assertFalse(response.streaming)
+        body = json.loads(asgi_body(response))
+        self.assertEqual(body, response.json())
+        self.assertEqual(len(body["orders"]), 5)
+
     def test_timeslot_detail_unauthorized(self) -> None:
         """Test the timeslot detail endpoint with unauthorized user"""
         client = APIClient()
@@ -501,6 +568,57 @@ class PizzaEndpointsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Order.objects.count(), 5)
 
+    def test_order_post_twice_unordered(self) -> None:
+        """Test that an order is a duplicate whatever the order of its pizzas"""
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        data = {
+            "user": "user1",
+            "time_slot": self.time_slot.id,
+            "pizza": [self.pizza1.id, self.pizza2.id, self.pizza1.id],
+            "type": "player",
+        }
+        response = client.post(reverse("order/list"), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["price"], 30)
+        self.assertEqual(PizzaOrder.objects.filter(order=response.data["id"]).count(), 3)
+
+        data["pizza"] = [self.pizza2.id, self.pizza1.id, self.pizza1.id]
+        response = client.post(reverse("order/list"), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_order_post_unknown_pizza(self) -> None:
+        """Test that an order with an unknown pizza is refused"""
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        response = client.post(
+            reverse("order/list"),
+            {"time_slot": self.time_slot.id, "pizza": [self.pizza1.id, 999], "type": "staff"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_post_full_timeslot(self) -> None:
+        """Test that the pizzas of a timeslot cannot exceed its capacity"""
+        self.time_slot.pizza_max = 4
+        self.time_slot.save()
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        response = client.post(
+            reverse("order/list"),
+            {"time_slot": self.time_slot.id, "pizza": [self.pizza1.id] * 3, "type": "staff"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 1)
+
+        response = client.post(
+            reverse("order/list"),
+            {"time_slot": self.time_slot.id, "pizza": [self.pizza1.id] * 2, "type": "staff"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PizzaOrder.objects.count(), 4)
+
     def test_order_list_full(self) -> None:
         """Test the order list full endpoint"""
         client = APIClient()
@@ -524,6 +642,16 @@ class PizzaEndpointsTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["id"], self.order.id)
 
+    def test_order_detail_queries(self) -> None:
+        """Test that an order is read with its timeslot in a fixed number of queries"""
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        # session, user, order and timeslot, pizzas, timeslot pizzas and orders
+        with self.assertNumQueries(6):
+            response = client.get(reverse("order/detail", kwargs={"pk": self.order.id}))
+        self.assertEqual(response.data["time_slot"]["id"], self.time_slot.id)
+        self.assertEqual(response.data["pizza"], [self.pizza1.id, self.pizza2.id])
+
     def test_order_detail_unauthorized(self) -> None:
         """Test the order detail endpoint with unauthorized user"""
         client = APIClient()
@@ -666,6 +794,56 @@ class PizzaEndpointsTestCase(TestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]["orders"][self.order.pizza.all()[0].name], 1)
 
+    def test_export_order_post_new_orders(self) -> None:
+        """Test that a new export only contains the orders which were not exported"""
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        client.post(reverse("timeslot/export", kwargs={"pk": self.time_slot.id}))
+
+        for _ in range(3):
+            order = Order.objects.create(time_slot=self.time_slot, user="Test user", price=10)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza1)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza1)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza2)
+
+        response = client.post(
+            reverse("timeslot/export", kwargs={"pk": self.time_slot.id})
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(
+            response.data[0]["orders"], {"Test Pizza": 1, "Test Pizza 2": 1}
+        )
+        self.assertEqual(
+            response.data[1]["orders"], {"Test Pizza": 6, "Test Pizza 2": 3}
+        )
+
+        # Nothing left to export
+        response = client.post(
+            reverse("timeslot/export", kwargs={"pk": self.time_slot.id})
+        )
+        self.assertEqual(len(response.data), 2)
+
+    def test_export_order_queries(self) -> None:
+        """Test that the pizzas of the exports are counted in a single query"""
+        client = APIClient()
+        client.force_login(user=self.admin_user)
+        for _ in range(3):
+            order = Order.objects.create(time_slot=self.time_slot, user="Test user", price=10)
+            PizzaOrder.objects.create(order=order, pizza=self.pizza2)
+            export = PizzaExport.objects.create(time_slot=self.time_slot)
+            export.orders.add(order)
+
+        # session, user, timeslot, exports, pizza counts
+        with self.assertNumQueries(5):
+            response = client.get(
+                reverse("timeslot/export", kwargs={"pk": self.time_slot.id})
+            )
+        self.assertEqual(len(response.data), 3)
+        with self.assertNumQueries(5):
+            response = client.get(reverse("export/detail", kwargs={"pk": export.id}))
+        self.assertEqual(response.data["orders"], {"Test Pizza 2": 1})
+
 class TestExportOrderGet(TestCase):
     """Test the export get view."""
 
@@ -761,3 +939,128 @@ class TestExportOrderDelete(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertEqual(PizzaExport.objects.count(), 1)
+
+
+class TestExportKitchen(TestCase):
+    """Test the kitchen documents of an export."""
+
+    def setUp(self) -> None:
+        cache_root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(cache_root.cleanup)
+        patcher = patch.object(app_settings, "CACHE_ROOT", cache_root.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.admin_user = User.objects.create(
+            username="admin", email="admin@example.com", is_staff=True
+        )
+        pizza1 = Pizza.objects.create(name="Reine")
+        pizza2 = Pizza.objects.create(name="Margherita")
+        self.time_slot = TimeSlot.objects.create(
+            start=timezone.now(),
+            end=timezone.now() + timedelta(hours=1),
+            delivery_time=timezone.now() + timedelta(hours=2),
+            pizza_max=100,
+        )
+        self.export = PizzaExport.objects.create(time_slot=self.time_slot)
+        # Enough orders to fill several columns
+        for i in range(60):
+            order = Order.objects.create(time_slot=self.time_slot, user=f"user{i}", price=10)
+            PizzaOrder.objects.create(order=order, pizza=pizza1)
+            if i % 2:
+                PizzaOrder.objects.create(order=order, pizza=pizza2)
+            self.export.orders.add(order)
+        self.client.force_login(user=self.admin_user)
+
+    def test_csv(self) -> None:
+        """Test the pizza totals of an export"""
+        response = self.client.get(
+            reverse("export/kitchen", kwargs={"pk": self.export.id, "fmt": "csv"})
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(
+            response.getvalue().decode(), "pizza;quantité\r\nMargherita;30\r\nReine;60\r\n"
+        )
+
+    def test_pdf(self) -> None:
+        """Test that the tickets are rendered once, then served from the disk"""
+        url = reverse("export/kitchen", kwargs={"pk": self.export.id, "fmt": "pdf"})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.getvalue().startswith(b"%PDF"))
+
+        with patch.object(kitchen, "render_export") as render:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        render.assert_not_called()
+
+    def test_header_on_every_page(self) -> None:
+        """Test that the delivery header is drawn again on the overflowing pages"""
+        pages: list[list[str]] = [[]]
+        draw_string = canvas.Canvas.drawString
+        show_page = canvas.Canvas.showPage
+
+        def record_string(pdf: canvas.Canvas, x: float, y: float, text: str) -> None:
+            pages[-1].append(text)
+            draw_string(pdf, x, y, text)
+
+        def record_page(pdf: canvas.Canvas) -> None:
+            pages.append([])
+            show_page(pdf)
+
+        with patch.object(canvas.Canvas, "drawString", record_string), \
+                patch.object(canvas.Canvas, "showPage", record_page):
+            kitchen.render_export(self.export)
+        # Saving the document ends its last page
+        self.assertEqual(pages.pop(), [])
+
+        header = "Livraison " + timezone.localtime(self.time_slot.delivery_time).strftime(
+            "%d/%m/%Y %H:%M"
+        )
+        self.assertGreater(len(pages), 1)
+        for page in pages:
+            self.assertEqual(page[0], header)
+            self.assertEqual(page.count(header), 1)
+
+    def test_rendering(self) -> None:
+        """Test that clients are asked to come back while the document is rendered"""
+        with patch.object(kitchen, "schedule_render") as schedule:
+            response = self.client.get(
+                reverse("export/kitchen", kwargs={"pk": self.export.id, "fmt": "pdf"})
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response["Retry-After"], "2")
+        schedule.assert_called_once_with(self.export)
+
+    def test_not_found(self) -> None:
+        """Test unknown exports and formats"""
+        response = self.client.get(
+            reverse("export/kitchen", kwargs={"pk": self.export.id, "fmt": "xls"})
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse("export/kitchen", kwargs={"pk": 999, "fmt": "pdf"}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete(self) -> None:
+        """Test that the documents of a deleted export are removed"""
+        kitchen.render_export(self.export)
+        pdf_path = kitchen.export_path(self.export, "pdf")
+        self.assertTrue(path.exists(pdf_path))
+        response = self.client.delete(reverse("export/detail", kwargs={"pk": self.export.id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(path.exists(pdf_path))
+
+    def test_warm_documents(self) -> None:
+        """Test that the recent exports without documents are rendered again"""
+        old_export = PizzaExport.objects.create(time_slot=self.time_slot)
+        PizzaExport.objects.filter(id=old_export.id).update(
+            created_at=timezone.now() - timedelta(days=30)
+        )
+
+        self.assertEqual(kitchen.warm_documents(), 1)
+        self.assertIsNotNone(kitchen.cached_document(self.export, "pdf"))
+        self.assertIsNotNone(kitchen.cached_document(self.export, "csv"))
+        old_export.refresh_from_db()
+        self.assertIsNone(kitchen.cached_document(old_export, "pdf"))
+        self.assertEqual(kitchen.warm_documents(), 0)
@@ -23,6 +23,7 @@
    - GET: get an order by id
    - PATCH: update an order by id
    - DELETE: delete an order by id
+- /pizza/export/<id>/<pdf|csv>/: tickets or pizza totals of an export (admin only)
 """
 from django.urls import path
 
@@ -45,4 +46,6 @@ urlpatterns = [
    path("order/full/", views.OrderListFull.as_view(), name="order/list/full"),
    path("order/<int:pk>/", views.OrderDetail.as_view(), name="order/detail"),
    path("export/<int:pk>/", views.ExportOrderDetails.as_view(), name="export/detail"),
+   path("export/<int:pk>/<str:fmt>/", views.ExportOrderKitchen.as_view(),
+        name="export/kitchen"),
 ]
@@ -7,8 +7,10 @@
 from typing import Any, Type
 
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models.query import QuerySet
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.http.response import HttpResponseBase
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -22,11 +24,21 @@ from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 from rest_framework.views import APIView
 
-from insalan.pizza import serializers
+from insalan.pizza import kitchen, serializers
 
 from .models import Pizza, TimeSlot, Order, PizzaExport
 
 
+# Seconds after which clients should ask again for a document being rendered
+KITCHEN_RETRY_AFTER = 2
+
+
+def serialize_order(order: dict[str, Any]) -> dict[str, Any]:
+    """Serialized order in the orders of its timeslot"""
+    order.pop("time_slot")
+    return order
+
+
 class ReadOnly(permissions.BasePermission):
     """Read-Only permissions"""
 
@@ -326,7 +338,17 @@ class PizzaListByTimeSlot(generics.ListAPIView[TimeSlot]):  # pylint: disable=un
         """
         Get pizzas ordered for a timeslot
         """
-        return super().get(request, *args, **kwargs)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        timeslots = page if page is not None else list(self.get_queryset())
+        # The pizzas of the whole page are counted at once
+        context = {
+            **self.get_serializer_context(),
+            "pizza_counts": TimeSlot.count_pizzas(timeslot.id for timeslot in timeslots),
+        }
+        serializer = self.get_serializer(timeslots, many=True, context=context)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
 
 # pylint: disable-next=unsubscriptable-object
@@ -441,24 +463,23 @@ class TimeSlotDetail(generics.RetrieveAPIView[TimeSlot], generics.DestroyAPIView
         }
     )
     def get(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        if not TimeSlot.objects.filter(id=self.kwargs["pk"]).exists():
+        timeslot = TimeSlot.objects.filter(id=self.kwargs["pk"]).first()
+        if timeslot is None:
             return Response({"detail": _("Not found.")}, status=404)
-        timeslot = TimeSlot.objects.get(id=self.kwargs["pk"])
-        serializer = serializers.TimeSlotSerializer(timeslot, context={"request": request}).data
-
-        order_serialized = []
-        for order in serializer["orders"]:
-            order = Order.objects.get(id=order)
-            order_serializer = serializers.OrderSerializer(order).data
-            order_serializer.pop("time_slot")
-            order_serialized.append(order_serializer)
-        serializer["orders"].clear()
-        serializer["orders"] = order_serialized
-
-        serializer.pop("player_product")
-        serializer.pop("staff_product")
-        serializer.pop("external_product")
+        serializer = serializers.TimeSlotDetailSerializer(
+            timeslot, context={"request": request}
+        ).data
+        orders = (
+            Order.objects.filter(time_slot=timeslot)
+            .select_related("user_obj")
+            .prefetch_related("pizza")
+            .order_by("-id")
+        )
 
+        serializer["orders"] = [
+            serialize_order(order)
+            for order in serializers.OrderSerializer(orders, many=True).data
+        ]
         return Response(serializer)
 
     @swagger_auto_schema(  # type: ignore[misc]
@@ -577,13 +598,17 @@ class OrderDetail(generics.RetrieveUpdateDestroyAPIView[Order]):
         }
     )
     def get(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        if not Order.objects.filter(id=self.kwargs["pk"]).exists():
+        order = (
+            Order.objects.select_related("time_slot", "user_obj")
+            .prefetch_related("pizza")
+            .filter(id=self.kwargs["pk"])
+            .first()
+        )
+        if order is None:
             return Response({"detail": _("Not found.")}, status=404)
-        order = Order.objects.get(id=self.kwargs["pk"])
         serializer = serializers.OrderSerializer(order, context={"request": request}).data
 
-        timeslot = TimeSlot.objects.get(id=serializer["time_slot"])
-        timeslot_serializer = serializers.TimeSlotSerializer(timeslot).data
+        timeslot_serializer = serializers.TimeSlotSerializer(order.time_slot).data
         timeslot_serializer.pop("player_product")
         timeslot_serializer.pop("staff_product")
         timeslot_serializer.pop("external_product")
@@ -615,9 +640,9 @@ class OrderDetail(generics.RetrieveUpdateDestroyAPIView[Order]):
         }
     )
     def patch(self, request: Request, *args: Any, **kwargs: Any) -> Response:
-        if not Order.objects.filter(id=self.kwargs["pk"]).exists():
+        order = Order.objects.filter(id=self.kwargs["pk"]).first()
+        if order is None:
             return Response({"detail": _("Not found.")}, status=404)
-        order = Order.objects.get(id=self.kwargs["pk"])
         data = request.data
 
         if "delivered" in data and data["delivered"] is True:
@@ -728,23 +753,15 @@ class ExportOrder(generics.ListCreateAPIView[PizzaExport]):
     def get(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         if not TimeSlot.objects.filter(id=self.kwargs["pk"]).exists():
             return Response({"detail": _("Not found.")}, status=404)
-        export = PizzaExport.objects.filter(time_slot=self.kwargs["pk"])
-        serializer = serializers.PizzaExportSerializer(export, many=True).data
+        exports = list(PizzaExport.objects.filter(time_slot=self.kwargs["pk"]))
+        pizza_counts = PizzaExport.count_pizzas(export.id for export in exports)
+        serializer = serializers.PizzaExportSerializer(
+            exports, many=True, context={"pizza_counts": pizza_counts}
+        ).data
 
         for s in serializer:
             s.pop("time_slot")
 
-            pizza_count = {}
-            for order in s["orders"]:
-                order = Order.objects.get(id=order)
-                for pizza in order.pizza.all():
-                    if pizza.name not in pizza_count:
-                        pizza_count[pizza.name] = 1
-                    else:
-                        pizza_count[pizza.name] += 1
-
-            s["orders"] = pizza_count
-
         return Response(serializer)
 
     @swagger_auto_schema(  # type: ignore[misc]
@@ -783,20 +800,22 @@ class ExportOrder(generics.ListCreateAPIView[PizzaExport]):
     def post(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         if not TimeSlot.objects.filter(id=self.kwargs["pk"]).exists():
             return Response({"detail": _("Not found.")}, status=404)
-        timeslot = TimeSlot.objects.get(id=self.kwargs["pk"])
-
-        # get the list of orders
-        orders = Order.objects.filter(time_slot=timeslot)
-
-        # remove the order already exported
-        for export in PizzaExport.objects.filter(time_slot=timeslot):
-            orders = orders.exclude(id__in=export.orders.all())
+        with transaction.atomic():
+            # Exports of the timeslot are created one at a time, so that an
+            # order is never exported twice
+            timeslot = TimeSlot.objects.select_for_update().get(id=self.kwargs["pk"])
+
+            # orders of the timeslot which are in no export yet
+            orders = list(
+                Order.objects.filter(time_slot=timeslot, orders__isnull=True)
+                .values_list("id", flat=True)
+            )
 
-        # if no order to export
-        if orders.exists():
-            # create the export
-            export = PizzaExport.objects.create(time_slot=timeslot)
-            export.orders.set(orders)
+            # if no order to export
+            if orders:
+                # create the export
+                export = PizzaExport.objects.create(time_slot=timeslot)
+                export.orders.add(*orders)
 
         # return the export (using get)
         return self.get(request, *args, **kwargs)  # type: ignore [no-any-return]
@@ -846,18 +865,9 @@ class ExportOrderDetails(generics.RetrieveDestroyAPIView[PizzaExport]):
         if not PizzaExport.objects.filter(id=self.kwargs["pk"]).exists():
             return Response({"detail": _("Not found.")}, status=404)
         export = PizzaExport.objects.get(id=self.kwargs["pk"])
-        serializer = serializers.PizzaExportSerializer(export).data
-
-        pizza_count = {}
-        for order in serializer["orders"]:
-            order = Order.objects.get(id=order)
-            for pizza in order.pizza.all():
-                if pizza.name not in pizza_count:
-                    pizza_count[pizza.name] = 1
-                else:
-                    pizza_count[pizza.name] += 1
-
-        serializer["orders"] = pizza_count
+        serializer = serializers.PizzaExportSerializer(
+            export, context={"pizza_counts": PizzaExport.count_pizzas([export.id])}
+        ).data
         return Response(serializer)
 
     @swagger_auto_schema(  # type: ignore[misc]
@@ -886,3 +896,56 @@ class ExportOrderDetails(generics.RetrieveDestroyAPIView[PizzaExport]):
     def delete(self, request: Request, *args: Any, **kwargs: Any) -> Response:
         """Delete an export."""
         return super().delete(request, *args, **kwargs)
+
+    def perform_destroy(self, instance: PizzaExport) -> None:
+        kitchen.remove_documents(instance)
+        super().perform_destroy(instance)
+
+
+class ExportOrderKitchen(APIView):
+    """Get the PDF tickets or the CSV totals of an export"""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(  # type: ignore[misc]
+        responses={
+            200: openapi.Response(description=_("Document de l'export")),
+            202: openapi.Response(description=_("Document en cours de génération")),
+            404: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "detail": openapi.Schema(
+                        type=openapi.TYPE_STRING,
+                        description=_("Export non trouvé.")
+                    )
+                }
+            )
+        }
+    )
+    def get(self, request: Request, *args: Any, **kwargs: Any) -> HttpResponseBase:
+        """
+        Get a document of an export, once rendered
+
+        The first requests answer 202 while the document is rendered, with the
+        number of seconds to wait in Retry-After.
+        """
+        fmt = self.kwargs["fmt"]
+        export = PizzaExport.objects.filter(id=self.kwargs["pk"]).first()
+        if export is None or fmt not in kitchen.KITCHEN_CONTENT_TYPES:
+            return Response({"detail": _("Not found.")}, status=404)
+
+        file_path = kitchen.cached_document(export, fmt)
+        if file_path is None:
+            kitchen.schedule_render(export)
+            file_path = kitchen.cached_document(export, fmt)
+        if file_path is None:
+            response = Response({"detail": _("Export en cours de génération.")}, status=202)
+            response["Retry-After"] = str(KITCHEN_RETRY_AFTER)
+            return response
+
+        return FileResponse(
+            open(file_path, "rb"),  # pylint: disable=consider-using-with
+            as_attachment=True,
+            filename=f"export-{export.id}.{fmt}",
+            content_type=kitchen.KITCHEN_CONTENT_TYPES[fmt],
+        )
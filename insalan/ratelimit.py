@@ -0,0 +1,66 @@
+"""
+Rate limiting helpers shared by the clients of external services.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens are refilled continuously at `rate` tokens per second, up to
+    `capacity`, and each call consumes as many tokens as requests made. The
+    rate must be positive: a bucket that never refills would block forever.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        if rate <= 0:
+            raise ValueError(f"The rate of a token bucket must be positive, not {rate}")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, count: int) -> int:
+        """
+        Consume up to `count` tokens without waiting and return how many
+        were granted.
+        """
+        with self._lock:
+            self._refill()
+            granted = min(count, int(self._tokens))
+            self._tokens -= granted
+            return granted
+
+    def give_back(self, count: int) -> None:
+        """Return tokens that were granted but not used"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + count)
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """
+        Consume a token, waiting for one to be refilled if needed.
+
+        Return False if no token could be obtained within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                if time.monotonic() + wait > deadline:
+                    return False
+            time.sleep(wait)
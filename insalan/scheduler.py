@@ -1,10 +1,200 @@
+"""
+Background jobs of the backend
+
+Every process runs a scheduler for the one-off jobs started by its requests
+(documents to render, names to refresh...). The periodic jobs of the registry
+(mail delivery, notifications, reconciliation, cache warming...) must only run
+once, whatever the number of workers: the server processes elect a leader by
+taking a PostgreSQL advisory lock on a connection of their own, and only the
+leader schedules them. Every SCHEDULER_LEADER_INTERVAL seconds, the leader
+checks that it still holds the lock, and schedules the jobs registered since,
+while the others try to take it, so that another process takes over when the
+leader stops.
+
+Only the entrypoints of the server (asgi.py, wsgi.py) take part in the
+election: management commands load the URLconf too, but must never run the
+periodic jobs.
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
 from apscheduler.schedulers.background import BackgroundScheduler # type: ignore[import]
 from apscheduler.schedulers import SchedulerAlreadyRunningError # type: ignore[import]
+from apscheduler.jobstores.base import JobLookupError # type: ignore[import]
 from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, close_old_connections, connections,
+)
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.utils import timezone
+
+from insalan import settings as app_settings
+
+logger = logging.getLogger(__name__)
+
 scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
 
+
+@dataclass
+class PeriodicJob:
+    """A job run every `seconds` seconds by the leader"""
+    name: str
+    func: Callable[[], Any]
+    seconds: float
+
+
+# Periodic jobs, by name
+jobs: dict[str, PeriodicJob] = {}
+
+
+def register_job(name: str, func: Callable[[], Any], seconds: float) -> None:
+    """Add a job to the ones the leader runs periodically"""
+    jobs[name] = PeriodicJob(name, func, seconds)
+
+
+def run_job(name: str) -> None:
+    """Run a periodic job, and record how it went in its metrics"""
+    # pylint: disable-next=import-outside-toplevel
+    from insalan.models import JobMetrics
+
+    started_at = timezone.now()
+    clock = time.monotonic()
+    error = ""
+    try:
+        jobs[name].func()
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        logger.exception("Periodic job %s failed", name)
+        error = repr(err)
+    try:
+        JobMetrics.record(name, started_at, time.monotonic() - clock, error)
+    except DatabaseError:
+        logger.exception("Unable to record the metrics of job %s", name)
+    finally:
+        close_old_connections()
+
+
+class LeaderElection:
+    """
+    Election of the process running the periodic jobs, through an advisory
+    lock held by a connection of its own
+    """
+
+    def __init__(self, target: BackgroundScheduler, lock_id: int) -> None:
+        self.scheduler = target
+        self.lock_id = lock_id
+        self.is_leader = False
+        self._connection: BaseDatabaseWrapper | None = None
+        self._lock = threading.Lock()
+
+    def _cursor_value(self, query: str) -> Any:
+        if self._connection is None:
+            # Not the connection of a thread, which is closed between requests
+            self._connection = connections.create_connection(DEFAULT_DB_ALIAS)
+            self._connection.inc_thread_sharing()
+        with self._connection.cursor() as cursor:
+            cursor.execute(query, [self.lock_id])
+            return cursor.fetchone()[0]
+
+    def elect(self) -> bool:
+        """Take or keep the lock, and schedule the periodic jobs of a new leader"""
+        with self._lock:
+            try:
+                if self.is_leader:
+                    # The lock is lost with the connection
+                    held = self._cursor_value(
+                        "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' "
+                        "AND (classid::bigint << 32 | objid::bigint) = %s AND objsubid = 1 "
+                        "AND pid = pg_backend_pid() AND granted"
+                    ) > 0
+                else:
+                    held = bool(self._cursor_value("SELECT pg_try_advisory_lock(%s)"))
+            except (DatabaseError, InterfaceError) as err:
+                logger.warning("Unable to take part in the scheduler election: %s", err)
+                held = False
+                self._close()
+            if held:
+                if not self.is_leader:
+                    logger.info("Elected to run the periodic jobs")
+                self._schedule_jobs()
+            elif self.is_leader:
+                logger.warning("Lost the lock of the periodic jobs")
+                self._unschedule_jobs()
+                self._close()
+            self.is_leader = bool(held)
+            return self.is_leader
+
+    def resign(self) -> None:
+        """Stop running the periodic jobs, and let another process take over"""
+        with self._lock:
+            if self.is_leader:
+                self._unschedule_jobs()
+                try:
+                    # Released right away, while closing the connection may
+                    # take a while to be noticed by the server
+                    self._cursor_value("SELECT pg_advisory_unlock(%s)")
+                except (DatabaseError, InterfaceError):
+                    pass
+            self.is_leader = False
+            self._close()
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except (DatabaseError, InterfaceError):
+                pass
+            self._connection = None
+
+    def _schedule_jobs(self) -> None:
+        """Schedule the jobs which are not yet, keeping the timers of the others"""
+        for job in jobs.values():
+            if self.scheduler.get_job(f"periodic:{job.name}") is not None:
+                continue
+            self.scheduler.add_job(
+                run_job, "interval", args=[job.name], seconds=job.seconds,
+                id=f"periodic:{job.name}", max_instances=1, coalesce=True,
+            )
+
+    def _unschedule_jobs(self) -> None:
+        for name in jobs:
+            try:
+                self.scheduler.remove_job(f"periodic:{name}")
+            except JobLookupError:
+                pass
+
+
+# Election of this process, once it takes part in it
+election: LeaderElection | None = None
+
+
 def start() -> None:
+    """Start the scheduler of this process, for its one-off jobs"""
+    if "test" in sys.argv:
+        # Tests run the background work synchronously
+        return
     try:
         scheduler.start()
     except SchedulerAlreadyRunningError:
         pass
+
+
+def start_election() -> None:
+    """Take part in the election of the process running the periodic jobs"""
+    global election  # pylint: disable=global-statement
+    if "test" in sys.argv or election is not None:
+        return
+    start()
+    election = LeaderElection(scheduler, app_settings.SCHEDULER_LOCK_ID)
+    scheduler.add_job(
+        election.elect, "interval", seconds=app_settings.SCHEDULER_LEADER_INTERVAL,
+        id="leader-election", next_run_time=timezone.now(),
+        max_instances=1, coalesce=True,
+    )
@@ -210,6 +210,28 @@ STATICFILES_DIRS = [path.join(BASE_DIR, "assets")]
 MEDIA_URL = 'v1/media/'
 MEDIA_ROOT = 'v1/' + getenv("MEDIA_ROOT", "media/")
 
+# Local on-disk caches (generated QR codes, exports...), never served directly
+CACHE_ROOT = 'v1/' + getenv("CACHE_ROOT", "cache/")
+QRCODE_CACHE_SIZE = int(getenv("QRCODE_CACHE_SIZE", "1024"))
+# Every KITCHEN_WARM_INTERVAL seconds, the documents of the pizza exports of the
+# last KITCHEN_WARM_AGE seconds which are not cached yet are rendered
+KITCHEN_WARM_INTERVAL = int(getenv("KITCHEN_WARM_INTERVAL", "300"))
+KITCHEN_WARM_AGE = int(getenv("KITCHEN_WARM_AGE", "172800"))
+
+# Seconds during which the rendered CMS contents are served without checking
+# whether the CMS was modified by another worker
+CMS_RENDER_VERSION_TTL = float(getenv("CMS_RENDER_VERSION_TTL", "5"))
+
+# Seconds during which the encoded seat map of an event is served without
+# reading the seats again. Changes made by this process are seen right away,
+# the ones made by another worker after at most this delay.
+SEAT_MAP_CACHE_TTL = float(getenv("SEAT_MAP_CACHE_TTL", "5"))
+
+# Periodic jobs run in the process holding the SCHEDULER_LOCK_ID advisory lock,
+# which the processes try to take every SCHEDULER_LEADER_INTERVAL seconds
+SCHEDULER_LOCK_ID = int(getenv("SCHEDULER_LOCK_ID", "4815162342"))
+SCHEDULER_LEADER_INTERVAL = int(getenv("SCHEDULER_LEADER_INTERVAL", "30"))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -246,9 +268,26 @@ EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 # pylint: disable-next=line-too-long
 EMAIL_AUTH = json.loads(getenv("MAIL_AUTH", '{"contact": {"from":"noreply@insalan.fr", "pass":"password", "host":"localhost", "port":587, "ssl":true}, "tournament": {"from":"noreply@insalan.fr", "pass":"password", "host":"localhost", "port":587, "ssl":true}}'))
 EMAIL_SUBJECT_PREFIX = "[InsaLan] "
+# Attachments of the queued mails are kept there until they are sent. Files
+# written in the last MAIL_SPOOL_GRACE seconds may belong to a mail being queued
+# and are never removed, the spool being swept again every MAIL_SPOOL_GRACE seconds
+MAIL_SPOOL_ROOT = 'v1/' + getenv("MAIL_SPOOL_ROOT", "mail-spool/")
+MAIL_SPOOL_GRACE = int(getenv("MAIL_SPOOL_GRACE", "3600"))
+# Delivery of the queued mails. The rate limit (mails per minute) and batch size
+# can be overridden per mailer with the "rate" and "batch" keys of MAIL_AUTH
+EMAIL_DELIVERY_INTERVAL = int(getenv("MAIL_DELIVERY_INTERVAL", "10"))
+EMAIL_RATE_LIMIT = float(getenv("MAIL_RATE_LIMIT", "60"))
+EMAIL_BATCH_SIZE = int(getenv("MAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(getenv("MAIL_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_DELAY = int(getenv("MAIL_RETRY_DELAY", "60"))
+EMAIL_MAX_RETRY_DELAY = int(getenv("MAIL_MAX_RETRY_DELAY", "21600"))
 
 # Payment variables
-HA_URL = f"https://{format(getenv('HELLOASSO_HOSTNAME', 'api.helloasso-sandbox.com'))}"
+# HELLOASSO_URL points to another server, such as `manage.py fake_helloasso`
+HA_URL = getenv(
+    "HELLOASSO_URL",
+    f"https://{format(getenv('HELLOASSO_HOSTNAME', 'api.helloasso-sandbox.com'))}",
+)
 HA_ORG_SLUG = getenv("HELLOASSO_ORGANIZATION_SLUG", "insalan-test")
 # View URLs (fall back on the front page if needed)
 HA_RETURN_URL = getenv("HELLOASSO_RETURN_URL", f"https://{WEBSITE_HOST}/")
@@ -257,9 +296,39 @@ HA_BACK_URL = getenv("HELLOASSO_BACK_URL", f"https://{WEBSITE_HOST}/")
 # OAuth Credentials
 HA_OAUTH_CLIENT_SECRET = getenv("HELLOASSO_CLIENT_SECRET")
 HA_OAUTH_CLIENT_ID = getenv("HELLOASSO_CLIENT_ID")
+# HTTP client: timeout (seconds), connection pool, retries of idempotent
+# requests, and circuit breaker (failures before opening, seconds before retrying)
+HA_TIMEOUT = float(getenv("HELLOASSO_TIMEOUT", "45"))
+HA_POOL_SIZE = int(getenv("HELLOASSO_POOL_SIZE", "10"))
+HA_MAX_RETRIES = int(getenv("HELLOASSO_MAX_RETRIES", "2"))
+HA_BREAKER_THRESHOLD = int(getenv("HELLOASSO_BREAKER_THRESHOLD", "5"))
+HA_BREAKER_COOLDOWN = float(getenv("HELLOASSO_BREAKER_COOLDOWN", "30"))
+# Refresh the OAuth token this many seconds before it expires
+HA_TOKEN_REFRESH_MARGIN = int(getenv("HELLOASSO_TOKEN_REFRESH_MARGIN", "120"))
+# Notifications are processed by a pool of threads, and swept periodically
+# (seconds) in case a worker stopped before processing them
+HA_NOTIFICATION_WORKERS = int(getenv("HELLOASSO_NOTIFICATION_WORKERS", "4"))
+HA_NOTIFICATION_INTERVAL = int(getenv("HELLOASSO_NOTIFICATION_INTERVAL", "60"))
+# Pending transactions untouched for HA_RECONCILE_AFTER seconds are checked
+# against HelloAsso every HA_RECONCILE_INTERVAL seconds, HA_RECONCILE_BATCH at
+# a time, and expired if their intent was not paid HA_INTENT_EXPIRY seconds
+# after its creation
+HA_RECONCILE_AFTER = int(getenv("HELLOASSO_RECONCILE_AFTER", "900"))
+HA_RECONCILE_INTERVAL = int(getenv("HELLOASSO_RECONCILE_INTERVAL", "300"))
+HA_RECONCILE_BATCH = int(getenv("HELLOASSO_RECONCILE_BATCH", "50"))
+HA_INTENT_EXPIRY = int(getenv("HELLOASSO_INTENT_EXPIRY", "3600"))
 
 RIOT_API_KEY = getenv("RIOT_API_KEY", "RGAPI-00000000-0000-0000-0000-000000000000")
 FACEIT_API_KEY = getenv("FACEIT_API_KEY", "00000000-0000-0000-0000-000000000000")
+# Game name validators: requests per second allowed by each API (and burst),
+# lookups cached (entries, seconds), and threads used to refresh many names
+RIOT_API_RATE = float(getenv("RIOT_API_RATE", "0.8"))
+RIOT_API_BURST = int(getenv("RIOT_API_BURST", "20"))
+FACEIT_API_RATE = float(getenv("FACEIT_API_RATE", "2"))
+FACEIT_API_BURST = int(getenv("FACEIT_API_BURST", "10"))
+NAME_VALIDATOR_CACHE_SIZE = int(getenv("NAME_VALIDATOR_CACHE_SIZE", "2048"))
+NAME_VALIDATOR_CACHE_TTL = int(getenv("NAME_VALIDATOR_CACHE_TTL", "600"))
+NAME_VALIDATOR_WORKERS = int(getenv("NAME_VALIDATOR_WORKERS", "4"))
 
 # Session cookie settings
 SESSION_COOKIE_AGE = int(getenv("SESSION_COOKIE_AGE", "1209600"))
@@ -0,0 +1,200 @@
+"""
+Local SMTP sink.
+
+A minimal SMTP server that accepts every message (and any credentials) and
+keeps it in memory. It lets tests and benchmarks run the real mailer
+pipeline, over the network, without any mail leaving the machine.
+"""
+from __future__ import annotations
+
+import socketserver
+import threading
+import time
+from dataclasses import dataclass, field
+from email import message_from_bytes
+from email.message import Message
+from types import TracebackType
+
+
+@dataclass
+class SunkMessage:
+    """A message received by the sink"""
+    mail_from: str
+    recipients: list[str]
+    data: bytes
+    # Number of the SMTP session the message was sent in
+    session: int = 0
+    received_at: float = field(default_factory=time.time)
+
+    def parse(self) -> Message:
+        """Parse the raw message"""
+        return message_from_bytes(self.data)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib and Django's SMTP backend"""
+
+    server: _SMTPServer
+
+    def reply(self, line: str) -> None:
+        """Send a reply line to the client"""
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def read_line(self) -> str | None:
+        """Read a command line, None when the client went away"""
+        line = self.rfile.readline()
+        if not line:
+            return None
+        return line.decode(errors="replace").rstrip("\r\n")
+
+    def read_data(self) -> bytes:
+        """Read the message content, until the lone dot"""
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                break
+            # Undo the dot-stuffing
+            if line.startswith(b".."):
+                line = line[1:]
+            lines.append(line)
+        return b"".join(lines)
+
+    def handle(self) -> None:
+        mail_from = ""
+        recipients: list[str] = []
+        session = self.server.sink.open_session()
+        self.reply("220 insalan-smtp-sink ready")
+        while True:
+            line = self.read_line()
+            if line is None:
+                return
+            command, _, argument = line.partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.reply("250-insalan-smtp-sink")
+                self.reply("250-8BITMIME")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command == "HELO":
+                self.reply("250 insalan-smtp-sink")
+            elif command == "AUTH":
+                mechanism, _, initial = argument.partition(" ")
+                if mechanism.upper() == "LOGIN":
+                    self.reply("334 VXNlcm5hbWU6")
+                    self.read_line()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.read_line()
+                elif not initial:
+                    self.reply("334 ")
+                    self.read_line()
+                self.reply("235 Authentication successful")
+            elif command == "MAIL":
+                mail_from = argument.partition(":")[2].strip().strip("<>")
+                recipients = []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipients.append(argument.partition(":")[2].strip().strip("<>"))
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.sink.store(
+                    SunkMessage(mail_from, recipients, self.read_data(), session)
+                )
+                self.reply("250 OK")
+            elif command == "RSET":
+                mail_from = ""
+                recipients = []
+                self.reply("250 OK")
+            elif command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], sink: SMTPSink) -> None:
+        super().__init__(address, _SMTPHandler)
+        self.sink = sink
+
+
+class SMTPSink:
+    """
+    SMTP server keeping every message it receives.
+
+    Use it as a context manager, or call `start` and `stop`. With port 0, a
+    free port is picked and available in `port` once started.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.messages: list[SunkMessage] = []
+        self.sessions = 0
+        self._lock = threading.Lock()
+        self._received = threading.Condition(self._lock)
+        self._server: _SMTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def open_session(self) -> int:
+        """Count a new SMTP session, and return its number"""
+        with self._lock:
+            self.sessions += 1
+            return self.sessions
+
+    def store(self, message: SunkMessage) -> None:
+        """Keep a received message"""
+        with self._received:
+            self.messages.append(message)
+            self._received.notify_all()
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        """Wait until at least `count` messages were received"""
+        with self._received:
+            return self._received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    def clear(self) -> None:
+        """Forget the received messages"""
+        with self._lock:
+            self.messages.clear()
+            self.sessions = 0
+
+    def start(self) -> None:
+        """Start serving in a background thread"""
+        self._server = _SMTPServer((self.host, self.port), self)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        """Serve in the current thread"""
+        self._server = _SMTPServer((self.host, self.port), self)
+        self.port = self._server.server_address[1]
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        """Stop serving"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> SMTPSink:
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.stop()
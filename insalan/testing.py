@@ -0,0 +1,41 @@
+"""
+Helpers shared by the tests of the apps
+"""
+
+from collections.abc import Mapping
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished
+from django.db import close_old_connections
+from django.http.response import HttpResponseBase
+
+
+def asgi_body(response: HttpResponseBase) -> bytes:
+    """
+    Send a response the way the ASGI server does, and return its body
+
+    Unlike the test clients, the ASGI handler iterates streaming responses
+    on the event loop, where the database cannot be queried.
+    """
+    body: list[bytes] = []
+
+    async def send(message: Mapping[str, Any]) -> None:
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    close = response.close
+
+    def close_keeping_connection() -> None:
+        # Closing the response must not close the connection of the test
+        # case, as with the test clients
+        request_finished.disconnect(close_old_connections)
+        try:
+            close()
+        finally:
+            request_finished.connect(close_old_connections)
+
+    response.close = close_keeping_connection  # type: ignore[method-assign]
+    async_to_sync(ASGIHandler().send_response)(response, send)
+    return b"".join(body)
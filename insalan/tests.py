@@ -0,0 +1,378 @@
+"""Tests of the mail outbox and of the scheduler"""
+
+import io
+import os
+import shutil
+import tempfile
+from os import path
+from unittest import mock
+
+from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore[import]
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.mail import EmailMessage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from insalan import settings
+from insalan.mailer import UserMailer
+from insalan import scheduler
+from insalan.models import JobMetrics, OutboxMail
+from insalan.smtp_sink import SMTPSink
+
+
+class OutboxTestCase(TestCase):
+    """Tests of the database backed outbox of the mailers"""
+
+    def setUp(self) -> None:
+        self.spool = tempfile.mkdtemp()
+        self.settings_override = override_settings(MAIL_SPOOL_ROOT=self.spool,
+                                                   MAIL_SPOOL_GRACE=0)
+        self.settings_override.enable()
+        self.mailer = UserMailer("localhost", "587", "noreply@insalan.fr", "password", False)
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        shutil.rmtree(self.spool)
+
+    def queue_mail(self, subject: str = "Sujet", attachment: bytes | None = None) -> OutboxMail:
+        """Queue a mail for a test recipient"""
+        email = EmailMessage(subject, "Contenu", "noreply@insalan.fr", ["joueur@insalan.fr"])
+        if attachment is not None:
+            email.attach("billet.pdf", attachment, "application/pdf")
+        return self.mailer.enqueue(email)
+
+    def test_enqueue(self) -> None:
+        """Test that queued mails are stored with their attachment spooled"""
+        outbox_mail = self.queue_mail(attachment=b"%PDF")
+
+        self.assertEqual(self.mailer.pending_count(), 1)
+        self.assertEqual(outbox_mail.to, ["joueur@insalan.fr"])
+        self.assertEqual(len(outbox_mail.attachments), 1)
+        self.assertTrue(outbox_mail.attachments[0]["path"].startswith(self.spool))
+        with open(outbox_mail.attachments[0]["path"], "rb") as file:
+            self.assertEqual(file.read(), b"%PDF")
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_shared_attachment_is_spooled_once(self) -> None:
+        """Test that identical attachments share the same spooled file"""
+        first = self.queue_mail(attachment=b"%PDF")
+        second = self.queue_mail(attachment=b"%PDF")
+        self.assertEqual(first.attachments[0]["path"], second.attachments[0]["path"])
+
+    def test_send_queued(self) -> None:
+        """Test that queued mails are sent in order and their attachment released"""
+        first = self.queue_mail("Premier", b"%PDF")
+        self.queue_mail("Second")
+
+        self.assertEqual(self.mailer.send_queued(), 2)
+
+        self.assertEqual([email.subject for email in mail.outbox], ["Premier", "Second"])
+        self.assertEqual(mail.outbox[0].attachments[0][1], b"%PDF")
+        first.refresh_from_db()
+        self.assertEqual(first.status, OutboxMail.Status.SENT)
+        self.assertIsNotNone(first.sent_at)
+        self.assertFalse(path.exists(first.attachments[0]["path"]))
+        self.assertEqual(self.mailer.pending_count(), 0)
+
+    def test_rate_limit(self) -> None:
+        """Test that no more mails than allowed by the rate limit are sent"""
+        mailer = UserMailer("localhost", "587", "noreply@insalan.fr", "password", False,
+                            rate=1, batch_size=3)
+        for i in range(5):
+            self.queue_mail(f"Mail {i}")
+
+        self.assertEqual(mailer.send_queued(), 3)
+        self.assertEqual(mailer.send_queued(), 0)
+        self.assertEqual(mailer.pending_count(), 2)
+
+    def test_shared_attachment_kept_while_pending(self) -> None:
+        """Test that an attachment still used by a pending mail is kept"""
+        first = self.queue_mail("Premier", b"%PDF")
+        self.queue_mail("Second", b"%PDF")
+        mailer = UserMailer("localhost", "587", "noreply@insalan.fr", "password", False,
+                            batch_size=1)
+
+        mailer.send_queued()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertTrue(path.exists(first.attachments[0]["path"]))
+
+    def test_recent_attachment_kept(self) -> None:
+        """
+        Test that a recently spooled attachment is kept after its mail is
+        sent, as a mail being queued may use it, until the spool is purged
+        """
+        first = self.queue_mail("Premier", b"%PDF")
+        with override_settings(MAIL_SPOOL_GRACE=3600):
+            self.assertEqual(self.mailer.send_queued(), 1)
+            self.assertTrue(path.exists(first.attachments[0]["path"]))
+            self.assertEqual(OutboxMail.purge_spool(), 0)
+        self.assertTrue(path.exists(first.attachments[0]["path"]))
+
+        self.assertEqual(OutboxMail.purge_spool(), 1)
+        self.assertFalse(path.exists(first.attachments[0]["path"]))
+
+    def test_purge_spool(self) -> None:
+        """Test that only the files no pending mail refers to are purged"""
+        pending = self.queue_mail("Premier", b"%PDF")
+        orphan = OutboxMail.spool_attachment("orphan.pdf", b"orphan", None)
+        with open(path.join(self.spool, "tmpabcdef"), "wb") as file:
+            file.write(b"%PD")
+
+        self.assertEqual(OutboxMail.purge_spool(), 2)
+        self.assertTrue(path.exists(pending.attachments[0]["path"]))
+        self.assertFalse(path.exists(str(orphan["path"])))
+        self.assertEqual(
+            sorted(name for _, _, names in os.walk(self.spool) for name in names),
+            [path.basename(pending.attachments[0]["path"])],
+        )
+
+    def test_failed_mail_backoff(self) -> None:
+        """Test that a mail which failed is retried later, with a growing delay"""
+        first = self.queue_mail("Premier")
+        self.queue_mail("Second")
+
+        def send_messages(messages: list[EmailMessage]) -> int:
+            if messages[0].subject == "Premier":
+                raise OSError("refused")
+            mail.outbox.extend(messages)
+            return len(messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+                        side_effect=send_messages), \
+             self.assertLogs("insalan.mailer", "WARNING"):
+            self.assertEqual(self.mailer.send_queued(), 1)
+        self.assertEqual(mail.outbox[0].subject, "Second")
+
+        first.refresh_from_db()
+        self.assertEqual(first.status, OutboxMail.Status.PENDING)
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual(first.last_error, "refused")
+        self.assertGreater(first.scheduled_at, timezone.now())
+        # Not retried before the delay expires
+        self.assertEqual(self.mailer.send_queued(), 0)
+
+        self.assertLess(UserMailer.retry_delay(1), UserMailer.retry_delay(2))
+        self.assertLess(UserMailer.retry_delay(2), UserMailer.retry_delay(3))
+
+    def test_failed_mail_gives_up(self) -> None:
+        """Test that a mail is marked as failed after too many attempts"""
+        outbox_mail = self.queue_mail("Premier")
+        OutboxMail.objects.filter(id=outbox_mail.id).update(
+            attempts=settings.EMAIL_MAX_ATTEMPTS - 1
+        )
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+                        side_effect=OSError("refused")), \
+             self.assertLogs("insalan.mailer", "ERROR"):
+            self.mailer.send_queued()
+
+        outbox_mail.refresh_from_db()
+        self.assertEqual(outbox_mail.status, OutboxMail.Status.FAILED)
+        self.assertEqual(self.mailer.pending_count(), 0)
+
+    def test_send_tournament_mails(self) -> None:
+        """Test that a mass mailing is queued in bulk with a single spooled attachment"""
+        attachment = ContentFile(b"%PDF", name="reglement.pdf")
+        recipients = [f"joueur{i}@insalan.fr" for i in range(10)]
+
+        with self.assertNumQueries(1):
+            count = self.mailer.send_tournament_mails(recipients, "Titre", "Contenu", attachment)
+
+        self.assertEqual(count, 10)
+        self.assertEqual(self.mailer.pending_count(), 10)
+        paths = {
+            outbox_mail.attachments[0]["path"] for outbox_mail in OutboxMail.objects.all()
+        }
+        self.assertEqual(len(paths), 1)
+
+
+class SMTPSinkTestCase(TestCase):
+    """Tests of the mail pipeline against the local SMTP sink"""
+
+    def setUp(self) -> None:
+        self.spool = tempfile.mkdtemp()
+        self.settings_override = override_settings(MAIL_SPOOL_ROOT=self.spool)
+        self.settings_override.enable()
+        self.sink = SMTPSink()
+        self.sink.start()
+
+    def tearDown(self) -> None:
+        self.sink.stop()
+        self.settings_override.disable()
+        shutil.rmtree(self.spool)
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+    def test_delivery_over_smtp(self) -> None:
+        """Test that queued mails reach the sink over a real SMTP connection"""
+        mailer = UserMailer("127.0.0.1", str(self.sink.port), "noreply@insalan.fr", "password",
+                            False)
+        mailer.send_tournament_mails(
+            ["a@example.net", "b@example.net"], "Titre", "Contenu",
+            ContentFile(b"%PDF", name="reglement.pdf"),
+        )
+
+        self.assertEqual(mailer.send_queued(), 2)
+        self.assertTrue(self.sink.wait_for(2, timeout=5))
+        self.assertCountEqual(
+            [message.recipients for message in self.sink.messages],
+            [["a@example.net"], ["b@example.net"]],
+        )
+        parsed = self.sink.messages[0].parse()
+        self.assertEqual(parsed["Subject"], settings.EMAIL_SUBJECT_PREFIX + "Titre")
+        attachments = [part.get_filename() for part in parsed.walk() if part.get_filename()]
+        self.assertEqual(attachments, ["reglement.pdf"])
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+    def test_send_queued_single_session(self) -> None:
+        """Test that a whole batch is sent in one SMTP session"""
+        mailer = UserMailer("127.0.0.1", str(self.sink.port), "noreply@insalan.fr", "password",
+                            False)
+        for i in range(5):
+            mailer.enqueue(EmailMessage(f"Mail {i}", "Contenu", "noreply@insalan.fr",
+                                        ["player@example.net"]))
+
+        self.assertEqual(mailer.send_queued(), 5)
+        self.assertTrue(self.sink.wait_for(5, timeout=5))
+        self.assertEqual(self.sink.sessions, 1)
+        self.assertEqual({message.session for message in self.sink.messages}, {1})
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+    def test_reconnect_after_error(self) -> None:
+        """Test that a new session is opened for the mails after a failed one"""
+        mailer = UserMailer("127.0.0.1", str(self.sink.port), "noreply@insalan.fr", "password",
+                            False)
+        for i in range(3):
+            mailer.enqueue(EmailMessage(f"Mail {i}", "Contenu", "noreply@insalan.fr",
+                                        ["player@example.net"]))
+
+        build_message = UserMailer.build_message
+
+        def failing_build_message(outbox_mail: OutboxMail) -> EmailMessage:
+            if outbox_mail.subject == "Mail 1":
+                raise OSError("boom")
+            return build_message(outbox_mail)
+
+        with mock.patch.object(UserMailer, "build_message", side_effect=failing_build_message):
+            self.assertEqual(mailer.send_queued(), 2)
+        self.assertTrue(self.sink.wait_for(2, timeout=5))
+        self.assertEqual([message.session for message in self.sink.messages], [1, 2])
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+    def test_benchmark(self) -> None:
+        """Test that the benchmark command delivers everything and rolls back"""
+        out = io.StringIO()
+        call_command("mail_benchmark", count=3, kinds="password,tournament", stdout=out)
+
+        self.assertIn("Delivered 6/6 mails", out.getvalue())
+        self.assertEqual(OutboxMail.objects.count(), 0)
+
+
+class SchedulerTestCase(TestCase):
+    """Tests of the periodic jobs and of the election of their leader"""
+
+    # Not the lock of a running backend
+    LOCK_ID = 4242
+
+    def setUp(self) -> None:
+        patcher = mock.patch.dict(scheduler.jobs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def election(self) -> scheduler.LeaderElection:
+        """A process taking part in the election, with its own scheduler"""
+        election = scheduler.LeaderElection(BackgroundScheduler(), self.LOCK_ID)
+        self.addCleanup(election.resign)
+        return election
+
+    @staticmethod
+    def job_ids(election: scheduler.LeaderElection) -> list[str]:
+        """Jobs scheduled in the process of an election"""
+        return sorted(job.id for job in election.scheduler.get_jobs())
+
+    def test_registry(self) -> None:
+        """Test that the periodic jobs of the apps are registered"""
+        self.assertLessEqual(
+            {"mail", "mail-spool", "notifications", "reconciliation", "ongoing-events",
+             "kitchen-documents"},
+            set(scheduler.jobs),
+        )
+
+    def test_start_in_tests(self) -> None:
+        """Test that the scheduler is not started by the tests"""
+        scheduler.start()
+        scheduler.start_election()
+        self.assertFalse(scheduler.scheduler.running)
+        self.assertIsNone(scheduler.election)
+
+    def test_metrics(self) -> None:
+        """Test that the runs and failures of a job are recorded"""
+        outcomes = [None, ValueError("boom"), None]
+        task = mock.Mock(side_effect=outcomes)
+        scheduler.register_job("test", task, 60)
+        # The connection of the test case holds its transaction
+        patcher = mock.patch.object(scheduler, "close_old_connections")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        scheduler.run_job("test")
+        metrics = JobMetrics.objects.get(name="test")
+        self.assertEqual((metrics.runs, metrics.failures), (1, 0))
+        self.assertIsNotNone(metrics.last_success_at)
+        self.assertEqual(metrics.total_duration, metrics.last_duration)
+
+        scheduler.run_job("test")
+        scheduler.run_job("test")
+        metrics.refresh_from_db()
+        self.assertEqual((metrics.runs, metrics.failures), (3, 1))
+        self.assertEqual(metrics.last_error, "ValueError('boom')")
+        self.assertGreaterEqual(metrics.total_duration, metrics.last_duration)
+        self.assertEqual(task.call_count, 3)
+
+    def test_single_leader(self) -> None:
+        """Test that only one process runs the periodic jobs, until it resigns"""
+        scheduler.register_job("test", mock.Mock(), 60)
+        first, second = self.election(), self.election()
+
+        self.assertTrue(first.elect())
+        self.assertFalse(second.elect())
+        self.assertTrue(first.elect())
+        self.assertIn("periodic:test", self.job_ids(first))
+        self.assertEqual(self.job_ids(second), [])
+
+        first.resign()
+        self.assertEqual(self.job_ids(first), [])
+        self.assertTrue(second.elect())
+        self.assertIn("periodic:test", self.job_ids(second))
+        self.assertFalse(first.elect())
+
+    def test_late_registration(self) -> None:
+        """Test that the leader schedules the jobs registered after its election"""
+        scheduler.register_job("test", mock.Mock(), 60)
+        election = self.election()
+        self.assertTrue(election.elect())
+        job = election.scheduler.get_job("periodic:test")
+
+        scheduler.register_job("later", mock.Mock(), 60)
+        self.assertTrue(election.elect())
+        self.assertIn("periodic:later", self.job_ids(election))
+        # The timers of the jobs already scheduled are kept
+        self.assertIs(election.scheduler.get_job("periodic:test"), job)
+
+    def test_lost_lock(self) -> None:
+        """Test that a leader whose connection is lost stops running the jobs"""
+        scheduler.register_job("test", mock.Mock(), 60)
+        first, second = self.election(), self.election()
+        self.assertTrue(first.elect())
+
+        assert first._connection is not None  # pylint: disable=protected-access
+        pid = first._connection.connection.get_backend_pid()  # pylint: disable=protected-access
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+        self.assertFalse(first.elect())
+        self.assertEqual(self.job_ids(first), [])
+        self.assertTrue(second.elect())
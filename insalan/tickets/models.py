@@ -8,18 +8,17 @@ from io import BytesIO
 from os import path
 from typing import TYPE_CHECKING
 
-import qrcode
 from django.db import models
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from PIL import Image
-from qrcode.image.pil import PilImage
 from reportlab.lib import utils
 from reportlab.pdfgen import canvas
 
 from insalan import settings
 from insalan.user.models import User
 from insalan.cms.models import Content
+from insalan.tickets.qrcode_cache import qrcode_cache
 
 if TYPE_CHECKING:
     from django.db.models import Combinable
@@ -109,12 +108,9 @@ class TicketManager(models.Manager[Ticket]):
         p.rect(0, 0, page_width, 0.117 * page_height, fill=True, stroke=False)
 
         # encode the url in a qr code
-        qr_buffer = BytesIO()
         url = settings.PROTOCOL + "://" + settings.WEBSITE_HOST + \
               reverse("tickets:get", args=[ticket.user.id, ticket.token])
-        qrcode_img: PilImage = qrcode.make(url)
-        qrcode_img.save(qr_buffer)
-        qr = utils.ImageReader(qr_buffer)
+        qr = utils.ImageReader(BytesIO(qrcode_cache.get(url, "png")))
         qr_size = 300/850 * page_height
         p.drawImage(qr, page_width/4, 0.117 * page_height, qr_size, qr_size)
 
@@ -0,0 +1,148 @@
+"""
+Content-addressed cache of the ticket QR codes.
+
+A QR code only depends on the URL it encodes, so rendered images are keyed by
+a hash of that URL. They are kept in a small in-memory LRU backed by a disk
+tier under `CACHE_ROOT`, which survives restarts and is shared by workers.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from os import path
+
+import qrcode
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from qrcode.image.pil import PilImage
+from qrcode.image.svg import SvgImage
+
+from insalan import settings
+
+logger = logging.getLogger(__name__)
+
+# A cached QR code never changes, clients may keep it for a year
+QRCODE_MAX_AGE = 365 * 24 * 60 * 60
+
+QRCODE_CONTENT_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+
+class QrCodeCache:
+    """
+    Two-tier (memory, then disk) cache of rendered QR codes
+    """
+
+    def __init__(self, directory: str, max_entries: int) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str, fmt: str) -> str:
+        """Content address of the QR code encoding `url` in the format `fmt`"""
+        return hashlib.sha256(f"{fmt}:{url}".encode()).hexdigest()
+
+    def get(self, url: str, fmt: str) -> bytes:
+        """
+        Return the QR code encoding `url` as `fmt` ("svg" or "png"),
+        rendering it only if no tier already holds it.
+        """
+        if fmt not in QRCODE_CONTENT_TYPES:
+            raise ValueError(f"Unknown QR code format: {fmt}")
+
+        key = self.key(url, fmt)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        data = self._load(key, fmt)
+        if data is None:
+            data = self.render(url, fmt)
+            self._dump(key, fmt, data)
+
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+    def clear(self) -> None:
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def render(url: str, fmt: str) -> bytes:
+        """Render the QR code without looking at the cache"""
+        buffer = BytesIO()
+        if fmt == "svg":
+            qrcode.make(
+                url,
+                image_factory=SvgImage,  # type: ignore[type-abstract]
+            ).save(buffer)
+        else:
+            image: PilImage = qrcode.make(url)
+            image.save(buffer)
+        return buffer.getvalue()
+
+    def _path(self, key: str, fmt: str) -> str:
+        return path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    def _load(self, key: str, fmt: str) -> bytes | None:
+        try:
+            with open(self._path(key, fmt), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+        except OSError as err:
+            logger.warning("Unable to read cached QR code %s: %s", key, err)
+            return None
+
+    def _dump(self, key: str, fmt: str, data: bytes) -> None:
+        # Write to a temporary file first so that concurrent readers never
+        # see a truncated image
+        file_path = self._path(key, fmt)
+        try:
+            os.makedirs(path.dirname(file_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.dirname(file_path))
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, file_path)
+        except OSError as err:
+            logger.warning("Unable to cache QR code %s on disk: %s", key, err)
+
+
+qrcode_cache = QrCodeCache(
+    path.join(settings.CACHE_ROOT, "qrcodes"), settings.QRCODE_CACHE_SIZE
+)
+
+
+def qrcode_response(request: HttpRequest, url: str, fmt: str = "svg") -> HttpResponse:
+    """
+    Build the response serving the QR code of `url`, with long-lived cache
+    headers. The ETag is the content address, so revalidation is answered
+    without rendering or reading anything.
+    """
+    etag = f'"{QrCodeCache.key(url, fmt)}"'
+    if request.headers.get("If-None-Match") == etag:
+        response: HttpResponse = HttpResponseNotModified()
+    else:
+        response = HttpResponse(
+            qrcode_cache.get(url, fmt), content_type=QRCODE_CONTENT_TYPES[fmt]
+        )
+    response["ETag"] = etag
+    # The QR code embeds the ticket token, shared caches must not keep it
+    patch_cache_control(response, private=True, max_age=QRCODE_MAX_AGE, immutable=True)
+    return response
@@ -14,7 +14,10 @@ The tests are organized into two classes:
 
 """
 from datetime import date
+import shutil
+import tempfile
 import uuid
+from unittest import mock
 
 from django.test import TestCase
 from django.urls import reverse
@@ -25,6 +28,7 @@ from rest_framework.test import APITestCase
 from insalan.tournament.models import Event, Game, EventTournament
 from insalan.user.models import User
 from .models import Ticket
+from .qrcode_cache import QrCodeCache, qrcode_cache
 
 def create_ticket(
     username: str,
@@ -109,6 +113,15 @@ class TicketTODO(APITestCase):
         """
         Create test environment for the API endpoint tests.
         """
+        # Keep the QR codes of the tests out of the real cache
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(qrcode_cache, "directory", directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        qrcode_cache.clear()
+        self.addCleanup(qrcode_cache.clear)
+
         User.objects.create_user(
             username="user", password="user", email="user@example.com"
         )
@@ -298,3 +311,69 @@ class TicketTODO(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertContains(response, "</svg>")
+
+    def test_qrcode_cache_headers(self) -> None:
+        """
+        Test that the QR code is served with long-lived cache headers and
+        revalidated through its ETag.
+        """
+        tourney = EventTournament.objects.all()[0]
+        create_ticket(
+            "user1", "00000000-0000-0000-0000-000000000001", tourney
+        )
+        self.login("user1")
+
+        url = reverse("tickets:qrcode", args=["00000000-0000-0000-0000-000000000001"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertIn("private", response["Cache-Control"])
+        self.assertIn("immutable", response["Cache-Control"])
+
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+
+class QrCodeCacheTestCase(TestCase):
+    """
+    Tests of the QR code cache
+    """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.cache = QrCodeCache(self.directory, 2)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_render_once(self) -> None:
+        """Test that a QR code is only rendered on a cache miss"""
+        with mock.patch.object(
+            QrCodeCache, "render", wraps=QrCodeCache.render
+        ) as render:
+            svg = self.cache.get("https://insalan.fr/a", "svg")
+            self.assertEqual(self.cache.get("https://insalan.fr/a", "svg"), svg)
+            self.assertEqual(render.call_count, 1)
+
+            # The disk tier answers once the memory tier forgot the entry
+            self.cache.clear()
+            self.assertEqual(self.cache.get("https://insalan.fr/a", "svg"), svg)
+            self.assertEqual(render.call_count, 1)
+
+            self.cache.get("https://insalan.fr/a", "png")
+            self.assertEqual(render.call_count, 2)
+
+    def test_lru_eviction(self) -> None:
+        """Test that the memory tier is bounded"""
+        for i in range(5):
+            self.cache.get(f"https://insalan.fr/{i}", "png")
+        # pylint: disable-next=protected-access
+        self.assertEqual(len(self.cache._entries), 2)
+        self.assertTrue(self.cache.get("https://insalan.fr/0", "png").startswith(b"\x89PNG"))
+
+    def test_unknown_format(self) -> None:
+        """Test that only svg and png are supported"""
+        with self.assertRaises(ValueError):
+            self.cache.get("https://insalan.fr/", "gif")
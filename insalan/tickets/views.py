@@ -4,16 +4,12 @@ This module contains Django views for ticket-related operations.
 It includes views for retrieving ticket details, scanning tickets, and
 generating QR codes for tickets.
 """
-import io
 import uuid
 
 from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
 
-from qrcode import make
-from qrcode.image.svg import SvgImage
-
 from drf_yasg import openapi  # type: ignore[import]
 from drf_yasg.utils import swagger_auto_schema  # type: ignore[import]
 
@@ -27,6 +23,7 @@ from insalan.user.models import User
 from insalan.mailer import MailManager
 from insalan.settings import EMAIL_AUTH
 from .models import Ticket, TicketManager
+from .qrcode_cache import qrcode_response
 
 # The decorator is missing types stubs.
 @swagger_auto_schema(  # type: ignore[misc]
@@ -246,14 +243,7 @@ def qrcode(request: HttpRequest, token: str) -> HttpResponse:
     url = request.build_absolute_uri(
         reverse("tickets:get", args=[request.user.id, token])
     )
-    ticket_qrcode = make(
-        url,
-        image_factory=SvgImage,  # type: ignore[type-abstract]
-    )
-    buffer = io.BytesIO()
-    ticket_qrcode.save(buffer)
-
-    return HttpResponse(buffer.getvalue().decode(), content_type="image/svg+xml")
+    return qrcode_response(request, url)
 
 # The decorator is missing types stubs.
 @swagger_auto_schema(  # type: ignore[misc]
@@ -1,6 +1,7 @@
 """Admin handlers for the tournament module"""
 
 import json
+from collections.abc import Iterator
 from typing import Any, cast, Type, TypeVar
 
 from django import forms
@@ -19,7 +20,13 @@ from django.contrib.auth.hashers import make_password
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.forms.models import ModelForm, ModelChoiceField
 from django.forms.renderers import BaseRenderer
-from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+)
 from django.template.response import TemplateResponse
 from django.urls import path, resolve, reverse, URLPattern
 from django.utils.decorators import method_decorator
@@ -27,16 +34,20 @@ from django.utils.html import escape
 from django.utils.safestring import SafeString
 from django.utils.translation import gettext as _
 from django.views.decorators.debug import sensitive_post_parameters
-from django.db.models import Q
+from django.db.models import Count, Q
 from unfold.admin import ModelAdmin # type: ignore
 
 from insalan.admin import ADMIN_ORDERING
+from insalan.csv_export import EXPORT_CHUNK_SIZE, stream_csv
 from insalan.mailer import MailManager
 from insalan.tournament.manage import (
+    allocate_seats,
     create_empty_knockout_matchs,
     create_group_matchs,
     create_swiss_matchs,
+    invalidate_seat_maps,
     launch_match,
+    schedule_names_refresh,
 )
 from insalan.utils import FieldOpts, FieldSets
 
@@ -68,6 +79,7 @@ from .models import (
     EventTournament,
     TournamentMailer,
 )
+from .models.name_validator import ValidatorUnavailable
 
 
 sensitive_post_parameters_m = method_decorator(sensitive_post_parameters())
@@ -134,11 +146,11 @@ class EventForm(ModelForm[Event]):  # pylint: disable=unsubscriptable-object
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
 
-        seats = Seat.objects.filter(event=self.instance)
+        seats = Seat.objects.filter(event=self.instance).values_list("x", "y")
         data = {
             "cellSize": 25,
             "pickedColor": "brown",  # css colors
-            "oldSeats": [(seat.x, seat.y) for seat in seats]
+            "oldSeats": list(seats)
         }
         self.fields["canvas_params"].initial = data
 
@@ -155,19 +167,25 @@ class EventForm(ModelForm[Event]):  # pylint: disable=unsubscriptable-object
         seats = self.cleaned_data.get("seats")
 
         if seats is not None:
-            old_seats = Seat.objects.filter(event=instance)
-            to_delete = [seat for seat in old_seats if [seat.x, seat.y] not in seats]
-            to_create = [
-                (x, y)
-                for (x, y) in seats
-                if (x, y) not in [(seat.x, seat.y) for seat in old_seats]
+            # Diff the coordinates, so that a hall of a thousand seats is
+            # saved with a few queries
+            new_seats = {tuple(seat) for seat in seats}
+            old_seats = {
+                (x, y): seat_id
+                for seat_id, x, y in Seat.objects.filter(event=instance).values_list(
+                    "id", "x", "y"
+                )
+            }
+            to_delete = [
+                seat_id for coords, seat_id in old_seats.items() if coords not in new_seats
             ]
-
-            for seat in to_delete:
-                seat.delete()
-            for (x, y) in to_create:
-                seat = Seat.objects.create(event=instance, x=x, y=y)
-                seat.save()
+            if to_delete:
+                Seat.objects.filter(id__in=to_delete).delete()
+            Seat.objects.bulk_create(
+                Seat(event=instance, x=x, y=y) for x, y in sorted(new_seats - old_seats.keys())
+            )
+            # The bulk queries send no signal
+            invalidate_seat_maps()
 
         return instance
 
@@ -187,6 +205,13 @@ class EventAdmin(ModelAdmin):  # type: ignore
     list_display = ("id", "name", "description", "date_start", "date_end", "ongoing")
     search_fields = ["name", "date_start", "date_end", "ongoing"]
 
+    actions = ['update_name']
+
+    @admin.action(description=_("Mettre à jour les pseudos"))
+    def update_name(self, request: HttpRequest, queryset: QuerySet[Event]) -> None:
+        schedule_names_refresh(EventTournament.objects.filter(event__in=queryset))
+        self.message_user(request, _("La mise à jour des pseudos a été lancée."))
+
     class Media:
         css = {
             'all': ('css/seat_canvas.css',)
@@ -302,17 +327,16 @@ class EventTournamentForm(ModelForm[EventTournament]):  # pylint: disable=unsubs
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
 
-        seats = Seat.objects.filter(event=self.instance.event)
-        seat_slots = SeatSlot.objects.filter(tournament=self.instance)
-
+        seats = Seat.objects.filter(event=self.instance.event).values_list("x", "y")
+        seat_slots = SeatSlot.objects.filter(tournament=self.instance).prefetch_related("seats")
         other_tournament_slots = SeatSlot.objects.exclude(tournament=self.instance).filter(
             tournament__event=self.instance.event,
-        )
+        ).prefetch_related("seats")
 
         data = {
             "cellSize": 25,
             "pickedColor": "lightgray",  # css colors
-            "eventSeats": [(seat.x, seat.y) for seat in seats],
+            "eventSeats": list(seats),
             "unavailableSeats": [(seat.x, seat.y)
                                  for slot in other_tournament_slots for seat in slot.seats.all()],
             "seatsPerSlot": self.instance.game.players_per_team,  # for client side validation
@@ -348,37 +372,67 @@ class EventTournamentForm(ModelForm[EventTournament]):  # pylint: disable=unsubs
 
             # Ensure that every used seat is used only once
             other_tournament_slots = SeatSlot.objects.exclude(tournament=self.instance)
-            unavailable_seats = set((seat.x, seat.y)
-                                    for slot in other_tournament_slots for seat in slot.seats.all())
+            unavailable_seats = set(
+                Seat.objects.filter(seatslot__in=other_tournament_slots).values_list("x", "y")
+            )
             all_seats = set(tuple(seat) for seats in seat_slots.values() for seat in seats)
             if unavailable_seats.intersection(all_seats):
                 raise ValidationError(
                 _("Les places ne peuvent pas être partagés entre plusieurs slots")
                 )
 
+            # Map the coordinates to the seats of the event once
+            seat_ids = {
+                (x, y): seat_id
+                for seat_id, x, y in Seat.objects.filter(event=self.instance.event).values_list(
+                    "id", "x", "y"
+                )
+            }
+            if not all_seats <= seat_ids.keys():
+                raise ValidationError(
+                _("Les places doivent appartenir à l'évènement du tournoi")
+                )
+            new_slots = {
+                slot_id: {seat_ids[(x, y)] for x, y in seats}
+                for slot_id, seats in seat_slots.items()
+            }
+
             # modification
-            old_slots = SeatSlot.objects.filter(tournament=self.instance)
-            to_delete = old_slots.exclude(id__in=[int(ss_id) for ss_id in seat_slots])
-            to_create = [seats
-                         for slot, seats in seat_slots.items()
-                         if int(slot) not in [slot.id for slot in old_slots]]
-
-            # check remaining slots for modification
-            remaining_slots = old_slots.difference(to_delete)
-
-            for slot in to_delete:
-                slot.delete()
-            for seat_coords in to_create:
-                slot = SeatSlot.objects.create(tournament=self.instance)
-                seats = [Seat.objects.get(event=self.instance.event, x=x, y=y)
-                         for x, y in seat_coords]
-                slot.seats.set(seats)
-                slot.save()
-            for slot in remaining_slots:
-                seats = [Seat.objects.get(event=self.instance.event, x=x, y=y)
-                         for x, y in seat_slots[str(slot.id)]]
-                slot.seats.set(seats)
-                slot.save()
+            through = SeatSlot.seats.through
+            old_slots: dict[str, set[int]] = {
+                str(slot_id): set()
+                for slot_id in SeatSlot.objects.filter(tournament=self.instance).values_list(
+                    "id", flat=True
+                )
+            }
+            for slot_id, seat_id in through.objects.filter(
+                seatslot__tournament=self.instance
+            ).values_list("seatslot_id", "seat_id"):
+                old_slots[str(slot_id)].add(seat_id)
+
+            to_delete = old_slots.keys() - new_slots.keys()
+            if to_delete:
+                SeatSlot.objects.filter(id__in=to_delete).delete()
+
+            # Slots whose seats changed are filled again along with the new ones
+            modified = [
+                slot_id for slot_id, seats in old_slots.items()
+                if slot_id in new_slots and new_slots[slot_id] != seats
+            ]
+            if modified:
+                through.objects.filter(seatslot_id__in=modified).delete()
+            added = sorted(new_slots.keys() - old_slots.keys())
+            created = SeatSlot.objects.bulk_create(
+                SeatSlot(tournament=self.instance) for key in added
+            )
+            filled = [int(slot_id) for slot_id in modified]
+            filled += [slot.id for slot in created]
+            through.objects.bulk_create(
+                through(seatslot_id=slot_id, seat_id=seat_id)
+                for slot_id, key in zip(filled, modified + added)
+                for seat_id in new_slots[key]
+            )
+            invalidate_seat_maps()
 
         return self.cleaned_data
 
@@ -395,11 +449,12 @@ class EventTournamentAdmin(ModelAdmin[EventTournament]): # type: ignore
     """Admin handler for Tournaments"""
 
     list_display = ("id", "name", "event", "game", "is_announced", "cashprizes", "get_occupancy")
+    list_select_related = ("event", "game")
     search_fields = ["name", "event__name", "game__name"]
 
     list_filter = (EventTournamentFilter, GameTournamentFilter)
 
-    actions = ['update_name', 'expand_threshold']
+    actions = ['update_name', 'expand_threshold', 'allocate_seats_action']
 
     def get_form(
         self,
@@ -413,14 +468,17 @@ class EventTournamentAdmin(ModelAdmin[EventTournament]): # type: ignore
             kwargs["form"] = EventTournamentForm
         return super().get_form(request, obj, change, **kwargs) # type: ignore
 
+    def get_queryset(self, request: HttpRequest) -> QuerySet[EventTournament]:
+        """Count the validated teams of every tournament of the page at once"""
+        return super().get_queryset(request).annotate(  # type: ignore[no-any-return]
+            validated_teams=Count("teams", filter=Q(teams__validated=True))
+        )
+
     def get_occupancy(self, obj: EventTournament) -> str:
         """
         Returns the occupancy of the tournament
         """
-        return str(Team.objects.filter(
-            tournament=obj,
-            validated=True,
-        ).count()) + " / " + str(obj.get_max_team())
+        return f"{obj.validated_teams} / {obj.get_max_team()}"
 
     get_occupancy.short_description = 'Remplissage'  # type: ignore[attr-defined]
 
@@ -428,9 +486,8 @@ class EventTournamentAdmin(ModelAdmin[EventTournament]): # type: ignore
     def update_name(
         self, request: HttpRequest, queryset: QuerySet[EventTournament]
     ) -> None:
-        for tournament in queryset:
-            tournament.update_name_in_game()
-        self.message_user(request,_("Les pseudo ont été mis à jour."))
+        schedule_names_refresh(queryset)
+        self.message_user(request, _("La mise à jour des pseudos a été lancée."))
 
     @admin.action(description=_("Augmenter le seuil d'équipes"))
     def expand_threshold(
@@ -440,6 +497,27 @@ class EventTournamentAdmin(ModelAdmin[EventTournament]): # type: ignore
             tournament.try_expand_threshold()
         self.message_user(request,_("Le seuil a été mis à jour."))
 
+    @admin.action(description=_("Placer les équipes validées"))
+    def allocate_seats_action(
+        self, request: HttpRequest, queryset: QuerySet[EventTournament]
+    ) -> None:
+        placed = unplaced = 0
+        for tournament in queryset.select_related("game"):
+            result = allocate_seats(tournament)
+            placed += result.placed
+            unplaced += result.unplaced
+        if unplaced:
+            self.message_user(
+                request,
+                _("%(placed)d équipes placées, %(unplaced)d sans place faute de places libres.")
+                % {"placed": placed, "unplaced": unplaced},
+                messages.WARNING,
+            )
+        else:
+            self.message_user(
+                request, _("%(placed)d équipes placées.") % {"placed": placed}
+            )
+
     class Media:
         css = {
             'all': ('css/seat_canvas.css',)
@@ -458,26 +536,29 @@ class PrivateTournamentAdmin(ModelAdmin[PrivateTournament]): # type: ignore
     Admin handler for PrivateTournament
     """
     list_display = ("id", "name", "game", "get_occupancy")
+    list_select_related = ("game",)
     search_fields = ["name", "game__name"]
 
     actions = ['update_name']
 
+    def get_queryset(self, request: HttpRequest) -> QuerySet[PrivateTournament]:
+        """Count the validated teams of every tournament of the page at once"""
+        return super().get_queryset(request).annotate(  # type: ignore[no-any-return]
+            validated_teams=Count("teams", filter=Q(teams__validated=True))
+        )
+
     def get_occupancy(self, obj: PrivateTournament) -> str:
         """
         Returns the occupancy of the tournament
         """
-        return str(Team.objects.filter(
-            tournament=obj,
-            validated=True,
-        ).count()) + " / " + str(obj.get_max_team())
+        return f"{obj.validated_teams} / {obj.get_max_team()}"
 
     @admin.action(description=_("Mettre à jour les pseudos"))
     def update_name(
         self, request: HttpRequest, queryset: QuerySet[EventTournament]
     ) -> None:
-        for tournament in queryset:
-            tournament.update_name_in_game()
-        self.message_user(request,_("Les pseudo ont été mis à jour."))
+        schedule_names_refresh(queryset)
+        self.message_user(request, _("La mise à jour des pseudos a été lancée."))
 
     get_occupancy.short_description = 'Remplissage'  # type: ignore[attr-defined]
 
@@ -662,7 +743,9 @@ class ValidatedFilter(admin.SimpleListFilter):
 class TeamAdmin(ModelAdmin):  # type: ignore
     """Admin handler for Team"""
 
-    list_display = ("id", "name", "tournament", "validated", "get_quota")
+    list_display = ("id", "name", "get_tournament", "validated", "get_quota")
+    # The event tournaments are selected too, to be displayed with their event
+    list_select_related = ("tournament__game", "tournament__eventtournament__event")
     search_fields = ["name", "tournament__name"]
     add_fieldsets: FieldSets = (
         (
@@ -679,11 +762,21 @@ class TeamAdmin(ModelAdmin):  # type: ignore
 
     list_filter = (TeamTournamentFilter, ValidatedFilter)
 
+    def get_queryset(self, request: HttpRequest) -> QuerySet[Team]:
+        """Count the players of every team of the page at once"""
+        return super().get_queryset(request).annotate(  # type: ignore[no-any-return]
+            player_count=Count("player")
+        )
+
+    @admin.display(description=_("Tournoi"), ordering="tournament")
+    def get_tournament(self, obj: Team) -> str:
+        """Returns the tournament of the team."""
+        return str(obj.tournament.get_selected_instance())
+
     def get_quota(self, obj: Team) -> str:
         """Returns the quota of the team."""
-        return str(Player.objects.filter(team=obj).count()) + " / " + str(
-            obj.tournament.game.players_per_team,
-        )
+        player_count = obj.player_count  # type: ignore[attr-defined]
+        return f"{player_count} / {obj.tournament.game.players_per_team}"
 
     get_quota.short_description = 'Nombre de Joueurs'  # type: ignore[attr-defined]
 
@@ -857,6 +950,57 @@ class PaymentStatusFilter(admin.SimpleListFilter):
             return queryset.filter(payment_status=self.value())
         return queryset
 
+@admin.action(description=_("Exporter les inscriptions sélectionnées"))
+def export_registrations(
+    # pylint: disable-next=unsubscriptable-object
+    modeladmin: ModelAdmin[ManagerOrPlayerOrSubstitute],
+    request: HttpRequest,
+    queryset: QuerySet[ManagerOrPlayerOrSubstitute],
+) -> FileResponse:
+    """
+    Export the selected players, managers or substitutes to a CSV file
+    """
+    registrations = (
+        queryset.select_related(
+            "user",
+            "team__tournament__eventtournament__event",
+            "team__tournament__privatetournament",
+        )
+        .order_by("id")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    statuses = dict(PaymentStatus.choices)
+
+    def rows() -> Iterator[list[Any]]:
+        for registration in registrations:
+            trnm = registration.team.tournament.get_selected_instance()
+            yield [
+                registration.id,
+                registration.user.username,
+                registration.user.email,
+                # Managers have no name in game
+                getattr(registration, "name_in_game", ""),
+                registration.team.name,
+                trnm.name,
+                trnm.event.name if isinstance(trnm, EventTournament) else "",
+                statuses.get(registration.payment_status, registration.payment_status),
+            ]
+
+    return stream_csv(
+        f"{modeladmin.opts.model_name}s.csv",
+        [
+            "id",
+            "utilisateur",
+            "courriel",
+            "pseudo en jeu",
+            "équipe",
+            "tournoi",
+            "évènement",
+            "statut de paiement",
+        ],
+        rows(),
+    )
+
 class ButtonWidget(forms.Widget):
     """Custom widget for the update name in game button."""
     template_name = ""
@@ -898,6 +1042,7 @@ class PlayerAdmin(ModelAdmin):  # type: ignore
     """Admin handler for Player Registrations"""
 
     list_display = ("id", "user", "name_in_game", "team", "payment_status", "get_tournament")
+    list_select_related = ("user", "team__tournament__eventtournament__event")
     search_fields = ["user__username", "team__name", "name_in_game"]
     readonly_fields = ("validator_data",)
     add_fieldsets: tuple[tuple[str | None, FieldOpts]] = (
@@ -905,6 +1050,7 @@ class PlayerAdmin(ModelAdmin):  # type: ignore
     )
 
     list_filter = (EventFilter, OngoingTournamentFilter, PaymentStatusFilter)
+    actions = [export_registrations]
 
     # use our custom form
     form = PlayerForm
@@ -953,10 +1099,17 @@ class PlayerAdmin(ModelAdmin):  # type: ignore
             )
 
         # perform the update
-        player.update_name_in_game()
-
-        msg = _("The name in game was successfully updated to ") + player.name_in_game + "."
-        messages.success(request, msg)
+        try:
+            player.update_name_in_game()
+        except ValidatorUnavailable:
+            messages.error(
+                request,
+                _("La validation des pseudos est temporairement indisponible, "
+                  "veuillez réessayer dans quelques instants"),
+            )
+        else:
+            msg = _("The name in game was successfully updated to ") + player.name_in_game + "."
+            messages.success(request, msg)
 
         return HttpResponseRedirect(
             reverse(
@@ -972,9 +1125,11 @@ class ManagerAdmin(ModelAdmin):  # type: ignore
     """Admin handler for Manager Registrations"""
 
     list_display = ("id", "user", "team", "payment_status", "get_tournament")
+    list_select_related = ("user", "team__tournament__eventtournament__event")
     search_fields = ["user__username", "team__name"]
 
     list_filter = (EventFilter, OngoingTournamentFilter, PaymentStatusFilter)
+    actions = [export_registrations]
 
     def get_tournament(self, obj: Manager) -> str:
         """Returns the tournament name of the manager."""
@@ -990,6 +1145,7 @@ class CasterAdmin(ModelAdmin):  # type: ignore
     """Admin handler for tournament Casters"""
 
     list_display = ("id", "name", "tournament")
+    list_select_related = ("tournament__event",)
     search_fields = ["name", "tournament__name"]
 
 
@@ -1012,6 +1168,7 @@ class SubstituteAdmin(ModelAdmin):  # type: ignore
     """Admin handler for Substitute Registrations"""
 
     list_display = ("id", "user", "name_in_game", "team", "payment_status", "get_tournament")
+    list_select_related = ("user", "team__tournament__eventtournament__event")
     search_fields = ["user__username", "team__name", "name_in_game"]
     readonly_fields = ("validator_data",)
     add_fieldsets: tuple[tuple[str | None, FieldOpts]] = (
@@ -1019,6 +1176,7 @@ class SubstituteAdmin(ModelAdmin):  # type: ignore
     )
 
     list_filter = (EventFilter, OngoingTournamentFilter, PaymentStatusFilter)
+    actions = [export_registrations]
 
     # use our custom form
     form = SubstituteForm
@@ -1067,10 +1225,17 @@ class SubstituteAdmin(ModelAdmin):  # type: ignore
             )
 
         # perform the update
-        substitute.update_name_in_game()
-
-        msg = _("The name in game was successfully updated to ") + substitute.name_in_game + "."
-        messages.success(request, msg)
+        try:
+            substitute.update_name_in_game()
+        except ValidatorUnavailable:
+            messages.error(
+                request,
+                _("La validation des pseudos est temporairement indisponible, "
+                  "veuillez réessayer dans quelques instants"),
+            )
+        else:
+            msg = _("The name in game was successfully updated to ") + substitute.name_in_game + "."
+            messages.success(request, msg)
 
         app_label = substitute._meta.app_label
         model_name = substitute._meta.model_name
@@ -1367,6 +1532,9 @@ class GroupMatchAdmin(ModelAdmin):  # type: ignore
 admin.site.register(GroupMatch, GroupMatchAdmin)
 
 
+MAILER_PREVIEW_KEY = "tournament_mailer_preview"
+
+
 class MailerAdmin(ModelAdmin):  # type: ignore
     """
     Admin handler for TournamentMailer
@@ -1394,6 +1562,12 @@ class MailerAdmin(ModelAdmin):  # type: ignore
             'title': _('Envoyer un mail'),
     })
 
+    def get_changeform_initial_data(self, request: HttpRequest) -> dict[str, Any]:
+        initial: dict[str, Any] = super().get_changeform_initial_data(request)
+        # fill the form back after a dry run
+        initial.update(request.session.pop(MAILER_PREVIEW_KEY, {}))
+        return initial
+
     # replace the list url with the add one
     def get_urls(self) -> list[URLPattern]:
         custom_urls = [
@@ -1412,7 +1586,7 @@ class MailerAdmin(ModelAdmin):  # type: ignore
         for mailer in MailManager.mailers.values():
             mailer_obj = TournamentMailer.objects.create(
                 mail=mailer.mail_from,
-                number=len(mailer.queue)
+                number=mailer.pending_count()
             )
             mailer_obj.save()
 
@@ -1422,10 +1596,27 @@ class MailerAdmin(ModelAdmin):  # type: ignore
     def response_add(
         self,
         request: HttpRequest,
-        _obj: TournamentMailer,
+        obj: TournamentMailer,
         post_url_continue: str | None = None,  # pylint: disable=unused-argument
     ) -> HttpResponse:
-        messages.info(request, _("Le mail est en cours d'envoi"))
+        if obj.dry_run:
+            messages.info(
+                request,
+                _("%d destinataire(s) recevrai(en)t ce mail, il n'a pas été envoyé")
+                % obj.recipient_count
+            )
+            # keep what was entered so that the preview can be sent as is
+            request.session[MAILER_PREVIEW_KEY] = {
+                'tournament': obj.tournament_id,
+                'team_validated': obj.team_validated,
+                'captains': obj.captains,
+                'title': obj.title,
+                'content': obj.content,
+            }
+            return HttpResponseRedirect(reverse('admin:tournament_tournamentmailer_add'))
+        messages.info(
+            request, _("Le mail est en cours d'envoi à %d destinataire(s)") % obj.recipient_count
+        )
         return HttpResponseRedirect(reverse('admin:tournament_tournamentmailer_changelist'))
 
 
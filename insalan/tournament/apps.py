@@ -3,9 +3,10 @@
 import logging
 from datetime import timedelta
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from insalan.scheduler import scheduler
+from insalan.scheduler import register_job
 
 logger = logging.getLogger(__name__)
 
@@ -33,4 +34,27 @@ class TournamentConfig(AppConfig):
 
         payment_handler_register()
 
-        scheduler.add_job(check_ongoing_events, 'interval', days=1)
+        # pylint: disable-next=import-outside-toplevel
+        from .manage.seat_map import invalidate_seat_maps
+        # pylint: disable-next=import-outside-toplevel
+        from .models import SeatSlot
+
+        for model_name in ("Seat", "SeatSlot", "Team"):
+            model = self.get_model(model_name)
+            post_save.connect(
+                invalidate_seat_maps,
+                sender=model,
+                dispatch_uid=f"seat-map-save-{model_name}",
+            )
+            post_delete.connect(
+                invalidate_seat_maps,
+                sender=model,
+                dispatch_uid=f"seat-map-delete-{model_name}",
+            )
+        m2m_changed.connect(
+            invalidate_seat_maps,
+            sender=SeatSlot.seats.through,
+            dispatch_uid="seat-map-slot-seats",
+        )
+
+        register_job("ongoing-events", check_ongoing_events, timedelta(days=1).total_seconds())
@@ -2,3 +2,6 @@ from .group import *
 from .bracket import *
 from .swiss import *
 from .match import *
+from .names import *
+from .seat_map import *
+from .seating import *
@@ -0,0 +1,134 @@
+import logging
+import sys
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from django.db import close_old_connections
+
+from insalan.scheduler import scheduler
+
+from ..models import BaseTournament, Player, Substitute
+from ..models.name_validator import EmptyNameValidator, get_validator
+
+logger = logging.getLogger(__name__)
+
+# Names looked up between two progress reports
+NAME_REFRESH_CHUNK = 50
+
+
+@dataclass
+class NameRefresh:
+    """Outcome of a refresh of the names in game"""
+    checked: int = 0
+    renamed: int = 0
+    # Names that could not be looked up, even once retried
+    skipped: int = 0
+
+
+def refresh_names_in_game(
+    tournament_ids: Iterable[int],
+    progress: Callable[[int, int], None] | None = None,
+) -> NameRefresh:
+    """
+    Refresh the name_in_game of every player and substitute of the tournaments
+
+    The names are looked up concurrently, within the rate limits of the APIs,
+    and the changed ones are saved with one query per model. The names that
+    could not be looked up are tried once more after the others, then counted
+    as skipped. `progress` is called with the number of names looked up so
+    far and the total.
+    """
+    tournament_ids = list(tournament_ids)
+    everyone: list[Player | Substitute] = [
+        *Player.objects.filter(team__tournament__in=tournament_ids)
+        .select_related("team__tournament__game"),
+        *Substitute.objects.filter(team__tournament__in=tournament_ids)
+        .select_related("team__tournament__game"),
+    ]
+
+    result = NameRefresh()
+    total = len(everyone)
+    renamed: list[Player | Substitute] = []
+    skipped = _look_up(everyone, renamed, result, total, progress)
+    if skipped:
+        # By now, the rate limits had time to let more requests through
+        logger.info("Retrying %d names in game that could not be looked up", len(skipped))
+        result.checked -= len(skipped)
+        skipped = _look_up(skipped, renamed, result, total, progress)
+    result.checked -= len(skipped)
+    result.skipped = len(skipped)
+    if skipped:
+        logger.warning("Unable to look up %d names in game", len(skipped))
+
+    renamed_players = [member for member in renamed if isinstance(member, Player)]
+    if renamed_players:
+        Player.objects.bulk_update(renamed_players, ["name_in_game"])
+    renamed_substitutes = [member for member in renamed if isinstance(member, Substitute)]
+    if renamed_substitutes:
+        Substitute.objects.bulk_update(renamed_substitutes, ["name_in_game"])
+    result.renamed = len(renamed)
+    return result
+
+
+def _look_up(
+    everyone: list[Player | Substitute],
+    renamed: list[Player | Substitute],
+    result: NameRefresh,
+    total: int,
+    progress: Callable[[int, int], None] | None,
+) -> list[Player | Substitute]:
+    """Look up the names of players, and return the ones that were skipped"""
+    members: defaultdict[str, list[Player | Substitute]] = defaultdict(list)
+    for member in everyone:
+        members[member.team.tournament.game.validators].append(member)
+
+    skipped: list[Player | Substitute] = []
+    for short, group in members.items():
+        validator = get_validator(short)
+        if validator is None or validator is EmptyNameValidator:
+            # Nothing to look up
+            result.checked += len(group)
+            if progress is not None:
+                progress(result.checked, total)
+            continue
+        for start in range(0, len(group), NAME_REFRESH_CHUNK):
+            chunk = group[start:start + NAME_REFRESH_CHUNK]
+            names = validator.update_names(
+                (member.name_in_game, member.validator_data) for member in chunk
+            )
+            for member, name in zip(chunk, names):
+                if name is None:
+                    skipped.append(member)
+                elif name != member.name_in_game:
+                    member.name_in_game = name
+                    renamed.append(member)
+            result.checked += len(chunk)
+            if progress is not None:
+                progress(result.checked, total)
+    return skipped
+
+
+def _refresh_in_background(tournament_ids: list[int]) -> None:
+    """Refresh the names from a thread of the scheduler"""
+    def log_progress(done: int, total: int) -> None:
+        logger.info("Refreshed %d/%d names in game", done, total)
+
+    try:
+        result = refresh_names_in_game(tournament_ids, log_progress)
+        logger.info(
+            "Renamed %d of %d players, %d skipped",
+            result.renamed, result.checked, result.skipped,
+        )
+    finally:
+        close_old_connections()
+
+
+def schedule_names_refresh(tournaments: Iterable[BaseTournament]) -> None:
+    """Refresh the names in game of tournaments, in the background"""
+    tournament_ids = [tournament.id for tournament in tournaments]
+    if "test" in sys.argv:
+        # Tests expect the names to be refreshed when the action returns
+        refresh_names_in_game(tournament_ids)
+        return
+    scheduler.add_job(_refresh_in_background, args=[tournament_ids])
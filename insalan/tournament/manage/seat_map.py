@@ -0,0 +1,124 @@
+"""
+Compact encoding of the seat map of an event
+
+The hall is sent as the bounds of its grid and a bitmap of the cells which
+are seats, instead of one object per seat. Seats are numbered in the order of
+the bitmap (row by row, from the top left corner), and every slot is given as
+ranges of those numbers.
+
+The encoded map and its ETag are kept for SEAT_MAP_CACHE_TTL seconds, and
+forgotten as soon as a seat, a slot or a team is modified in this process.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from itertools import groupby
+from typing import Any
+
+from insalan import settings as app_settings
+
+from ..models import Seat, SeatSlot
+
+# Encoded seat maps with their ETag and expiry, per event
+_seat_maps: dict[int, tuple[float, dict[str, Any], str]] = {}
+# Incremented on every invalidation, so that a map encoded meanwhile is not kept
+_generation: int = 0
+_lock = threading.Lock()
+
+
+def seat_ranges(indices: list[int]) -> list[list[int]]:
+    """
+    Group sorted seat numbers into [first, last + 1) ranges of consecutive
+    numbers
+    """
+    ranges: list[list[int]] = []
+    for _, run in groupby(enumerate(indices), key=lambda item: item[1] - item[0]):
+        numbers = [index for _, index in run]
+        ranges.append([numbers[0], numbers[-1] + 1])
+    return ranges
+
+
+def encode_seat_map(event_id: int) -> dict[str, Any]:
+    """Build the compact seat map of an event"""
+    seats = sorted(
+        Seat.objects.filter(event=event_id).values_list("id", "x", "y"),
+        key=lambda seat: (seat[2], seat[1]),
+    )
+    if not seats:
+        return {"x": 0, "y": 0, "width": 0, "height": 0, "seats": "", "slots": []}
+
+    min_x = min(x for _, x, _ in seats)
+    min_y = seats[0][2]
+    width = max(x for _, x, _ in seats) - min_x + 1
+    height = seats[-1][2] - min_y + 1
+
+    # One bit per cell of the grid, the first cell being the most
+    # significant bit of the first byte
+    bitmap = bytearray((width * height + 7) // 8)
+    numbers: dict[int, int] = {}
+    for number, (seat_id, x, y) in enumerate(seats):
+        cell = (y - min_y) * width + x - min_x
+        bitmap[cell // 8] |= 0x80 >> (cell % 8)
+        numbers[seat_id] = number
+
+    slot_seats: dict[int, list[int]] = {}
+    for slot_id, seat_id in SeatSlot.seats.through.objects.filter(
+        seatslot__tournament__event=event_id
+    ).values_list("seatslot_id", "seat_id"):
+        # Seats of another event are not part of the map
+        if seat_id in numbers:
+            slot_seats.setdefault(slot_id, []).append(numbers[seat_id])
+
+    slots = [
+        {
+            "id": slot_id,
+            "tournament": tournament_id,
+            "team": team_id,
+            "seats": seat_ranges(sorted(slot_seats.get(slot_id, []))),
+        }
+        for slot_id, tournament_id, team_id in SeatSlot.objects.filter(
+            tournament__event=event_id
+        ).order_by("id").values_list("id", "tournament_id", "team")
+    ]
+
+    return {
+        "x": min_x,
+        "y": min_y,
+        "width": width,
+        "height": height,
+        "seats": base64.b64encode(bytes(bitmap)).decode(),
+        "slots": slots,
+    }
+
+
+def seat_map_etag(seat_map: dict[str, Any]) -> str:
+    """ETag of a seat map, which changes with any seat, slot or team"""
+    digest = hashlib.sha256(json.dumps(seat_map, sort_keys=True).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def cached_seat_map(event_id: int) -> tuple[dict[str, Any], str]:
+    """Return the seat map of an event and its ETag, encoding it if needed"""
+    now = time.monotonic()
+    with _lock:
+        entry = _seat_maps.get(event_id)
+        if entry is not None and now < entry[0]:
+            return entry[1], entry[2]
+        generation = _generation
+    seat_map = encode_seat_map(event_id)
+    etag = seat_map_etag(seat_map)
+    with _lock:
+        if generation == _generation:
+            _seat_maps[event_id] = (now + app_settings.SEAT_MAP_CACHE_TTL, seat_map, etag)
+    return seat_map, etag
+
+
+def invalidate_seat_maps(*_args: Any, **_kwargs: Any) -> None:
+    """Forget the encoded seat maps, also usable as a signal receiver"""
+    global _generation  # pylint: disable=global-statement
+    with _lock:
+        _generation += 1
+        _seat_maps.clear()
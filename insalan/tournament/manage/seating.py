@@ -0,0 +1,249 @@
+"""
+Automatic allocation of the seats of the validated teams
+
+The players of a team are given a slot of contiguous seats, taken from a row
+of the hall when one is long enough. Its managers and substitutes have no slot,
+but as many free seats as they are are kept next to it, as the spare seats of
+the slot, so that no other team is seated there, by this allocation or by a
+later one of any tournament of the event. Slots drawn by hand for the
+tournament are used first.
+
+The allocation is planned in memory from the seats of the event, then saved
+with a few bulk queries. The event is locked meanwhile, so that two
+allocations cannot give the same seats.
+"""
+
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count
+
+from ..models import Event, EventTournament, Seat, SeatSlot, Team
+from .seat_map import invalidate_seat_maps
+
+
+@dataclass
+class SeatPlan:
+    """Seats given to the teams by the allocator"""
+    # Team id -> id of a slot drawn by hand
+    slots: dict[int, int] = field(default_factory=dict)
+    # Team id -> seats of a slot to create
+    new_slots: dict[int, list[int]] = field(default_factory=dict)
+    # Team id -> free seats kept next to its slot for its managers and substitutes
+    spares: dict[int, list[int]] = field(default_factory=dict)
+    # Teams left without a seat
+    unplaced: list[int] = field(default_factory=list)
+
+
+@dataclass
+class SeatAllocation:
+    """Outcome of an allocation"""
+    placed: int = 0
+    unplaced: int = 0
+
+
+class SeatPlanner:
+    """Plan the seats of teams on the grid of an event"""
+
+    def __init__(
+        self,
+        seats: Iterable[tuple[int, int, int]],
+        taken: set[int],
+        free_slots: dict[int, list[int]],
+        slot_size: int,
+    ) -> None:
+        """
+        `seats` are the (id, x, y) of the seats of the event, `taken` the ones
+        which cannot be given, and `free_slots` the seats of the unused slots
+        of the tournament, which are taken too.
+        """
+        self.slot_size = slot_size
+        self.coords: dict[int, tuple[int, int]] = {}
+        self.at: dict[tuple[int, int], int] = {}
+        self.rows: dict[int, list[tuple[int, int]]] = {}
+        for seat_id, x, y in seats:
+            self.coords[seat_id] = (x, y)
+            self.at[(x, y)] = seat_id
+            self.rows.setdefault(y, []).append((x, seat_id))
+        for row in self.rows.values():
+            row.sort()
+        self.free_slots = {
+            slot_id: sorted(seats, key=lambda seat_id: self.coords[seat_id][::-1])
+            for slot_id, seats in sorted(free_slots.items())
+        }
+        in_slots = {seat_id for seats in free_slots.values() for seat_id in seats}
+        self.free = set(self.coords) - taken - in_slots
+        # Runs of consecutive free seats, per row, refreshed as seats are given
+        self.runs = {y: self._row_runs(y) for y in sorted(self.rows)}
+
+    def _row_runs(self, y: int) -> list[list[int]]:
+        """Runs of consecutive free seats of a row"""
+        runs: list[list[int]] = []
+        last_x: int | None = None
+        for x, seat_id in self.rows[y]:
+            if seat_id not in self.free:
+                last_x = None
+                continue
+            if last_x is not None and x == last_x + 1:
+                runs[-1].append(seat_id)
+            else:
+                runs.append([seat_id])
+            last_x = x
+        return runs
+
+    def _take(self, seats: list[int]) -> None:
+        """Remove seats from the free ones"""
+        self.free.difference_update(seats)
+        for y in {self.coords[seat_id][1] for seat_id in seats}:
+            self.runs[y] = self._row_runs(y)
+
+    def _neighbours(self, seat_id: int) -> list[int]:
+        x, y = self.coords[seat_id]
+        return [
+            self.at[cell]
+            for cell in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1))
+            if cell in self.at
+        ]
+
+    def _grow(self, seats: list[int], count: int) -> list[int]:
+        """Up to `count` free seats, as close as possible to `seats`"""
+        grown: list[int] = []
+        seen = set(seats)
+        queue = deque(seats)
+        while queue and len(grown) < count:
+            for neighbour in self._neighbours(queue.popleft()):
+                if neighbour in seen or neighbour not in self.free:
+                    continue
+                seen.add(neighbour)
+                grown.append(neighbour)
+                queue.append(neighbour)
+                if len(grown) == count:
+                    break
+        return grown
+
+    def _region(self) -> list[int] | None:
+        """
+        Free seats next to each other, across rows, when no row has enough
+        consecutive ones
+        """
+        for y in sorted(self.rows):
+            for _, seat_id in self.rows[y]:
+                if seat_id in self.free:
+                    region = [seat_id, *self._grow([seat_id], self.slot_size - 1)]
+                    if len(region) == self.slot_size:
+                        return region
+        return None
+
+    def place(self, team_id: int, spares: int, plan: SeatPlan) -> None:
+        """Give seats to a team, for its players and then its other members"""
+        if self.free_slots:
+            slot_id = next(iter(self.free_slots))
+            players = self.free_slots.pop(slot_id)
+            plan.slots[team_id] = slot_id
+            kept = self._grow(players, spares)
+        else:
+            runs = [run for runs in self.runs.values() for run in runs]
+            # The smallest run which fits the whole team, else its players
+            fitting = [run for run in runs if len(run) >= self.slot_size + spares]
+            fitting = fitting or [run for run in runs if len(run) >= self.slot_size]
+            if fitting:
+                run = min(fitting, key=len)
+                players = run[:self.slot_size]
+                kept = run[self.slot_size:self.slot_size + spares]
+            else:
+                region = self._region()
+                if region is None:
+                    plan.unplaced.append(team_id)
+                    return
+                players, kept = region, []
+            self._take(players + kept)
+            kept += self._grow(players + kept, spares - len(kept))
+            plan.new_slots[team_id] = players
+        self._take(kept)
+        if kept:
+            plan.spares[team_id] = kept
+
+    def plan(self, teams: Iterable[tuple[int, int]]) -> SeatPlan:
+        """
+        Place the (id, number of managers and substitutes) teams, the
+        biggest first
+        """
+        plan = SeatPlan()
+        for team_id, spares in sorted(teams, key=lambda team: (-team[1], team[0])):
+            self.place(team_id, spares, plan)
+        return plan
+
+
+def plan_seats(tournament: EventTournament) -> SeatPlan:
+    """Plan the seats of the validated teams of a tournament without any"""
+    through = SeatSlot.seats.through
+    slot_seats: dict[int, list[int]] = {}
+    for slot_id, seat_id in through.objects.filter(
+        seat__event=tournament.event_id
+    ).values_list("seatslot_id", "seat_id"):
+        slot_seats.setdefault(slot_id, []).append(seat_id)
+    free_slots = {
+        slot_id: slot_seats.pop(slot_id)
+        for slot_id in SeatSlot.objects.filter(tournament=tournament, team=None).values_list(
+            "id", flat=True
+        )
+        if len(slot_seats.get(slot_id, [])) == tournament.game.players_per_team
+    }
+    taken = {seat_id for seats in slot_seats.values() for seat_id in seats}
+    # Seats kept for the managers and substitutes of the seated teams
+    taken.update(
+        SeatSlot.spare_seats.through.objects.filter(
+            seat__event=tournament.event_id, seatslot__team__isnull=False
+        ).values_list("seat_id", flat=True)
+    )
+
+    teams = Team.objects.filter(
+        tournament=tournament, validated=True, seat_slot=None
+    ).annotate(
+        spares=Count("manager", distinct=True) + Count("substitute", distinct=True)
+    ).values_list("id", "spares")
+
+    planner = SeatPlanner(
+        Seat.objects.filter(event=tournament.event_id).values_list("id", "x", "y"),
+        taken,
+        free_slots,
+        tournament.game.players_per_team,
+    )
+    return planner.plan(teams)
+
+
+def allocate_seats(tournament: EventTournament) -> SeatAllocation:
+    """Give a slot to every validated team of a tournament without one"""
+    with transaction.atomic():
+        # Allocations of the tournaments of an event are planned one at a time
+        Event.objects.select_for_update().filter(id=tournament.event_id).first()
+        plan = plan_seats(tournament)
+        created = SeatSlot.objects.bulk_create(
+            SeatSlot(tournament=tournament) for _ in plan.new_slots
+        )
+        through = SeatSlot.seats.through
+        through.objects.bulk_create(
+            through(seatslot_id=slot.id, seat_id=seat_id)
+            for slot, seats in zip(created, plan.new_slots.values())
+            for seat_id in seats
+        )
+        slots = plan.slots | {
+            team_id: slot.id for team_id, slot in zip(plan.new_slots, created)
+        }
+        spare_through = SeatSlot.spare_seats.through
+        # Slots drawn by hand may have kept seats for a former team
+        spare_through.objects.filter(seatslot_id__in=plan.slots.values()).delete()
+        spare_through.objects.bulk_create(
+            spare_through(seatslot_id=slots[team_id], seat_id=seat_id)
+            for team_id, seats in plan.spares.items()
+            for seat_id in seats
+        )
+        Team.objects.bulk_update(
+            [Team(id=team_id, seat_slot_id=slot_id) for team_id, slot_id in slots.items()],
+            ["seat_slot"],
+        )
+    # The bulk queries send no signal
+    invalidate_seat_maps()
+    return SeatAllocation(placed=len(slots), unplaced=len(plan.unplaced))
@@ -0,0 +1,58 @@
+"""
+Command handler to refresh the names in game of the players of an event.
+
+Players may rename their FaceIt or Riot account after registering. The names
+are looked up concurrently, within the rate limits of the APIs.
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from insalan.tournament.manage import refresh_names_in_game
+from insalan.tournament.models import BaseTournament
+
+
+class Command(BaseCommand):
+    """The `refresh_names_in_game` command handler class"""
+
+    help = "Refresh the names in game of the players and substitutes of events or tournaments"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add declarations for the arguments this command will take"""
+        parser.add_argument(
+            "--event",
+            type=int,
+            action="append",
+            dest="events",
+            help="Refresh the tournaments of this event (can be repeated)",
+        )
+        parser.add_argument(
+            "--tournament",
+            type=int,
+            action="append",
+            dest="tournaments",
+            help="Refresh this tournament (can be repeated)",
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:
+        """Command handler"""
+        if not options["events"] and not options["tournaments"]:
+            raise CommandError("Give at least one --event or --tournament")
+        tournament_ids = set(options["tournaments"] or [])
+        if options["events"]:
+            tournament_ids.update(
+                BaseTournament.objects.filter(
+                    eventtournament__event__in=options["events"]
+                ).values_list("id", flat=True)
+            )
+
+        def report(done: int, total: int) -> None:
+            self.stdout.write(f"{done}/{total} names looked up")
+
+        result = refresh_names_in_game(tournament_ids, report)
+        self.stdout.write(f"Renamed {result.renamed} of {result.checked} players")
+        if result.skipped:
+            self.stderr.write(
+                f"{result.skipped} names could not be looked up, run the command again later"
+            )
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.12 on 2026-10-19 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournament', '0019_alter_player_options_alter_substitute_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournamentmailer',
+            name='dry_run',
+            field=models.BooleanField(blank=True, default=False, help_text='Compter les destinataires sans envoyer le mail', verbose_name='Aperçu'),
+        ),
+    ]
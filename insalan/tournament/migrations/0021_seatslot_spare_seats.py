@@ -0,0 +1,18 @@
+# Generated by Django 4.1.12 on 2026-10-19 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournament', '0020_tournamentmailer_dry_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seatslot',
+            name='spare_seats',
+            field=models.ManyToManyField(blank=True, help_text='Places gardées à côté du slot pour les managers et remplaçant⋅e⋅s', related_name='spare_slots', to='tournament.seat', verbose_name='Places gardées'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from typing import Any
+from __future__ import annotations
+
+from typing import Any, TYPE_CHECKING
 
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -7,9 +9,11 @@ from insalan.mailer import MailManager
 from insalan.settings import EMAIL_AUTH
 
 from .player import Player
-from .team import Team
 from .tournament import EventTournament
 
+if TYPE_CHECKING:
+    from django_stubs_ext import ValuesQuerySet
+
 
 class TournamentMailer(models.Model):
     """
@@ -21,7 +25,8 @@ class TournamentMailer(models.Model):
     - captains: if the players are captains
 
     The save method is overriden to send the mail to every players matching the filters and not
-    actually save the object. The database table should be empty at all time.
+    actually save the object. The database table should be empty at all time. With `dry_run`,
+    the recipients are only counted.
 
     """
     class Meta:
@@ -72,6 +77,12 @@ class TournamentMailer(models.Model):
         blank=True,
         default="",
     )
+    dry_run = models.BooleanField(
+        default=False,
+        blank=True,
+        verbose_name=_("Aperçu"),
+        help_text=_("Compter les destinataires sans envoyer le mail"),
+    )
     attachment = models.FileField(
         verbose_name=_("Pièce jointe"),
         blank=True,
@@ -79,35 +90,43 @@ class TournamentMailer(models.Model):
         upload_to="mail-attachments",
     )
 
-    def save(self, *args: Any, **kwargs: Any) -> None:
-        """Override default save of TournamentMailer"""
-        if self.mail != "":
-            super().save(*args, **kwargs)
-            return
+    recipient_count: int = 0
+
+    def get_recipients(self) -> ValuesQuerySet[Player, str]:
+        """
+        E-mail addresses of the players matching the filters, resolved in a
+        single query.
+        """
         # get every players of the ongoing event
-        players = Player.objects.filter(team__tournament__event__ongoing=True)
+        players = Player.objects.filter(
+            team__tournament__eventtournament__event__ongoing=True
+        )
         # if the tournament is specified, filter by tournament
         if self.tournament is not None:
             players = players.filter(team__tournament=self.tournament)
         # if the team is validated, filter by validated teams
         if self.team_validated:
             players = players.filter(team__validated=True)
-        # if the captains filter is enabled, filter by captains
+        # if the captains filter is enabled, only keep the captains of their team
         if self.captains:
-            # get every teams
-            teams = Team.objects.all()
-            # get every captains
-            captains = [team.captain.id for team in teams if team.captain is not None]
-            # filter players by captains
-            players = players.filter(id__in=captains)
-        # send the mail to every players
-        for player in players:
-            # send the mail
-            mailer = MailManager.get_mailer(EMAIL_AUTH["tournament"]["from"])
-            assert mailer is not None
-            mailer.send_tournament_mail(
-                player.user,
-                self.title,
-                self.content,
-                self.attachment,
-            )
+            players = players.filter(team_captain__isnull=False)
+        return players.order_by("user__email").values_list("user__email", flat=True).distinct()
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        """Override default save of TournamentMailer"""
+        if self.mail != "":
+            super().save(*args, **kwargs)
+            return
+        recipients = self.get_recipients()
+        if self.dry_run:
+            self.recipient_count = recipients.count()
+            return
+        # queue the mail for every players at once
+        mailer = MailManager.get_mailer(EMAIL_AUTH["tournament"]["from"])
+        assert mailer is not None
+        self.recipient_count = mailer.send_tournament_mails(
+            recipients.iterator(),
+            self.title,
+            self.content,
+            self.attachment,
+        )
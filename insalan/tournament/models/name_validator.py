@@ -1,23 +1,141 @@
 """
 NameValidator class
+
+The validators of FaceIt and League of Legends share a client, which keeps a
+pool of connections to the APIs, caches the lookups for a while, and paces the
+requests to stay within the rate limit of each API.
 """
 from __future__ import annotations
 
+import logging
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Any, ClassVar, Type, TYPE_CHECKING, cast
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, ClassVar, Type, TypeVar, TYPE_CHECKING, cast
 
 from django.utils.translation import gettext_lazy as _
 
 import requests
-
-from insalan.settings import FACEIT_API_KEY, RIOT_API_KEY
+from requests.adapters import HTTPAdapter
+
+from insalan.ratelimit import TokenBucket
+from insalan.settings import (
+    FACEIT_API_BURST,
+    FACEIT_API_KEY,
+    FACEIT_API_RATE,
+    NAME_VALIDATOR_CACHE_SIZE,
+    NAME_VALIDATOR_CACHE_TTL,
+    NAME_VALIDATOR_WORKERS,
+    RIOT_API_BURST,
+    RIOT_API_KEY,
+    RIOT_API_RATE,
+)
 
 if TYPE_CHECKING:
     from django_stubs_ext import StrPromise
 
+logger = logging.getLogger(__name__)
 
 REQUESTS_TIMEOUT_SECONDS: int = 5
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ValidatorUnavailable(RuntimeError):
+    """The rate limit of an API did not let a lookup through in time"""
+
+
+class LookupCache:
+    """
+    Thread-safe LRU cache whose entries expire `ttl` seconds after being set
+
+    `None` is a valid value: it records that a name or an account does not
+    exist.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """Return whether the key is cached, and its value"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache a value, evicting the least recently used entry if full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget every entry"""
+        with self._lock:
+            self._entries.clear()
+
+
+class ValidatorClient:
+    """Client of the APIs used by the name validators"""
+
+    def __init__(self) -> None:
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=NAME_VALIDATOR_WORKERS)
+        self.session.mount("https://", adapter)
+        self.cache = LookupCache(NAME_VALIDATOR_CACHE_SIZE, NAME_VALIDATOR_CACHE_TTL)
+        self.rate_limits = {
+            "faceit": TokenBucket(FACEIT_API_RATE, FACEIT_API_BURST),
+            "riot": TokenBucket(RIOT_API_RATE, RIOT_API_BURST),
+        }
+        self.pool = ThreadPoolExecutor(
+            max_workers=NAME_VALIDATOR_WORKERS, thread_name_prefix="name-validator"
+        )
+
+    def get(self, api: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Send a GET request to an API, within its rate limit
+
+        Raise ValidatorUnavailable if the rate limit did not let the request
+        through in time: the name may well be valid.
+        """
+        if not self.rate_limits[api].acquire(timeout=REQUESTS_TIMEOUT_SECONDS):
+            logger.warning("Rate limit of the %s API reached, lookup skipped", api)
+            raise ValidatorUnavailable(f"Rate limit of the {api} API reached")
+        return self.session.get(url, timeout=REQUESTS_TIMEOUT_SECONDS, **kwargs)
+
+    def map(self, func: Callable[[T], R], items: Iterable[T]) -> list[R]:
+        """Apply a function to many items, on the thread pool"""
+        return list(self.pool.map(func, items))
+
+
+_client: ValidatorClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_validator_client() -> ValidatorClient:
+    """Return the validator client of this process"""
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ValidatorClient()
+    return _client
+
 
 class NameValidator(ABC):
     short: ClassVar[str]
@@ -39,6 +157,26 @@ class NameValidator(ABC):
         Each validators should implement this method
         """
 
+    @classmethod
+    def update_names(
+        cls, entries: Iterable[tuple[str, dict[str, Any]]]
+    ) -> list[str | None]:
+        """
+        Update the names of many players at once, concurrently
+
+        Each entry is a name and its validator data. None is returned for a
+        name that could not be looked up.
+        """
+        def update(entry: tuple[str, dict[str, Any]]) -> str | None:
+            name, data = entry
+            try:
+                return cls.update_name(name, data)
+            except (requests.exceptions.RequestException, ValidatorUnavailable) as err:
+                logger.warning("Unable to update the name %s: %s", name, err)
+                return None
+
+        return get_validator_client().map(update, entries)
+
 
 class EmptyNameValidator(NameValidator):
     """NameValidator class"""
@@ -54,6 +192,12 @@ class EmptyNameValidator(NameValidator):
     def update_name(_name: str, _data: dict[str, Any]) -> str:
         return _name
 
+    @classmethod
+    def update_names(
+        cls, entries: Iterable[tuple[str, dict[str, Any]]]
+    ) -> list[str | None]:
+        return [name for name, _data in entries]
+
 
 class FaceItNameValidator(NameValidator):
     """FaceItNameValidator class"""
@@ -66,17 +210,28 @@ class FaceItNameValidator(NameValidator):
     @staticmethod
     def validate_name(name: str) -> dict[str, Any] | None:
         """This method is used to validate the FaceIt name of a CS2 player."""
-        response = requests.get(
-            f"{FaceItNameValidator.face_it_api}/players",
-            params={"nickname": name, },
-            headers={"Authorization": f"Bearer {FACEIT_API_KEY}"},
-            timeout=REQUESTS_TIMEOUT_SECONDS,
-        )
-
-        if response.status_code != 200:
+        client = get_validator_client()
+        cached, player_id = client.cache.get(("faceit", "nickname", name))
+        if not cached:
+            response = client.get(
+                "faceit",
+                f"{FaceItNameValidator.face_it_api}/players",
+                params={"nickname": name, },
+                headers={"Authorization": f"Bearer {FACEIT_API_KEY}"},
+            )
+            if response.status_code == 404:
+                client.cache.set(("faceit", "nickname", name), None)
+            if response.status_code != 200:
+                return None
+
+            player_id = response.json()["player_id"]
+            client.cache.set(("faceit", "nickname", name), player_id)
+            client.cache.set(
+                ("faceit", "player_id", player_id), response.json().get("nickname", name)
+            )
+
+        if player_id is None:
             return None
-
-        player_id = response.json()["player_id"]
         data = {"player_id": player_id}
 
         return data
@@ -88,20 +243,24 @@ class FaceItNameValidator(NameValidator):
         its player id.
         """
         player_id: str = data["player_id"]
-        response = requests.get(
-            f"{FaceItNameValidator.face_it_api}/players/{player_id}",
-            headers={"Authorization": f"Bearer {FACEIT_API_KEY}"},
-            timeout=REQUESTS_TIMEOUT_SECONDS,
-        )
-        if response.status_code != 200:
-            return name
-
-        nickname: str | None = response.json().get("nickname")
+        client = get_validator_client()
+        cached, nickname = client.cache.get(("faceit", "player_id", player_id))
+        if not cached:
+            response = client.get(
+                "faceit",
+                f"{FaceItNameValidator.face_it_api}/players/{player_id}",
+                headers={"Authorization": f"Bearer {FACEIT_API_KEY}"},
+            )
+            if response.status_code != 200:
+                return name
+
+            nickname = response.json().get("nickname")
+            client.cache.set(("faceit", "player_id", player_id), nickname)
 
         if nickname is None:
             return name
 
-        return nickname
+        return cast(str, nickname)
 
 
 class LeagueOfLegendsNameValidator(NameValidator):
@@ -124,27 +283,41 @@ class LeagueOfLegendsNameValidator(NameValidator):
             return None
         gamename, tagline = name.split("#")
 
-        # Get the puuid associated with the account
-        response = requests.get(
-            accountendpoint.format(gamename, tagline, RIOT_API_KEY),
-            timeout=REQUESTS_TIMEOUT_SECONDS,
-        )
-        if response.status_code != 200:
+        client = get_validator_client()
+        # The puuid of a name with a League of Legends account, None if the
+        # name or the account does not exist
+        cached, puuid = client.cache.get(("riot", "riot_id", name))
+        if not cached:
+            # Get the puuid associated with the account
+            response = client.get(
+                "riot", accountendpoint.format(gamename, tagline, RIOT_API_KEY)
+            )
+            if response.status_code == 404:
+                client.cache.set(("riot", "riot_id", name), None)
+            if response.status_code != 200:
+                return None
+            account = response.json()
+            puuid = account["puuid"]
+
+            # Get the league of legends account associated with the puuid
+            response = client.get("riot", summonerendpoint.format(puuid, RIOT_API_KEY))
+            if response.status_code == 404:
+                client.cache.set(("riot", "riot_id", name), None)
+            if response.status_code != 200:
+                return None
+
+            # We don't need to check the response, if the request was successful,
+            # the name is valid and a league of legends account exists with this name
+            client.cache.set(("riot", "riot_id", name), puuid)
+            if "gameName" in account and "tagLine" in account:
+                client.cache.set(
+                    ("riot", "puuid", puuid), account["gameName"] + "#" + account["tagLine"]
+                )
+
+        if puuid is None:
             return None
-        puuid = response.json()["puuid"]
         data["puuid"] = puuid
 
-        # Get the league of legends account associated with the puuid
-        response = requests.get(
-            summonerendpoint.format(puuid, RIOT_API_KEY),
-            timeout=REQUESTS_TIMEOUT_SECONDS,
-        )
-        if response.status_code != 200:
-            return None
-
-        # We don't need to check the response, if the request was successful,
-        # the name is valid and a league of legends account exists with this name
-
         return data
 
     @staticmethod
@@ -159,10 +332,12 @@ class LeagueOfLegendsNameValidator(NameValidator):
             return name
 
         puuid = data["puuid"]
-        response = requests.get(
-            summonerendpoint.format(puuid, RIOT_API_KEY),
-            timeout=REQUESTS_TIMEOUT_SECONDS,
-        )
+        client = get_validator_client()
+        cached, riot_id = client.cache.get(("riot", "puuid", puuid))
+        if cached:
+            return cast(str, riot_id)
+
+        response = client.get("riot", summonerendpoint.format(puuid, RIOT_API_KEY))
         # If the request fails, don't update the name
         if response.status_code != 200:
             return name
@@ -175,6 +350,7 @@ class LeagueOfLegendsNameValidator(NameValidator):
         if not isinstance(game_name, str) or not isinstance(tag_line, str):
             return name
 
+        client.cache.set(("riot", "puuid", puuid), game_name + "#" + tag_line)
         return game_name + "#" + tag_line
 
 
@@ -20,6 +20,16 @@ class SeatSlot(models.Model):
         verbose_name=_("Place"),
     )
 
+    # Kept free by the seat allocation, so that the next allocations do not
+    # seat other teams there
+    spare_seats = models.ManyToManyField(
+        "Seat",
+        blank=True,
+        related_name="spare_slots",
+        verbose_name=_("Places gardées"),
+        help_text=_("Places gardées à côté du slot pour les managers et remplaçant⋅e⋅s"),
+    )
+
     def __str__(self) -> str:
         return f"SeatSlot {self.id} for {self.tournament.name}"
 
@@ -102,9 +102,10 @@ class Team(models.Model):
 
     def __str__(self) -> str:
         """Format this team to a str"""
-        if isinstance(self.tournament, tournament.EventTournament):
-            return f"{self.name} ({self.tournament.event})"
-        return f"{self.name} ({self.tournament.name})"
+        trnm = self.tournament.get_selected_instance()
+        if isinstance(trnm, tournament.EventTournament):
+            return f"{self.name} ({trnm.event})"
+        return f"{self.name} ({trnm.name})"
 
     def get_name(self) -> str:
         """
@@ -112,6 +112,23 @@ class BaseTournament(PolymorphicModel):  # type: ignore[misc]
         """Get the name of the tournament"""
         return self.name
 
+    def get_selected_instance(self) -> BaseTournament:
+        """
+        Get this tournament as an instance of its actual class
+
+        Tournaments selected along with another model (select_related) are
+        not downcast by django-polymorphic. The event or private tournament
+        selected with them (through `eventtournament` or `privatetournament`)
+        is then used without any query.
+        """
+        if type(self) is not BaseTournament:  # pylint: disable=unidiomatic-typecheck
+            return self
+        for child in ("eventtournament", "privatetournament"):
+            selected: BaseTournament | None = self._state.fields_cache.get(child)
+            if selected is not None:
+                return selected
+        return cast(BaseTournament, self.get_real_instance())
+
     def get_game(self) -> "Game":
         """Get the game of a tournament"""
         return self.game
@@ -252,11 +269,10 @@ class BaseTournament(PolymorphicModel):  # type: ignore[misc]
 
     def update_name_in_game(self) -> None:
         """Update all name_in_game of players and substitutes in the tournament"""
-        for team_obj in self.get_teams():
-            for player in team_obj.get_players():
-                player.update_name_in_game()
-            for substitute in team_obj.get_substitutes():
-                substitute.update_name_in_game()
+        # pylint: disable-next=import-outside-toplevel
+        from ..manage.names import refresh_names_in_game
+
+        refresh_names_in_game([self.id])
 
 class PrivateTournament(BaseTournament):
     """
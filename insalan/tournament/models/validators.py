@@ -4,6 +4,7 @@ from collections import Counter
 from math import ceil
 from typing import Any, TYPE_CHECKING
 
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils.translation import gettext_lazy as _
 from rest_framework.exceptions import ValidationError
 
@@ -15,6 +16,7 @@ from . import substitute as sub
 from .event import Event
 from .game import Game
 from .match import BestofType, Match
+from .name_validator import ValidatorUnavailable
 from .tournament import BaseTournament, EventTournament, PrivateTournament
 
 if TYPE_CHECKING:
@@ -145,7 +147,20 @@ def validate_match_data(match: Match, data: dict[str, Any]) -> dict[str, str] |
     return None
 
 def valid_name(game_param: Game, name: str) -> dict[str, Any] | None:
+    """
+    Validate a name in game, and return its validator data
+
+    Return None if the name is invalid, and raise a ValidationError asking to
+    retry if the API of the validator could not be queried in time.
+    """
     name_validator = game_param.get_name_validator()
     if name_validator is None:
         return {}
-    return name_validator.validate_name(name)
+    try:
+        return name_validator.validate_name(name)
+    except ValidatorUnavailable as err:
+        raise DjangoValidationError(
+            _("La validation des pseudos est temporairement indisponible, "
+              "veuillez réessayer dans quelques instants"),
+            code="unavailable",
+        ) from err
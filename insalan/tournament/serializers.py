@@ -948,7 +948,7 @@ class SeatSlotSerializer(serializers.ModelSerializer[SeatSlot]):
         """Meta options for the serializer"""
 
         model = SeatSlot
-        fields = "__all__"
+        exclude = ["spare_seats"]
 
 
 class SeatSerializer(serializers.ModelSerializer[Seat]):
@@ -1153,7 +1153,7 @@ class FullDerefSeatSlotSerializer(serializers.ModelSerializer[SeatSlot]):
         """Meta options for the serializer"""
 
         model = SeatSlot
-        exclude = ["tournament"]
+        exclude = ["tournament", "spare_seats"]
 
 
 class FullDerefEventSerializer(serializers.ModelSerializer[Event]):
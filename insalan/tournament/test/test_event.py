@@ -1,20 +1,29 @@
 """Tournament Event Module Tests"""
 
+import base64
+import time
 from datetime import date
 from io import BytesIO
+from unittest.mock import patch
 
 from django.utils import timezone
 from django.db.utils import IntegrityError
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TransactionTestCase
+from django.urls import reverse
 
 from rest_framework.test import APITestCase
 
+from insalan import settings as app_settings
+from insalan.tournament.manage import invalidate_seat_maps
 from insalan.tournament.models import (
     EventTournament,
     Event,
     Game,
+    Seat,
+    SeatSlot,
+    Team,
 )
 
 class EventTestCase(TransactionTestCase):
@@ -326,3 +335,110 @@ class EventDerefAndGroupingEndpoints(APITestCase):
             "planning_file": None,
         }
         self.assertEqual(request.data, model)
+
+
+class EventSeatMapEndpoint(APITestCase):
+    """Tests of the compact seat map of an event"""
+
+    def setUp(self) -> None:
+        self.event = Event.objects.create(
+            name="Insalan Test",
+            date_start=date(2023, 2, 1),
+            date_end=date(2023, 2, 2),
+            description=""
+        )
+        game = Game.objects.create(name="Game", players_per_team=2)
+        self.tournament = EventTournament.objects.create(event=self.event, game=game)
+        # Two rows of three seats, with a hole in the middle of the second
+        self.seats = {
+            (x, y): Seat.objects.create(event=self.event, x=x, y=y)
+            for x, y in [(2, 5), (3, 5), (4, 5), (2, 6), (4, 6)]
+        }
+        self.slot = SeatSlot.objects.create(tournament=self.tournament)
+        self.slot.seats.set([self.seats[(3, 5)], self.seats[(4, 5)]])
+        self.other_slot = SeatSlot.objects.create(tournament=self.tournament)
+        self.other_slot.seats.set([self.seats[(2, 5)], self.seats[(4, 6)]])
+        self.url = reverse("event/seat-map", kwargs={"pk": self.event.id})
+        invalidate_seat_maps()
+        self.addCleanup(invalidate_seat_maps)
+
+    def test_seat_map(self) -> None:
+        """Test the encoding of the grid and of the slots"""
+        team = Team.objects.create(
+            name="Team", tournament=self.tournament, seat_slot=self.slot
+        )
+
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        seat_map = response.json()
+        self.assertEqual(
+            (seat_map["x"], seat_map["y"], seat_map["width"], seat_map["height"]), (2, 5, 3, 2)
+        )
+        # 111 101
+        self.assertEqual(base64.b64decode(seat_map["seats"]), bytes([0b11110100]))
+        self.assertEqual(seat_map["slots"], [
+            {"id": self.slot.id, "tournament": self.tournament.id, "team": team.id,
+             "seats": [[1, 3]]},
+            {"id": self.other_slot.id, "tournament": self.tournament.id, "team": None,
+             "seats": [[0, 1], [4, 5]]},
+        ])
+
+    def test_empty_event(self) -> None:
+        """Test the seat map of an event without seats"""
+        event = Event.objects.create(
+            name="Empty", date_start=date(2023, 2, 1), date_end=date(2023, 2, 2), description=""
+        )
+        response = self.client.get(reverse("event/seat-map", kwargs={"pk": event.id}))
+        self.assertEqual(response.json()["width"], 0)
+        self.assertEqual(response.json()["slots"], [])
+
+        response = self.client.get(reverse("event/seat-map", kwargs={"pk": 9999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_etag(self) -> None:
+        """Test that the seat map is revalidated until it changes"""
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        Team.objects.create(name="Team", tournament=self.tournament, seat_slot=self.other_slot)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_none_match(self) -> None:
+        """Test that lists of tags, weak tags and "*" are understood"""
+        etag = self.client.get(self.url)["ETag"]
+
+        for if_none_match in (f'"other", {etag}', f"W/{etag}", "*"):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other", W/"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached(self) -> None:
+        """Test that the seat map is only encoded again once modified"""
+        etag = self.client.get(self.url)["ETag"]
+
+        # Only the event is read
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.seats[(2, 6)].delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # Changes of other workers are seen once the map expires
+        Seat.objects.filter(id=self.seats[(4, 6)].id).update(x=3)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        expired = time.monotonic() + app_settings.SEAT_MAP_CACHE_TTL
+        with patch("insalan.tournament.manage.seat_map.time.monotonic", return_value=expired):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
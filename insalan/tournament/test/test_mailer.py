@@ -0,0 +1,145 @@
+"""Tournament Mailer Module Tests"""
+
+from datetime import date
+
+from django.core import mail
+from django.test import TestCase
+from django.urls import reverse
+
+from insalan.tournament.models import (
+    Event,
+    EventTournament,
+    Game,
+    Player,
+    Team,
+    TournamentMailer,
+)
+from insalan.user.models import User
+
+
+class TournamentMailerTestCase(TestCase):
+    """
+    Tests for the TournamentMailer model
+    """
+
+    def setUp(self) -> None:
+        """
+        Set the tests up
+        """
+        event = Event.objects.create(
+            name="InsaLan Test",
+            date_start=date(2023, 2, 1),
+            date_end=date(2023, 2, 2),
+            description="",
+            ongoing=True,
+        )
+        old_event = Event.objects.create(
+            name="InsaLan Old",
+            date_start=date(2022, 2, 1),
+            date_end=date(2022, 2, 2),
+            description="",
+            ongoing=False,
+        )
+        game = Game.objects.create(name="Game", short_name="GME", players_per_team=2)
+        self.tourney = EventTournament.objects.create(event=event, game=game)
+        self.other_tourney = EventTournament.objects.create(event=event, game=game)
+        old_tourney = EventTournament.objects.create(event=old_event, game=game)
+
+        def register(username: str, team: Team) -> Player:
+            user = User.objects.create_user(
+                username=username, email=f"{username}@example.net", password="password"
+            )
+            return Player.objects.create(user=user, team=team, name_in_game=username)
+
+        validated = Team.objects.create(name="Validée", tournament=self.tourney, validated=True)
+        validated.captain = register("alice", validated)
+        validated.save()
+        register("bob", validated)
+        pending = Team.objects.create(name="En attente", tournament=self.tourney)
+        pending.captain = register("carol", pending)
+        pending.save()
+        other = Team.objects.create(name="Autre", tournament=self.other_tourney)
+        register("dave", other)
+        old = Team.objects.create(name="Ancienne", tournament=old_tourney)
+        register("eve", old)
+
+    def test_recipients(self) -> None:
+        """Test that the filters are applied to the recipients"""
+        mailer = TournamentMailer()
+        self.assertCountEqual(
+            mailer.get_recipients(),
+            ["alice@example.net", "bob@example.net", "carol@example.net", "dave@example.net"],
+        )
+
+        mailer = TournamentMailer(tournament=self.tourney)
+        self.assertCountEqual(
+            mailer.get_recipients(),
+            ["alice@example.net", "bob@example.net", "carol@example.net"],
+        )
+
+        mailer = TournamentMailer(tournament=self.tourney, team_validated=True)
+        self.assertCountEqual(
+            mailer.get_recipients(), ["alice@example.net", "bob@example.net"]
+        )
+
+        mailer = TournamentMailer(tournament=self.tourney, captains=True)
+        self.assertCountEqual(
+            mailer.get_recipients(), ["alice@example.net", "carol@example.net"]
+        )
+
+    def test_recipients_single_query(self) -> None:
+        """Test that the recipients are resolved in a single query"""
+        mailer = TournamentMailer(captains=True, team_validated=True)
+        with self.assertNumQueries(1):
+            list(mailer.get_recipients())
+
+    def test_dry_run(self) -> None:
+        """Test that a dry run only counts the recipients"""
+        mailer = TournamentMailer(tournament=self.tourney, title="Titre", dry_run=True)
+        mailer.save()
+
+        self.assertEqual(mailer.recipient_count, 3)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(TournamentMailer.objects.count(), 0)
+
+    def test_send(self) -> None:
+        """Test that every recipient gets its own mail"""
+        mailer = TournamentMailer(tournament=self.tourney, title="Titre", content="Contenu")
+        mailer.save()
+
+        self.assertEqual(mailer.recipient_count, 3)
+        self.assertCountEqual(
+            [email.to for email in mail.outbox],
+            [["alice@example.net"], ["bob@example.net"], ["carol@example.net"]],
+        )
+        self.assertEqual(TournamentMailer.objects.count(), 0)
+
+    def test_admin_dry_run(self) -> None:
+        """Test that the admin form is filled back after a dry run"""
+        admin_user = User.objects.create_superuser("admin@example.net", "admin", "password")
+        self.client.force_login(admin_user)
+
+        response = self.client.post(
+            reverse("admin:tournament_tournamentmailer_add"),
+            {
+                "tournament": self.tourney.id,
+                "captains": "on",
+                "title": "Titre",
+                "content": "Contenu du mail",
+                "dry_run": "on",
+            },
+            follow=True,
+        )
+
+        self.assertContains(response, "2 destinataire(s) recevrai(en)t ce mail")
+        initial = response.context["adminform"].form.initial
+        self.assertEqual(initial["tournament"], self.tourney.id)
+        self.assertTrue(initial["captains"])
+        self.assertFalse(initial["team_validated"])
+        self.assertEqual(initial["title"], "Titre")
+        self.assertEqual(initial["content"], "Contenu du mail")
+        self.assertEqual(len(mail.outbox), 0)
+
+        # the values are only kept for the next form
+        response = self.client.get(reverse("admin:tournament_tournamentmailer_add"))
+        self.assertNotIn("title", response.context["adminform"].form.initial)
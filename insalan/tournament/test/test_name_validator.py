@@ -0,0 +1,276 @@
+"""Tournament Name Validator Module Tests"""
+
+from datetime import date
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from insalan.ratelimit import TokenBucket
+from insalan.tournament.models import (
+    Event,
+    EventTournament,
+    Game,
+    Player,
+    Substitute,
+    Team,
+)
+from insalan.tournament.models.name_validator import (
+    FaceItNameValidator,
+    LeagueOfLegendsNameValidator,
+    LookupCache,
+    ValidatorClient,
+    ValidatorUnavailable,
+)
+from insalan.tournament.models.validators import valid_name
+from insalan.user.models import User
+
+
+def make_response(status_code: int, body: object = None) -> MagicMock:
+    """Build a fake `requests` response"""
+    response = MagicMock(spec=requests.Response)
+    response.status_code = status_code
+    response.json.return_value = body
+    return response
+
+
+class LookupCacheTestCase(SimpleTestCase):
+    """Tests of the LRU cache of the lookups"""
+
+    def test_expiry(self) -> None:
+        """Test that entries expire after their TTL"""
+        cache = LookupCache(maxsize=10, ttl=60)
+        with patch("insalan.tournament.models.name_validator.time.monotonic") as monotonic:
+            monotonic.return_value = 1000
+            cache.set("name", None)
+            self.assertEqual(cache.get("name"), (True, None))
+            monotonic.return_value = 1061
+            self.assertEqual(cache.get("name"), (False, None))
+
+    def test_eviction(self) -> None:
+        """Test that the least recently used entry is evicted"""
+        cache = LookupCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("c"), (True, 3))
+
+
+class TokenBucketTestCase(SimpleTestCase):
+    """Tests of the blocking acquisition of tokens"""
+
+    def test_acquire(self) -> None:
+        """Test that acquiring waits for a token, up to the timeout"""
+        bucket = TokenBucket(rate=100, capacity=1)
+        self.assertTrue(bucket.acquire())
+        # Refilled after 10ms
+        self.assertTrue(bucket.acquire(timeout=1))
+
+        bucket = TokenBucket(rate=0.01, capacity=1)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0.1))
+
+    def test_invalid_rate(self) -> None:
+        """Test that a bucket which would never refill is refused"""
+        self.assertRaises(ValueError, TokenBucket, rate=0, capacity=1)
+        self.assertRaises(ValueError, TokenBucket, rate=-1, capacity=1)
+
+
+class ValidatorTestCase(SimpleTestCase):
+    """Tests of the FaceIt and League of Legends validators"""
+
+    def setUp(self) -> None:
+        self.client_val = ValidatorClient()
+        self.addCleanup(self.client_val.pool.shutdown)
+        client_patcher = patch(
+            "insalan.tournament.models.name_validator._client", self.client_val
+        )
+        client_patcher.start()
+        self.addCleanup(client_patcher.stop)
+        patcher = patch.object(self.client_val.session, "get")
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_faceit_cached(self) -> None:
+        """Test that a FaceIt name is only looked up once"""
+        self.get.return_value = make_response(
+            200, {"player_id": "abc", "nickname": "Jane"}
+        )
+
+        for _ in range(3):
+            self.assertEqual(FaceItNameValidator.validate_name("Jane"), {"player_id": "abc"})
+        # The nickname of the player is known too
+        self.assertEqual(FaceItNameValidator.update_name("Old", {"player_id": "abc"}), "Jane")
+
+        self.get.assert_called_once()
+
+    def test_unknown_name_cached(self) -> None:
+        """Test that names which do not exist are cached, but not errors"""
+        self.get.return_value = make_response(500)
+        self.assertIsNone(LeagueOfLegendsNameValidator.validate_name("Jane#EUW"))
+        self.get.return_value = make_response(404)
+        self.assertIsNone(LeagueOfLegendsNameValidator.validate_name("Jane#EUW"))
+        self.assertIsNone(LeagueOfLegendsNameValidator.validate_name("Jane#EUW"))
+
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_lol(self) -> None:
+        """Test that a LoL account is looked up once, with its current name"""
+        self.get.side_effect = [
+            make_response(200, {"puuid": "xyz", "gameName": "Jane", "tagLine": "EUW"}),
+            make_response(200, {"id": "summoner"}),
+        ]
+
+        self.assertEqual(LeagueOfLegendsNameValidator.validate_name("jane#euw"), {"puuid": "xyz"})
+        self.assertEqual(LeagueOfLegendsNameValidator.validate_name("jane#euw"), {"puuid": "xyz"})
+        self.assertEqual(
+            LeagueOfLegendsNameValidator.update_name("jane#euw", {"puuid": "xyz"}), "Jane#EUW"
+        )
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_rate_limited(self) -> None:
+        """Test that no request is sent past the rate limit"""
+        self.client_val.rate_limits["faceit"] = TokenBucket(rate=0.001, capacity=1)
+        self.get.return_value = make_response(200, {"nickname": "Jane"})
+
+        with patch("insalan.tournament.models.name_validator.REQUESTS_TIMEOUT_SECONDS", 0), \
+                self.assertLogs("insalan.tournament.models.name_validator", level="WARNING"):
+            names = FaceItNameValidator.update_names([
+                ("Old", {"player_id": "a"}),
+                ("Old", {"player_id": "b"}),
+            ])
+
+        # The lookup refused by the rate limit is reported as skipped
+        self.assertCountEqual(names, ["Jane", None])
+        self.get.assert_called_once()
+
+    def test_validate_rate_limited(self) -> None:
+        """Test that a name is not reported as invalid past the rate limit"""
+        bucket = TokenBucket(rate=0.001, capacity=1)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.client_val.rate_limits["riot"] = bucket
+        game = Game(name="League of Legends", validators="LoL")
+
+        with patch("insalan.tournament.models.name_validator.REQUESTS_TIMEOUT_SECONDS", 0), \
+                self.assertLogs("insalan.tournament.models.name_validator", level="WARNING"):
+            with self.assertRaises(ValidatorUnavailable):
+                LeagueOfLegendsNameValidator.validate_name("jane#euw")
+            with self.assertRaises(ValidationError) as context:
+                valid_name(game, "jane#euw")
+
+        self.assertEqual(context.exception.code, "unavailable")
+        self.get.assert_not_called()
+        # Nothing is cached, the name is looked up once the bucket refills
+        self.assertEqual(self.client_val.cache.get(("riot", "riot_id", "jane#euw")), (False, None))
+
+    def test_update_names_errors(self) -> None:
+        """Test that a failed lookup is reported as skipped"""
+        self.get.side_effect = requests.exceptions.ConnectionError("unreachable")
+        with self.assertLogs("insalan.tournament.models.name_validator", level="WARNING"):
+            names = FaceItNameValidator.update_names([("Old", {"player_id": "a"})])
+        self.assertEqual(names, [None])
+
+
+class UpdateNameInGameTestCase(TestCase):
+    """Tests of the update of the names of a tournament"""
+
+    def setUp(self) -> None:
+        self.event = Event.objects.create(
+            name="InsaLan Test", date_start=date(2023, 8, 1), date_end=date(2023, 8, 2),
+            description=""
+        )
+        game = Game.objects.create(name="Test Game", validators="FaceIt")
+        self.trnm = EventTournament.objects.create(game=game, event=self.event)
+        team = Team.objects.create(name="La Team Test", tournament=self.trnm)
+        users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.net")
+            for i in range(3)
+        ]
+        Player.objects.create(
+            team=team, user=users[0], name_in_game="Old", validator_data={"player_id": "a"}
+        )
+        Player.objects.create(
+            team=team, user=users[1], name_in_game="Same", validator_data={"player_id": "b"}
+        )
+        Substitute.objects.create(
+            team=team, user=users[2], name_in_game="Sub", validator_data={"player_id": "c"}
+        )
+        new_names = {"a": "New", "b": "Same", "c": "NewSub"}
+        patcher = patch.object(
+            FaceItNameValidator,
+            "update_name",
+            side_effect=lambda name, data: new_names[data["player_id"]],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_renamed(self) -> None:
+        """Check that the player and the substitute were renamed"""
+        self.assertEqual(
+            sorted(Player.objects.values_list("name_in_game", flat=True)), ["New", "Same"]
+        )
+        self.assertEqual(Substitute.objects.get().name_in_game, "NewSub")
+
+    def test_update_name_in_game(self) -> None:
+        """Test that players and substitutes are renamed"""
+        self.trnm.update_name_in_game()
+        self.assert_renamed()
+
+    def test_command(self) -> None:
+        """Test that the names of an event are refreshed with one update per model"""
+        out = StringIO()
+        # Tournaments, players, substitutes, then one update per model
+        with self.assertNumQueries(5):
+            call_command("refresh_names_in_game", event=[self.event.id], stdout=out)
+
+        self.assert_renamed()
+        self.assertIn("3/3 names looked up", out.getvalue())
+        self.assertIn("Renamed 2 of 3 players", out.getvalue())
+
+    def test_skipped(self) -> None:
+        """Test that the names skipped by the rate limit are not reported as refreshed"""
+        new_names = {"a": "New", "b": "Same"}
+        refused = {"a": 1, "c": 2}
+
+        def update_name(_name: str, data: dict[str, str]) -> str:
+            # "a" is refused once then looked up again, "c" every time
+            player_id = data["player_id"]
+            if refused.get(player_id, 0):
+                refused[player_id] -= 1
+                raise ValidatorUnavailable("Rate limit of the faceit API reached")
+            return new_names[player_id]
+
+        out = StringIO()
+        err = StringIO()
+        with patch.object(FaceItNameValidator, "update_name", side_effect=update_name), \
+                self.assertLogs("insalan.tournament", level="WARNING"):
+            call_command(
+                "refresh_names_in_game", event=[self.event.id], stdout=out, stderr=err
+            )
+
+        self.assertEqual(
+            sorted(Player.objects.values_list("name_in_game", flat=True)), ["New", "Same"]
+        )
+        self.assertEqual(Substitute.objects.get().name_in_game, "Sub")
+        self.assertIn("Renamed 1 of 2 players", out.getvalue())
+        self.assertIn("1 names could not be looked up", err.getvalue())
+
+    def test_event_admin_action(self) -> None:
+        """Test the admin action refreshing the names of an event"""
+        admin_user = User.objects.create_superuser("admin@example.net", "admin", "password")
+        self.client.force_login(admin_user)
+        response = self.client.post(
+            reverse("admin:tournament_event_changelist"),
+            {"action": "update_name", ACTION_CHECKBOX_NAME: [self.event.id]},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_renamed()
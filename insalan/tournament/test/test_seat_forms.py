@@ -405,3 +405,59 @@ class SeatsFieldTestCase(TestCase):
         )
 
         self.assertFalse(form.is_valid())
+
+    def test_event_form_saves_hall_in_bulk(self) -> None:
+        hall = [(x, y) for x in range(40) for y in range(25)]
+        form = EventForm(
+            instance=self.evobj,
+            data={
+                "name": "Test Event",
+                "date_start": "2021-12-1",
+                "date_end": "2021-12-2",
+                "seats": json.dumps(hall),
+            },
+        )
+        form.full_clean()
+        # The event, its seats, then one insertion of every new seat
+        with self.assertNumQueries(3):
+            form.save()
+
+        self.assertEqual(
+            set(Seat.objects.filter(event=self.evobj).values_list("x", "y")), set(hall)
+        )
+
+    def test_tournament_form_saves_slots_in_bulk(self) -> None:
+        slots = {
+            slot.id: [(seat.x, seat.y) for seat in slot.seats.all()]
+            for slot in self.slots1[1:]
+        }
+        slots[self.slots1[1].id] = [(seat.x, seat.y) for seat in self.available_seats[:5]]
+        slots[42069] = [(seat.x, seat.y) for seat in self.seats[:5]]
+
+        form = EventTournamentForm(
+            instance=self.tournament,
+            data={"seat_slots": json.dumps(slots)},
+        )
+        # Seats taken by other tournaments, seats of the event, slots and
+        # their seats, 5 to delete a slot, then one deletion and two insertions
+        with self.assertNumQueries(12):
+            form.full_clean()
+
+        self.assertEqual(
+            set(SeatSlot.objects.get(id=self.slots1[1].id).seats.all()),
+            set(self.available_seats[:5]),
+        )
+        self.assertFalse(SeatSlot.objects.filter(id=self.slots1[0].id).exists())
+        new_slot = SeatSlot.objects.get(tournament=self.tournament, id__gt=self.slots1[-1].id)
+        self.assertEqual(set(new_slot.seats.all()), set(self.seats[:5]))
+        self.assertEqual(SeatSlot.objects.filter(tournament=self.tournament).count(), 3)
+
+    def test_tournament_form_invalid_if_seat_not_in_event(self) -> None:
+        form = EventTournamentForm(
+            instance=self.tournament,
+            data={"seat_slots": json.dumps({42069: [(100, y) for y in range(5)]})},
+        )
+        self.assertFalse(form.is_valid())
+        self.assertEqual(
+            set(SeatSlot.objects.filter(tournament=self.tournament)), set(self.slots1)
+        )
@@ -1,14 +1,20 @@
 from datetime import date
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.db.utils import IntegrityError
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
 
 from insalan.tournament.models import (
     Event,
     EventTournament,
     Game,
+    Manager,
     Seat,
     SeatSlot,
+    Team,
 )
+from insalan.tournament.manage import SeatPlanner, allocate_seats
+from insalan.user.models import User
 
 from insalan.tournament.admin import SeatSlotForm
 
@@ -157,3 +163,189 @@ class SeatSlotFormTestCase(TestCase):
             data={"tournament": self.tournament_two, "seats": self.seats[3:6]}
         )
         self.assertTrue(form.is_valid())
+
+
+def grid(width: int, height: int) -> list[tuple[int, int, int]]:
+    """Seats (id, x, y) of a full grid, numbered row by row"""
+    return [(y * width + x, x, y) for y in range(height) for x in range(width)]
+
+
+class SeatPlannerTestCase(SimpleTestCase):
+    """
+    Test the planning of the seats of the teams in memory
+    """
+
+    def test_row_with_spares(self) -> None:
+        """Test that a team is seated in a row, with its other members next to it"""
+        planner = SeatPlanner(grid(10, 2), taken={0, 1}, free_slots={}, slot_size=3)
+        plan = planner.plan([(1, 2)])
+
+        self.assertEqual(plan.new_slots, {1: [2, 3, 4]})
+        self.assertEqual(plan.spares, {1: [5, 6]})
+
+    def test_smallest_run(self) -> None:
+        """Test that the smallest run which fits the team is used"""
+        # Runs of 4 seats on the first row, of 10 on the second one
+        planner = SeatPlanner(grid(10, 2), taken={4, 5}, free_slots={}, slot_size=3)
+        plan = planner.plan([(1, 1), (2, 0)])
+
+        self.assertEqual(plan.new_slots, {1: [0, 1, 2], 2: [6, 7, 8]})
+        self.assertEqual(plan.spares, {1: [3]})
+
+    def test_spares_on_next_row(self) -> None:
+        """Test that the other members are seated on the next row when the row is full"""
+        planner = SeatPlanner(grid(3, 2), taken=set(), free_slots={}, slot_size=3)
+        plan = planner.plan([(1, 2)])
+
+        self.assertEqual(plan.new_slots, {1: [0, 1, 2]})
+        self.assertEqual(plan.spares, {1: [3, 4]})
+
+    def test_region_across_rows(self) -> None:
+        """Test that a team is seated across rows when no row is long enough"""
+        planner = SeatPlanner(grid(2, 3), taken=set(), free_slots={}, slot_size=3)
+        plan = planner.plan([(1, 0)])
+
+        self.assertEqual(plan.new_slots, {1: [0, 1, 2]})
+
+    def test_free_slots_first(self) -> None:
+        """Test that the slots drawn by hand are used before new ones"""
+        planner = SeatPlanner(
+            grid(10, 1), taken=set(), free_slots={7: [7, 8, 9]}, slot_size=3
+        )
+        plan = planner.plan([(1, 1), (2, 0)])
+
+        self.assertEqual(plan.slots, {1: 7})
+        self.assertEqual(plan.spares, {1: [6]})
+        self.assertEqual(plan.new_slots, {2: [0, 1, 2]})
+
+    def test_unplaced(self) -> None:
+        """Test that teams are left without seats when the hall is full"""
+        planner = SeatPlanner(grid(4, 1), taken=set(), free_slots={}, slot_size=3)
+        plan = planner.plan([(1, 0), (2, 0)])
+
+        self.assertEqual(plan.new_slots, {1: [0, 1, 2]})
+        self.assertEqual(plan.unplaced, [2])
+
+    def test_large_hall(self) -> None:
+        """Test that the seats of a big hall are given without overlap"""
+        seats = grid(60, 50)
+        coords = {seat_id: (x, y) for seat_id, x, y in seats}
+        planner = SeatPlanner(seats, taken=set(), free_slots={}, slot_size=5)
+        teams = [(team_id, team_id % 3) for team_id in range(450)]
+
+        plan = planner.plan(teams)
+
+        self.assertEqual(plan.unplaced, [])
+        given = [seat for seats in plan.new_slots.values() for seat in seats]
+        given += [seat for seats in plan.spares.values() for seat in seats]
+        self.assertEqual(len(given), len(set(given)))
+        for team_id, spares in teams:
+            self.assertEqual(len(plan.spares.get(team_id, [])), spares)
+        for slot in plan.new_slots.values():
+            # Every slot is on a single row, on consecutive seats
+            self.assertEqual(len({coords[seat][1] for seat in slot}), 1)
+            self.assertEqual(
+                sorted(coords[seat][0] for seat in slot),
+                list(range(coords[slot[0]][0], coords[slot[0]][0] + 5)),
+            )
+
+
+class AllocateSeatsTestCase(TestCase):
+    """
+    Test the allocation of the seats of a tournament
+    """
+
+    def setUp(self) -> None:
+        self.event = Event.objects.create(
+            name="Test Event",
+            description="This is a test",
+            date_start=date(2021, 12, 1),
+            date_end=date(2021, 12, 2),
+            ongoing=False,
+        )
+        game = Game.objects.create(name="Test Game", players_per_team=2)
+        self.tournament = EventTournament.objects.create(
+            name="Tourney", game=game, event=self.event
+        )
+        other = EventTournament.objects.create(name="Other", game=game, event=self.event)
+        self.seats = {
+            (x, y): Seat.objects.create(event=self.event, x=x, y=y)
+            for y in range(2)
+            for x in range(6)
+        }
+        # Seats of another tournament, and a slot drawn by hand
+        SeatSlot.objects.create(tournament=other).seats.set(
+            [self.seats[(0, 0)], self.seats[(1, 0)]]
+        )
+        self.drawn = SeatSlot.objects.create(tournament=self.tournament)
+        self.drawn.seats.set([self.seats[(4, 1)], self.seats[(5, 1)]])
+
+        self.teams = [
+            Team.objects.create(name=f"Team {i}", tournament=self.tournament, validated=True)
+            for i in range(3)
+        ]
+        self.not_validated = Team.objects.create(name="Late", tournament=self.tournament)
+        user = User.objects.create_user(username="manager", email="manager@example.net")
+        Manager.objects.create(user=user, team=self.teams[1])
+
+    def slot_coords(self, team: Team) -> set[tuple[int, int]]:
+        """Coordinates of the seats of the slot of a team"""
+        team.refresh_from_db()
+        assert team.seat_slot is not None
+        return {(seat.x, seat.y) for seat in team.seat_slot.seats.all()}
+
+    def test_allocate_seats(self) -> None:
+        """Test that the validated teams are seated with a few queries"""
+        # Lock of the event, slots, free slots, kept seats, teams, seats, then
+        # one insertion of the slots, one of their seats, one cleanup and one
+        # insertion of the kept seats and one update of the teams, in a
+        # savepoint
+        with self.assertNumQueries(13):
+            result = allocate_seats(self.tournament)
+
+        self.assertEqual((result.placed, result.unplaced), (3, 0))
+        # The team with a manager is placed first, on the slot drawn by hand,
+        # and (3, 1) is kept for its manager
+        self.assertEqual(self.slot_coords(self.teams[1]), {(4, 1), (5, 1)})
+        self.assertEqual(self.slot_coords(self.teams[0]), {(0, 1), (1, 1)})
+        self.assertEqual(self.slot_coords(self.teams[2]), {(2, 0), (3, 0)})
+        self.not_validated.refresh_from_db()
+        self.assertIsNone(self.not_validated.seat_slot)
+
+        # Seated teams keep their seats
+        self.assertEqual(allocate_seats(self.tournament).placed, 0)
+
+    def test_spares_kept(self) -> None:
+        """Test that the seats kept for managers stay free in the next allocations"""
+        allocate_seats(self.tournament)
+        self.teams[1].refresh_from_db()
+        assert self.teams[1].seat_slot is not None
+        kept = {(seat.x, seat.y) for seat in self.teams[1].seat_slot.spare_seats.all()}
+        self.assertEqual(kept, {(3, 1)})
+
+        # Teams validated later are not seated on the kept seat
+        late = [
+            Team.objects.create(name=f"Late {i}", tournament=self.tournament, validated=True)
+            for i in range(2)
+        ]
+        result = allocate_seats(self.tournament)
+        self.assertEqual((result.placed, result.unplaced), (1, 1))
+        self.assertEqual(self.slot_coords(late[0]), {(4, 0), (5, 0)})
+
+    def test_admin_action(self) -> None:
+        """Test the admin action seating the teams of tournaments"""
+        Team.objects.create(name="Team 4", tournament=self.tournament, validated=True)
+        Team.objects.create(name="Team 5", tournament=self.tournament, validated=True)
+        admin_user = User.objects.create_superuser("admin@example.net", "admin", "password")
+        self.client.force_login(admin_user)
+
+        response = self.client.post(
+            reverse("admin:tournament_eventtournament_changelist"),
+            {"action": "allocate_seats_action", ACTION_CHECKBOX_NAME: [self.tournament.id]},
+            follow=True,
+        )
+
+        self.assertContains(response, "4 équipes placées, 1 sans place")
+        self.assertEqual(
+            Team.objects.filter(tournament=self.tournament, seat_slot__isnull=False).count(), 4
+        )
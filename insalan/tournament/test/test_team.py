@@ -1,10 +1,16 @@
 """Tournament Team Module Tests"""
 
+import re
 from datetime import date
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.db import connection
 from django.db.utils import IntegrityError
 from django.contrib.auth.hashers import make_password
 from django.core.exceptions import ValidationError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.html import escape
 
 from insalan.tournament.models import (
     PaymentStatus,
@@ -14,10 +20,12 @@ from insalan.tournament.models import (
     Team,
     EventTournament,
     Event,
+    PrivateTournament,
     Game,
     SeatSlot,
     Seat
 )
+from insalan.testing import asgi_body
 from insalan.user.models import User
 
 class TeamTestCase(TestCase):
@@ -836,3 +844,123 @@ class TournamentTeamEndpoints(TestCase):
             format="json",
         )
         self.assertEqual(request.status_code, 403)
+
+
+class TeamAdminChangelistTestCase(TestCase):
+    """
+    Tests of the admin changelists of the teams and their members
+    """
+
+    def setUp(self) -> None:
+        """
+        Create a tournament and log an admin in
+        """
+        self.event = Event.objects.create(
+            name="Insalan Admin",
+            date_start=date(2023, 2, 1),
+            date_end=date(2023, 2, 2),
+            description="",
+        )
+        self.game = Game.objects.create(name="Admin Game", players_per_team=3)
+        self.trnm = EventTournament.objects.create(
+            event=self.event, game=self.game, name="Admin Tournament",
+        )
+        admin_user = User.objects.create_superuser("admin@example.net", "admin", "password")
+        self.client.force_login(admin_user)
+        self.users = 0
+
+    def add_team(self, validated: bool = True) -> Team:
+        """Add a team of two players to the tournament"""
+        team = Team.objects.create(
+            name=f"Team {Team.objects.count()}", tournament=self.trnm, validated=validated
+        )
+        for _ in range(2):
+            self.users += 1
+            user = User.objects.create_user(
+                username=f"user{self.users}", email=f"user{self.users}@example.net"
+            )
+            Player.objects.create(team=team, user=user)
+        return team
+
+    def count_queries(self, url: str) -> int:
+        """Number of queries of a changelist"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_queries_do_not_depend_on_rows(self) -> None:
+        """Test that the changelists do not query the database per row"""
+        urls = [
+            reverse("admin:tournament_team_changelist"),
+            reverse("admin:tournament_player_changelist"),
+            reverse("admin:tournament_eventtournament_changelist"),
+            reverse("admin:user_user_changelist"),
+        ]
+        self.add_team()
+        counts = [self.count_queries(url) for url in urls]
+        for _ in range(3):
+            self.add_team()
+        self.assertEqual([self.count_queries(url) for url in urls], counts)
+
+    def test_columns(self) -> None:
+        """Test the annotated columns of the changelists"""
+        team = self.add_team()
+        self.add_team(validated=False)
+
+        response = self.client.get(reverse("admin:tournament_team_changelist"))
+        self.assertContains(response, "2 / 3", count=2)
+        # The tournaments are shown with their event
+        self.assertContains(response, escape(str(self.trnm)), count=2)
+
+        response = self.client.get(reverse("admin:tournament_player_changelist"))
+        self.assertContains(response, escape(str(team)), count=2)
+
+        response = self.client.get(reverse("admin:tournament_eventtournament_changelist"))
+        self.assertContains(response, f"1 / {self.trnm.get_max_team()}")
+
+        response = self.client.get(reverse("admin:user_user_changelist"))
+        registrations = re.findall(
+            r'field-get_number_of_registration[^>]*>(\d+)</td>', response.content.decode()
+        )
+        self.assertEqual(sorted(registrations), ["0", "1", "1", "1", "1"])
+
+    def export(self, model: str, ids: list[int]) -> tuple[list[str], int]:
+        """Export registrations, return the lines and the number of queries"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse(f"admin:tournament_{model}_changelist"),
+                {"action": "export_registrations", ACTION_CHECKBOX_NAME: ids},
+            )
+            # Sent the way the ASGI server does
+            content = asgi_body(response).decode()
+        self.assertEqual(response.status_code, 200)
+        return content.splitlines(), len(queries)
+
+    def test_export_registrations(self) -> None:
+        """Test that the registrations are exported with a constant number of queries"""
+        self.add_team()
+        lines, queries = self.export("player", list(Player.objects.values_list("id", flat=True)))
+        self.assertEqual(lines[0], (
+            "id;utilisateur;courriel;pseudo en jeu;équipe;tournoi;évènement;statut de paiement"
+        ))
+        self.assertEqual(lines[1].split(";")[4:], [
+            "Team 0", "Admin Tournament", "Insalan Admin", "Pas payé"
+        ])
+
+        private = PrivateTournament.objects.create(name="Private", game=self.game)
+        team = self.add_team()
+        team.tournament = private
+        team.save()
+        lines, more_queries = self.export(
+            "player", list(Player.objects.values_list("id", flat=True))
+        )
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(queries, more_queries)
+        self.assertEqual(lines[-1].split(";")[4:7], ["Team 1", "Private", ""])
+
+        manager = Manager.objects.create(user=User.objects.get(username="user1"), team=team)
+        lines, _ = self.export("manager", [manager.id])
+        self.assertEqual(lines[1].split(";")[1:7], [
+            "user1", "user1@example.net", "", "Team 1", "Private", ""
+        ])
@@ -12,6 +12,7 @@ urlpatterns = [
         views.EventDetailsSomeDeref.as_view(),
         name="event/details-tournaments",
     ),
+    path("event/<int:pk>/seats/", views.EventSeatMap.as_view(), name="event/seat-map"),
     path("event/year/<int:year>/", views.EventByYear.as_view(), name="event/by-year"),
     path("game/", views.GameList.as_view(), name="game/list"),
     path("game/<int:pk>/", views.GameDetails.as_view(), name="game/details"),
@@ -2,6 +2,8 @@ from typing import Any
 
 from django.db.models.query import QuerySet
 from django.http import Http404
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from django.utils.translation import gettext_lazy as _
 
 from drf_yasg.utils import swagger_auto_schema  # type: ignore[import]
@@ -12,6 +14,7 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 
 from insalan.tournament import serializers
+from insalan.tournament.manage import cached_seat_map
 
 from ..models import Event, EventTournament
 from .permissions import ReadOnly
@@ -256,6 +259,108 @@ class EventDetailsSomeDeref(generics.RetrieveAPIView[Any]):
         return Response(event_serialized, status=status.HTTP_200_OK)
 
 
+class EventSeatMap(generics.GenericAPIView[Event]):  # pylint: disable=unsubscriptable-object
+    """
+    Seat map of an event, encoded as the bounds of the grid, a bitmap of the
+    seats and the ranges of seats of every slot
+    """
+
+    queryset = Event.objects.all()
+    permission_classes = [permissions.AllowAny]
+
+    # The decorator is missing types stubs.
+    @swagger_auto_schema(  # type: ignore[misc]
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "x": openapi.Schema(
+                        type=openapi.TYPE_INTEGER,
+                        description=_("Abscisse de la première colonne de la grille")
+                    ),
+                    "y": openapi.Schema(
+                        type=openapi.TYPE_INTEGER,
+                        description=_("Ordonnée de la première ligne de la grille")
+                    ),
+                    "width": openapi.Schema(
+                        type=openapi.TYPE_INTEGER,
+                        description=_("Largeur de la grille")
+                    ),
+                    "height": openapi.Schema(
+                        type=openapi.TYPE_INTEGER,
+                        description=_("Hauteur de la grille")
+                    ),
+                    "seats": openapi.Schema(
+                        type=openapi.TYPE_STRING,
+                        description=_(
+                            "Bitmap des places de la grille, ligne par ligne, en base64"
+                        )
+                    ),
+                    "slots": openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                "id": openapi.Schema(
+                                    type=openapi.TYPE_INTEGER,
+                                    description=_("ID du slot")
+                                ),
+                                "tournament": openapi.Schema(
+                                    type=openapi.TYPE_INTEGER,
+                                    description=_("ID du tournoi")
+                                ),
+                                "team": openapi.Schema(
+                                    type=openapi.TYPE_INTEGER,
+                                    description=_("ID de l'équipe placée sur le slot")
+                                ),
+                                "seats": openapi.Schema(
+                                    type=openapi.TYPE_ARRAY,
+                                    items=openapi.Schema(
+                                        type=openapi.TYPE_ARRAY,
+                                        items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                                    ),
+                                    description=_(
+                                        "Intervalles [début, fin[ des numéros des places"
+                                    )
+                                ),
+                            }
+                        )
+                    ),
+                }
+            ),
+            304: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                description=_("Plan inchangé depuis l'ETag donné")
+            ),
+            404: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "err": openapi.Schema(
+                        type=openapi.TYPE_STRING,
+                        description=_("Évènement introuvable")
+                    )
+                }
+            ),
+        }
+    )
+    def get(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        """
+        Get the seat map of an event
+        """
+        event = self.get_object()
+        seat_map, etag = cached_seat_map(event.id)
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        # Weak comparison, as required for If-None-Match
+        if "*" in if_none_match or etag in (tag.removeprefix("W/") for tag in if_none_match):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(seat_map, status=status.HTTP_200_OK)
+        response["ETag"] = etag
+        # Seating plans are edited during the event, always revalidate
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
 class EventByYear(generics.ListAPIView[Event]):  # pylint: disable=unsubscriptable-object
     """Get all of the events of a year"""
 
@@ -2,7 +2,7 @@ from typing import Any
 
 from django.db.models.query import QuerySet
 from django.contrib.auth.hashers import check_password
-from django.core.exceptions import PermissionDenied, BadRequest
+from django.core.exceptions import PermissionDenied, BadRequest, ValidationError
 from django.http import QueryDict
 from django.utils.translation import gettext_lazy as _
 
@@ -114,7 +114,14 @@ class PlayerRegistration(generics.RetrieveAPIView[Player]):
             }, status=status.HTTP_403_FORBIDDEN)
 
         if "name_in_game" in data:
-            player_data = valid_name(player.team.tournament.game, data["name_in_game"])
+            try:
+                player_data = valid_name(player.team.tournament.game, data["name_in_game"])
+            except ValidationError as err:
+                # The name could not be checked, not found invalid
+                return Response(
+                    {"name_in_game": err.messages},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
             if player_data is None:
                 return Response(
                     {"name_in_game": _("Pseudo invalide")},
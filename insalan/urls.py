@@ -75,5 +75,5 @@ if not int(getenv("DEV", "1")):
 # Set admin site url correctly for the admin panel
 admin.site.site_url = getenv("HTTP_PROTOCOL", "http") + "://" + getenv("WEBSITE_HOST", "localhost")
 
-scheduler.start()
 start_job()
+scheduler.start()
@@ -6,6 +6,7 @@ import copy
 from typing import Any
 
 from django import forms
+from django.db.models import Count
 from django.db.models.query import QuerySet
 from django.contrib import admin, messages
 from django.contrib.admin import SimpleListFilter
@@ -25,7 +26,6 @@ from unfold.forms import AdminPasswordChangeForm, UserChangeForm, UserCreationFo
 
 from insalan.mailer import MailManager
 from insalan.settings import EMAIL_AUTH
-from insalan.tournament.models import Player, Manager, Substitute
 from insalan.utils import FieldOpts, FieldSets
 
 from .models import User
@@ -163,10 +163,16 @@ class CustomUserAdmin(DjangoUserAdmin):
             return self.fieldsets
         return super().get_fieldsets(request, obj)
 
+    def get_queryset(self, request: HttpRequest) -> QuerySet[User]:
+        """Count the registrations of every user of the page at once"""
+        return super().get_queryset(request).annotate(  # type: ignore[no-any-return]
+            registrations=Count("player", distinct=True)
+            + Count("manager", distinct=True)
+            + Count("substitute", distinct=True)
+        )
+
     def get_number_of_registration(self, obj: User) -> int:
-        return Player.objects.filter(user=obj).count() + \
-               Manager.objects.filter(user=obj).count() + \
-               Substitute.objects.filter(user=obj).count()
+        return obj.registrations  # type: ignore[attr-defined,no-any-return]
     get_number_of_registration.short_description = (  # type: ignore[attr-defined]
         'Number of registrations'
     )
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "insalan.settings")
 
 application = get_wsgi_application()
+
+# pylint: disable-next=wrong-import-position
+from insalan import scheduler
+
+# Only the server runs the periodic jobs, not the management commands
+scheduler.start_election()